@@ -0,0 +1,136 @@
+"""单一输出流音频引擎：Mixer 分块混音后推送到一个 QAudioSink"""
+from PySide6.QtCore import QObject, QThread, QTimer, Qt, Slot, QMetaObject
+from PySide6.QtMultimedia import QAudioFormat, QAudioSink, QMediaDevices
+
+from mixer import Mixer, decode_audio_file
+
+
+class AudioEngine(QObject):
+    """
+    在独立线程中运行的音频引擎。
+
+    界面线程只调用 note_on/note_off（写入 Mixer 的无锁命令队列），
+    引擎线程用精确定时器检查输出缓冲空闲量，按块混音并以推模式写入 QAudioSink。
+    """
+
+    def __init__(self, sample_rate=48000, channels=2, block_frames=256, max_voices=32, volume=0.8,
+                 velocity_exponent=1.0):
+        super().__init__()
+        self.mixer = Mixer(sample_rate, channels, max_voices=max_voices, volume=volume,
+                           velocity_exponent=velocity_exponent)
+        self.block_frames = block_frames
+        self.block_bytes = block_frames * channels * 2
+        self.sink = None
+        self.io = None
+        self.timer = None
+        self.sources = {}  # MIDI编号 -> 已加载的音频文件路径
+        self.bank = None
+        self.residency = None  # 可选的采样常驻策略
+        self.trace = None  # 延迟追踪回调 trace(midi)，在含首个非零采样的块写入设备后调用
+        self.format = QAudioFormat()
+        self.format.setSampleRate(sample_rate)
+        self.format.setChannelCount(channels)
+        self.format.setSampleFormat(QAudioFormat.SampleFormat.Int16)
+        self.device = QMediaDevices.defaultAudioOutput()
+        self.worker_thread = QThread()
+        self.worker_thread.setObjectName("AudioEngine")
+
+    @property
+    def available(self):
+        """是否存在可用的输出设备"""
+        return not self.device.isNull() and self.device.isFormatSupported(self.format)
+
+    def start(self):
+        if not self.available:
+            return False
+        self.moveToThread(self.worker_thread)
+        self.worker_thread.started.connect(self._setup)
+        self.worker_thread.start(QThread.Priority.TimeCriticalPriority)
+        return True
+
+    def stop(self):
+        if self.residency is not None:
+            self.residency.shutdown()
+        if self.worker_thread.isRunning():
+            QMetaObject.invokeMethod(self, "_teardown", Qt.ConnectionType.BlockingQueuedConnection)
+            self.worker_thread.quit()
+            self.worker_thread.wait()
+
+    @Slot()
+    def _setup(self):
+        """在引擎线程内创建输出设备，保证 QAudioSink 与定时器同线程"""
+        self.sink = QAudioSink(self.device, self.format)
+        # 约4个混音块的设备缓冲，兼顾延迟与抗抖动
+        self.sink.setBufferSize(self.block_bytes * 4)
+        self.io = self.sink.start()
+        self.timer = QTimer()
+        self.timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.timer.setInterval(max(1, int(self.block_frames * 1000 / self.mixer.sample_rate / 2)))
+        self.timer.timeout.connect(self._pump)
+        self.timer.start()
+
+    @Slot()
+    def _teardown(self):
+        if self.timer is not None:
+            self.timer.stop()
+        if self.sink is not None:
+            self.sink.stop()
+        self.io = None
+
+    def _pump(self):
+        """把输出缓冲填满，每次写入一个混音块"""
+        if self.io is None:
+            return
+        while self.sink.bytesFree() >= self.block_bytes:
+            self.io.write(self.mixer.render_int16(self.block_frames))
+            if self.mixer.first_output:
+                for midi in self.mixer.first_output:
+                    if self.trace is not None:
+                        self.trace(midi)
+                self.mixer.first_output.clear()
+
+    # ---- 采样加载 ----
+    def load_note(self, midi, sound_file):
+        """解码并登记音符采样，成功返回True"""
+        if self.sources.get(midi) == sound_file and self.mixer.has_sample(midi):
+            return True
+        try:
+            self.mixer.set_sample(midi, decode_audio_file(sound_file, self.mixer.sample_rate))
+        except Exception as e:
+            print(f"音频解码失败：{sound_file}，错误：{str(e)}")
+            return False
+        self.sources[midi] = sound_file
+        return True
+
+    def load_bank(self, bank):
+        """登记采样库中的全部音符及其力度层（引用视图，不复制数据）"""
+        self.bank = bank
+        self.sources.clear()
+        self.mixer.clear_layers()
+        for midi in bank.notes():
+            self.mixer.set_sample(midi, bank.get(midi))
+        for midi in bank.layered_notes():
+            self.mixer.set_layers(midi, bank.layers(midi))
+
+    def has_sample(self, midi):
+        return self.mixer.has_sample(midi)
+
+    def is_loading(self, midi):
+        """该音符是否仍在后台解码中"""
+        return self.bank is not None and self.bank.is_loading(midi)
+
+    # ---- 演奏控制（任意线程可调用） ----
+    def note_on(self, midi, velocity=127):
+        self.mixer.note_on(midi, velocity)
+        if self.residency is not None:
+            self.residency.touch(midi)
+
+    def note_off(self, midi):
+        """松键；踏板保持的音符由混音器推迟到抬起踏板时释放"""
+        self.mixer.note_off(midi)
+
+    def control_change(self, controller, value):
+        self.mixer.control_change(controller, value)
+
+    def set_volume(self, volume):
+        self.mixer.set_volume(volume)
@@ -0,0 +1,220 @@
+"""
+按键到发声延迟基准测试。
+
+在离屏Qt平台上构造 PianoWidget，合成键盘 QKeyEvent 与 rtmidi 风格的回调，
+记录各阶段时间戳并按后端/格式输出 p50/p95/p99 与抖动：
+
+    dispatch  事件进入 keyPressEvent/handle_midi_note 后到达 PianoKeyItem.press
+    press     进入 PianoKey.press
+    engine    音频引擎启动（AudioEngine.note_on / QSoundEffect.play / QMediaPlayer.play）
+    audible   首个非零采样写入设备（混音引擎）；Qt后端以播放状态信号近似
+
+用法：
+    python benchmark_latency.py --backend mixer --backend qt --format wav --format m4a --repeat 20
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtCore import QEvent, Qt
+from PySide6.QtGui import QKeyEvent
+from PySide6.QtMultimedia import QMediaPlayer, QSoundEffect
+from PySide6.QtWidgets import QApplication
+
+from note_tables import NOTE_TO_MIDI
+from pianist import PianoWidget
+
+STAGES = ['dispatch', 'press', 'engine', 'audible']
+# 默认测试音符：C4 附近的白键与黑键
+DEFAULT_NOTES = ['C4', 'C#4', 'E4', 'G4', 'A#4', 'C5']
+
+
+def now():
+    return time.perf_counter_ns()
+
+
+class LatencyProbe:
+    """为单个事件收集各阶段时间戳"""
+
+    def __init__(self):
+        self.stamps = {}
+
+    def begin(self):
+        self.stamps = {'event': now()}
+
+    def mark(self, stage):
+        # 同一阶段只记录第一次
+        if 'event' in self.stamps and stage not in self.stamps:
+            self.stamps[stage] = now()
+
+    def deltas_ms(self):
+        start = self.stamps['event']
+        return {stage: (self.stamps[stage] - start) / 1e6 for stage in STAGES if stage in self.stamps}
+
+
+def wrap(obj, name, before):
+    """在实例上包装方法，调用原方法前先执行 before()"""
+    original = getattr(obj, name)
+
+    def wrapper(*args, **kwargs):
+        before()
+        return original(*args, **kwargs)
+
+    setattr(obj, name, wrapper)
+
+
+def instrument(widget, probe):
+    """在琴键、音频引擎和Qt播放器上挂接阶段探针"""
+    for item in widget.all_items:
+        wrap(item, 'press', lambda: probe.mark('dispatch'))
+        key = item.key_widget
+        wrap(key, 'press', lambda: probe.mark('press'))
+        sound = key.sound
+        if isinstance(sound, QSoundEffect):
+            wrap(sound, 'play', lambda: probe.mark('engine'))
+            sound.playingChanged.connect(lambda s=sound: s.isPlaying() and probe.mark('audible'))
+        elif isinstance(sound, QMediaPlayer):
+            wrap(sound, 'play', lambda: probe.mark('engine'))
+            sound.positionChanged.connect(lambda pos: pos > 0 and probe.mark('audible'))
+    engine = widget.audio_engine
+    if engine is not None:
+        wrap(engine, 'note_on', lambda: probe.mark('engine'))
+        engine.mixer.tracing = True
+        engine.trace = lambda midi: probe.mark('audible')
+
+
+def key_event(widget, note, press=True):
+    """按键位映射为音符构造 QKeyEvent，并切换到对应音程"""
+    binding = widget.key_map.get(note)
+    if binding is None:
+        return None
+    shift = binding.startswith('Shift+')
+    text = binding[6:] if shift else binding
+    letter, octave = text[:-1], int(text[-1])
+    widget.current_octave = octave
+    key = getattr(Qt.Key, f"Key_{letter}", Qt.Key.Key_unknown)
+    modifiers = Qt.KeyboardModifier.ShiftModifier if shift else Qt.KeyboardModifier.NoModifier
+    event_type = QEvent.Type.KeyPress if press else QEvent.Type.KeyRelease
+    return QKeyEvent(event_type, key, modifiers, letter.lower())
+
+
+def wait_until(app, predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        app.processEvents()
+        if predicate():
+            return True
+        time.sleep(0.0005)
+    return False
+
+
+def wait_for_samples(app, widget, timeout=120):
+    """等待冷启动后台解码完成"""
+    engine = widget.audio_engine
+    if engine is None:
+        return
+    wait_until(app, lambda: not any(engine.is_loading(item.key_widget.midi) for item in widget.all_items), timeout)
+
+
+def run_case(app, backend, file_format, source, notes, repeat, settle):
+    config = PianoWidget.load_config()
+    config.update({'audio_backend': backend, 'file_format': file_format})
+    widget = PianoWidget(config=config)
+    try:
+        wait_for_samples(app, widget)
+        probe = LatencyProbe()
+        instrument(widget, probe)
+        results = {stage: [] for stage in STAGES}
+        for _ in range(repeat):
+            for note in notes:
+                midi = NOTE_TO_MIDI[note]
+                if source == 'keyboard':
+                    event = key_event(widget, note)
+                    if event is None:
+                        continue
+                    probe.begin()
+                    QApplication.sendEvent(widget, event)
+                else:
+                    probe.begin()
+                    widget.midi_input.callback(([0x90, midi, 100], 0.0))
+                wait_until(app, lambda: 'audible' in probe.stamps, settle)
+                for stage, value in probe.deltas_ms().items():
+                    results[stage].append(value)
+                if source == 'keyboard':
+                    QApplication.sendEvent(widget, key_event(widget, note, press=False))
+                else:
+                    widget.midi_input.callback(([0x80, midi, 0], 0.0))
+                wait_until(app, lambda: False, settle / 4)
+        return results
+    finally:
+        widget.cleanup()
+        widget.deleteLater()
+        app.processEvents()
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(results):
+    summary = {}
+    for stage, values in results.items():
+        if not values:
+            continue
+        summary[stage] = {
+            'n': len(values),
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99),
+            'jitter': statistics.pstdev(values),
+        }
+    return summary
+
+
+def print_report(rows):
+    print(f"{'backend':<8}{'format':<7}{'input':<10}{'stage':<10}{'n':>5}{'p50':>10}{'p95':>10}{'p99':>10}{'jitter':>10}")
+    for (backend, file_format, source), summary in rows:
+        for stage in STAGES:
+            if stage not in summary:
+                continue
+            s = summary[stage]
+            print(f"{backend:<8}{file_format:<7}{source:<10}{stage:<10}{s['n']:>5}"
+                  f"{s['p50']:>10.3f}{s['p95']:>10.3f}{s['p99']:>10.3f}{s['jitter']:>10.3f}")
+    print("（单位：毫秒，均相对于事件合成时刻）")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pianist 按键到发声延迟基准测试")
+    parser.add_argument('--backend', action='append', choices=['mixer', 'qt'], help="音频后端，可重复指定")
+    parser.add_argument('--format', action='append', choices=['wav', 'flac', 'm4a', 'mp3', 'ogg'], help="音频格式，可重复指定")
+    parser.add_argument('--input', action='append', choices=['keyboard', 'midi'], help="输入方式，可重复指定")
+    parser.add_argument('--note', action='append', help="测试音符（如 C4），可重复指定")
+    parser.add_argument('--repeat', type=int, default=10, help="每个音符重复次数")
+    parser.add_argument('--settle', type=float, default=0.5, help="每次按键等待发声的最长秒数")
+    parser.add_argument('--json', help="把结果另存为JSON文件")
+    args = parser.parse_args(argv)
+
+    notes = [note for note in (args.note or DEFAULT_NOTES) if note in NOTE_TO_MIDI]
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    rows = []
+    for backend in args.backend or ['mixer', 'qt']:
+        for file_format in args.format or ['m4a']:
+            for source in args.input or ['keyboard', 'midi']:
+                results = run_case(app, backend, file_format, source, notes, args.repeat, args.settle)
+                rows.append(((backend, file_format, source), summarize(results)))
+    print_report(rows)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump([{'backend': b, 'format': fmt, 'input': src, 'stages': summary}
+                       for (b, fmt, src), summary in rows], f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,17 @@
 import numpy as np
 from scipy.io import wavfile
-from scipy.signal import butter, lfilter, firwin
+from scipy.signal import butter, lfilter, firwin, sosfilt
+from scipy import fft as sp_fft
 from pydub import AudioSegment
 from pydub.effects import normalize, compress_dynamic_range
 import os
+import re
+import hashlib
+import json
+from functools import lru_cache
 import numba as nb
 from multiprocessing import Pool
+from sample_bank import BASE_VELOCITY, MANIFEST_NAME, MANIFEST_VERSION, layer_key
 import tempfile
 import subprocess
 import fluidsynth, wave
@@ -26,22 +32,30 @@ DURATION = 3.5  # 延长持续时间 音频持续时间毫秒
 # 物理建模参数
 HAMMER_HARDNESS = 0.9  # 琴槌硬度系数
 STRING_LOSS = 1.2  # 琴弦能量损耗
-ffmpeg_version = '4.0' #'6.1.1_2'
+BANK_SEED = 0  # 音色库随机种子，每个音符的种子由它与MIDI编号派生；None 表示不固定
+# 力度层：力度越大琴槌越硬、截止频率越高；DEFAULT_VELOCITY 层即不带力度后缀的基础采样
+DEFAULT_VELOCITY = BASE_VELOCITY
+VELOCITY_HARDNESS = 0.6  # 力度从默认到127时琴槌硬度增加 0.6*(127-默认)/127
+VELOCITY_BRIGHTNESS = 1.5  # 力度从0到127时截止频率变化的倍频程数
+SYNTHESIS = 'direct'  # 谐波合成方式：direct（逐采样正弦）、ifft（逆FFT叠加）或 stream（流式分块，仅构建音色库）
 
 def check_ffmpeg_version():
-    result = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True)
-    print(result.stdout.split('\n')[0])  # 打印FFmpeg版本信息
+    capabilities = probe_ffmpeg()
+    if capabilities is None:
+        print("未找到ffmpeg")
+        return
+    print(f"FFmpeg 版本: {capabilities['version']}，FLAC采样格式: {capabilities['sample_formats']}")
 
-@nb.njit(nb.float64[:](nb.float64[:], nb.float64, nb.int64), fastmath=True)
-def generate_harmonics(t, frequency, midi_number):
-    """类型明确的谐波生成函数"""
+@nb.njit(nb.float64[:](nb.float64[:], nb.float64, nb.int64, nb.float64[:]), fastmath=True)
+def generate_harmonics(t, frequency, midi_number, jitter):
+    """类型明确的谐波生成函数，jitter 为2~15次谐波的频率抖动（标准正态，由 note_randomness 提供）"""
     harmonics = np.zeros_like(t)  # 明确使用float64类型
 
     fundamental_amp = 1.0 - (midi_number - 21) / 87 * 0.3
     harmonics = harmonics + fundamental_amp * np.sin(2 * np.pi * frequency * t)
 
     for n in range(2, 16):
-        freq_mult = n + 0.2 * np.random.randn()
+        freq_mult = n + 0.2 * jitter[n - 2]
         amp = (1.0 / (n ** 1.2)) * (0.9 ** (midi_number / 12))
         amp *= 1.0 - 0.1 * (n % 3)
         # 使用显式赋值代替 +=
@@ -56,28 +70,126 @@ def generate_harmonics(t, frequency, midi_number):
     return harmonics * 0.8 + inharmonic * 0.2
 
 
-def physical_hammer_model(wave, midi_number):
+def velocity_hardness(velocity):
+    """力度对琴槌硬度的修正量，默认力度为0"""
+    return VELOCITY_HARDNESS * (velocity - DEFAULT_VELOCITY) / 127
+
+
+def physical_hammer_model(wave, midi_number, velocity=DEFAULT_VELOCITY):
     """琴槌物理特性模拟"""
-    hardness = HAMMER_HARDNESS + (midi_number - 60) / 60 * 0.2
+    hardness = HAMMER_HARDNESS + (midi_number - 60) / 60 * 0.2 + velocity_hardness(velocity)
     wave = np.sign(wave) * np.abs(wave) ** (1 + hardness)
     return wave * 0.9 / np.max(np.abs(wave))
 
-def butter_lowpass(cutoff, order=5):
-    """设计巴特沃斯低通滤波器"""
-    nyq = 0.5 * SAMPLE_RATE  # 奈奎斯特频率
+@lru_cache(maxsize=None)
+def butter_lowpass(cutoff, order=5, sample_rate=SAMPLE_RATE):
+    """设计巴特沃斯低通滤波器（二阶节形式，按 截止频率/阶数/采样率 缓存）"""
+    nyq = 0.5 * sample_rate  # 奈奎斯特频率
     normal_cutoff = np.clip(cutoff / nyq, 0.001, 0.999)  # 确保截止频率有效
-    b, a = butter(order, normal_cutoff, btype='low', analog=False)
-    return b, a
+    return butter(order, normal_cutoff, btype='low', analog=False, output='sos')
 
 def lowpass_filter(data, cutoff, order=5):
-    """应用低通滤波器"""
-    b, a = butter_lowpass(cutoff, order=order)
-    y = lfilter(b, a, data)
-    return y
+    """应用低通滤波器，data 可为多行音符，沿最后一维滤波"""
+    return sosfilt(butter_lowpass(float(cutoff), order), data, axis=-1)
+
+
+def piano_equalizer(midi_number, velocity=DEFAULT_VELOCITY):
+    """动态均衡：低音区5kHz低通并增强1.2倍，高音区截止频率随音高下降（高频滚降）；力度越大截止频率越高"""
+    if midi_number < 60:
+        cutoff, gain = 5000, 1.2
+    else:
+        cutoff, gain = 10000 - (midi_number - 60) * 100, 1.0
+    cutoff *= 2 ** (VELOCITY_BRIGHTNESS * (velocity - DEFAULT_VELOCITY) / 127)
+    return min(cutoff, NYQUIST * 0.99), gain
+
+
+class LowpassStage:
+    """按音符与力度选择截止频率与增益的低通滤波级，design(midi, velocity) -> (截止频率, 增益)"""
+
+    def __init__(self, design, order=5):
+        self.design = design
+        self.order = order
+
+    def __call__(self, data, midi_numbers, velocities=None):
+        """
+        对 (音符数, 采样数) 的数组原地滤波；设计相同的音符行共用一份二阶节设计。
+        逐行滤波并写回：sosfilt 以float64计算，整组一次滤波会产生整组大小的临时数组。
+        """
+        if velocities is None:
+            velocities = [DEFAULT_VELOCITY] * len(midi_numbers)
+        groups = {}
+        for row, (midi_number, velocity) in enumerate(zip(midi_numbers, velocities)):
+            groups.setdefault(self.design(midi_number, velocity), []).append(row)
+        for (cutoff, gain), rows in groups.items():
+            sos = butter_lowpass(float(cutoff), self.order)
+            for row in rows:
+                filtered = sosfilt(sos, data[row])
+                if gain != 1.0:
+                    filtered *= gain
+                data[row] = filtered
+        return data
+
+    def stream(self, midi_number, velocity=DEFAULT_VELOCITY):
+        """返回逐块滤波的函数，二阶节状态在块之间延续"""
+        cutoff, gain = self.design(midi_number, velocity)
+        sos = butter_lowpass(float(cutoff), self.order)
+        state = np.zeros((sos.shape[0], 2))
+
+        def process(block):
+            nonlocal state
+            block, state = sosfilt(sos, block, zi=state)
+            return block * gain if gain != 1.0 else block
+        return process
+
+
+class FilterChain:
+    """可复用的滤波流水线：依次应用各滤波级，单个音符传入一维波形即可"""
+
+    def __init__(self, *stages):
+        self.stages = list(stages)
+
+    def __call__(self, data, midi_numbers, velocities=None):
+        single = np.ndim(data) == 1
+        data = np.array(data, ndmin=2, copy=single)
+        for stage in self.stages:
+            data = stage(data, midi_numbers, velocities)
+        return data[0] if single else data
+
+    def stream(self, midi_number, velocity=DEFAULT_VELOCITY):
+        """单个音符的逐块滤波函数，各级状态独立延续"""
+        processors = [stage.stream(midi_number, velocity) for stage in self.stages]
+
+        def process(block):
+            for processor in processors:
+                block = processor(block)
+            return block
+        return process
+
+
+PIANO_FILTERS = FilterChain(LowpassStage(piano_equalizer))
 
-def generate_piano_note(midi_number):
+def note_rng(midi_number):
+    """由音色库种子与MIDI编号派生每个音符独立的随机数发生器，与进程、生成顺序无关"""
+    if BANK_SEED is None:
+        return np.random.default_rng()
+    return np.random.default_rng([BANK_SEED, midi_number])
+
+
+def note_randomness(midi_number):
+    """
+    每个音符的随机量：基频微偏（半音）与2~15次谐波的频率抖动。
+    按固定顺序抽取，逐采样（numba）、逆FFT与批量合成共用，保证同一种子输出一致。
+    """
+    rng = note_rng(midi_number)
+    detune = rng.uniform(-0.02, 0.02)
+    jitter = rng.standard_normal(14)
+    return detune, jitter
+
+
+def generate_piano_note(midi_number, synthesis=None, velocity=DEFAULT_VELOCITY):
+    detune, jitter = note_randomness(midi_number)
     # 计算基频
-    frequency = 440 * (2 ** ((midi_number - 69 + np.random.uniform(-0.02, 0.02)) / 12))
+    frequency = 440 * (2 ** ((midi_number - 69 + detune) / 12))
 
     # 验证基频范围
     if frequency <= 0 or frequency >= NYQUIST:
@@ -88,10 +200,13 @@ def generate_piano_note(midi_number):
     t = np.linspace(0, DURATION, int(SAMPLE_RATE * DURATION), dtype=np.float64)
 
     # 生成复合波形（包含动态谐波）
-    wave = generate_harmonics(t, frequency, midi_number)
+    if (synthesis or SYNTHESIS) == 'ifft':
+        wave = generate_harmonics_ifft(t, frequency, midi_number, jitter)
+    else:
+        wave = generate_harmonics(t, frequency, midi_number, jitter)
 
     # 琴槌物理建模
-    wave = physical_hammer_model(wave, midi_number)
+    wave = physical_hammer_model(wave, midi_number, velocity)
 
     # 高级ADSR包络
     attack = np.linspace(0, 1, int(SAMPLE_RATE * 0.005)) ** 3
@@ -113,17 +228,8 @@ def generate_piano_note(midi_number):
     #                   fs=SAMPLE_RATE, pass_zero=False)
     # wave = lfilter(low_pass, 1.0, wave)
 
-    # 动态均衡处理
-    if midi_number < 60:
-        # 低音区增强（保持原有逻辑）
-        cutoff = min(5000, NYQUIST * 0.99)
-        wave = lowpass_filter(wave, cutoff)
-        wave *= 1.2
-    else:
-        # 高音区高频滚降（修正FIR滤波器参数）
-        base_freq = 440 * (2 ** ((midi_number - 69) / 12))
-        cutoff = min(10000 - (midi_number - 60) * 100, NYQUIST * 0.99)
-        wave = lowpass_filter(wave, cutoff)
+    # 动态均衡处理（低音区增强，高音区高频滚降）
+    wave = PIANO_FILTERS(wave, [midi_number], [velocity])
 
     # 添加空间混响（立体声处理）
     left = wave * 0.9 + np.roll(wave, 500) * 0.1
@@ -138,44 +244,543 @@ def generate_piano_note(midi_number):
     return stereo_wave.astype(np.float32)
 
 
-def save_high_quality(wave, filename):
-    """修复后的高音质保存函数"""
+# ---- 批量生成：整块音符共享时间轴，按分音逐次向量化累加 ----
+HARMONIC_COUNT = 15
+INHARMONIC_COUNT = 3
+DEFAULT_MEMORY_LIMIT_MB = 512
+# 批量合成每行每采样的峰值内存：float32波形(4) + 立体声输出(8)，分音表与矩阵乘的分段表约1字节
+BATCH_BYTES_PER_SAMPLE = 13
+# 只有一行大小、与批大小无关的临时数组：sosfilt的float64结果(8) + 写回时的类型转换(4)
+# + 产出的立体声副本(8) + 立体声混响的 np.roll 与乘积(12)
+ROW_SCRATCH_BYTES_PER_SAMPLE = 32
+
+
+def adsr_envelope(length):
+    """与 generate_piano_note 相同的ADSR包络（所有音符共用）"""
+    attack = np.linspace(0, 1, int(SAMPLE_RATE * 0.005)) ** 3
+    decay = np.exp(-np.linspace(0, 5, int(SAMPLE_RATE * 0.2)))
+    release = np.exp(-np.linspace(0, 8, int(SAMPLE_RATE * 0.3)))
+    return np.concatenate((
+        attack,
+        decay * 0.7,
+        np.linspace(0.7, 0.4, int(SAMPLE_RATE * (DURATION - 0.505))),
+        release * 0.4
+    ))[:length].astype(np.float32)
+
+
+def batch_rows(length, memory_limit_mb=DEFAULT_MEMORY_LIMIT_MB):
+    """按内存上限计算每批音符数：扣除单行临时数组后，按每行峰值内存均分"""
+    budget = memory_limit_mb * 1024 * 1024 - length * ROW_SCRATCH_BYTES_PER_SAMPLE
+    return max(1, int(budget // (length * BATCH_BYTES_PER_SAMPLE)))
+
+
+def partial_table(midi, jitter):
+    """
+    分音表：基频 + 2~15次谐波（频率按 jitter 微偏，幅度按 0.9**(midi/12) 衰减），以及3个非谐波成分。
+    midi 为音符数组，jitter 形状为 (音符数, 14)；返回 (倍频, 幅度, 初相)，前两者形状为
+    (音符数, 分音数)，与 generate_harmonics 一致。
+    """
+    midi = np.asarray(midi, dtype=np.float64)
+    rows = len(midi)
+    harmonics = np.arange(2, HARMONIC_COUNT + 1)
+    multipliers = np.concatenate((
+        np.ones((rows, 1)),
+        harmonics + 0.2 * np.asarray(jitter).reshape(rows, len(harmonics)),
+        np.broadcast_to(1 + 0.03 * np.arange(1, INHARMONIC_COUNT + 1), (rows, INHARMONIC_COUNT)),
+    ), axis=1)
+    amps = np.concatenate((
+        (1.0 - (midi - 21) / 87 * 0.3)[:, None] * 0.8,
+        (1.0 / harmonics ** 1.2) * (0.9 ** (midi / 12))[:, None] * (1.0 - 0.1 * (harmonics % 3)) * 0.8,
+        np.full((rows, INHARMONIC_COUNT), 0.05 * 0.2),
+    ), axis=1)
+    offsets = np.concatenate((np.zeros(HARMONIC_COUNT), np.full(INHARMONIC_COUNT, np.pi / 4)))
+    return multipliers, amps, offsets
+
+
+def sum_partials(step, multipliers, amps, offsets, length, chunk_len=1024):
+    """
+    合成多行分音之和，返回 (音符数, length) 的float32数组。
+
+    第i个采样拆为 段号k × 段长 + 段内偏移j，利用 sin(a+b) = sin(a)cos(b) + cos(a)sin(b)，
+    所有分音之和即每行一次矩阵乘：[A·sin(a_k), A·cos(a_k)] @ [cos(b_j); sin(b_j)]。
+    三角函数只在两张小表上以float64求值（保证高音高次谐波的相位精度），整段波形由
+    float32批量矩阵乘一次写出，不再为每个分音分配整段数组。
+    """
+    chunks = -(-length // chunk_len)
+    omega = step * multipliers  # (音符数, 分音数) 每采样相位增量
+    outer = omega[:, None, :] * (np.arange(chunks) * chunk_len)[None, :, None] + offsets
+    inner = omega[:, :, None] * np.arange(chunk_len)
+    weights = amps[:, None, :]
+    left = np.concatenate((np.sin(outer) * weights, np.cos(outer) * weights), axis=2).astype(np.float32)
+    right = np.concatenate((np.cos(inner), np.sin(inner)), axis=1).astype(np.float32)
+    return np.matmul(left, right).reshape(len(omega), -1)[:, :length]
+
+
+def generate_piano_block(midi_numbers, t, envelope):
+    """
+    一次生成一组音符，返回 (音符数, 采样数, 2) 的float32数组。
+
+    音色与 generate_piano_note 相同，各音符成行共享时间轴，逐步骤原地处理。
+    """
+    midi = np.asarray(midi_numbers, dtype=np.float64)
+    rows, length = len(midi), len(t)
+    detune, jitter = zip(*(note_randomness(midi_number) for midi_number in midi_numbers))
+    frequency = 440 * (2 ** ((midi - 69 + np.array(detune)) / 12))
+    frequency = np.clip(frequency, 20, NYQUIST * 0.99)[:, None]
+    # 共享的等间距时间轴：第i个采样的相位 = 2πf·i·dt
+    step = 2 * np.pi * frequency * (t[1] - t[0])
+
+    multipliers, amps, offsets = partial_table(midi, np.array(jitter))
+    acc = sum_partials(step, multipliers, amps, offsets, length)
+    sign = np.empty_like(acc)
+
+    # 琴槌物理建模：sign(x)*|x|^(1+hardness)，逐行归一化
+    hardness = HAMMER_HARDNESS + (midi - 60) / 60 * 0.2
+    np.sign(acc, out=sign)
+    np.abs(acc, out=acc)
+    np.power(acc, (1 + hardness)[:, None].astype(np.float32), out=acc)
+    # |x|^p 非负，此时的逐行最大值即归一化所需的峰值，无需再分配 abs 临时数组
+    peak = acc.max(axis=1)
+    acc *= sign
+    del sign
+    acc *= (0.9 / peak)[:, None].astype(np.float32)
+
+    acc *= envelope
+    acc = PIANO_FILTERS(acc, midi_numbers)
+
+    stereo = np.empty((rows, length, 2), dtype=np.float32)
+    abnormal = False
+    for row, wave in enumerate(acc):
+        # 空间混响（立体声处理）
+        stereo[row, :, 0] = wave * 0.9 + np.roll(wave, 500) * 0.1
+        stereo[row, :, 1] = wave * 0.9 + np.roll(wave, 700) * 0.1
+        # 逐行检查，避免整块大小的 abs/isnan 临时数组
+        abnormal = abnormal or np.any(np.isnan(stereo[row])) or np.any(np.abs(stereo[row]) > 1.0)
+    del acc
+    if abnormal:
+        print(f"MIDI {midi_numbers[0]}~{midi_numbers[-1]} 数据异常，正在修正...")
+        for channels in stereo:
+            np.nan_to_num(channels, copy=False)
+            np.clip(channels, -0.99, 0.99, out=channels)
+    return stereo
+
+
+def generate_piano_notes_batched(midi_numbers=range(21, 109), memory_limit_mb=DEFAULT_MEMORY_LIMIT_MB):
+    """按内存上限分批生成，逐个产出 (midi, 立体声波形)"""
+    midi_numbers = list(midi_numbers)
+    t = np.linspace(0, DURATION, int(SAMPLE_RATE * DURATION), dtype=np.float64)
+    envelope = adsr_envelope(len(t))
+    rows = batch_rows(len(t), memory_limit_mb)
+    for start in range(0, len(midi_numbers), rows):
+        block = midi_numbers[start:start + rows]
+        stereo = generate_piano_block(block, t, envelope)
+        for row, midi in enumerate(block):
+            # 产出副本：调用方持有的行视图会让整块在生成下一块时仍驻留内存
+            yield midi, stereo[row].copy()
+        del stereo
+
+
+def generate_batched(memory_limit_mb=DEFAULT_MEMORY_LIMIT_MB, overwrite=False):
+    """批量生成整个键盘中过期的音色文件，并更新清单"""
+    manifest = load_manifest()
+    notes = manifest['notes']
+    todo = [midi for midi in range(21, 109)
+            if overwrite or is_dirty(notes.get(str(midi)), midi, 'batched', seed=BANK_SEED)]
+    manifest.update(code_version=code_version(), sample_rate=SAMPLE_RATE, file_format=file_format)
+    for midi, audio in generate_piano_notes_batched(todo, memory_limit_mb):
+        path = save_high_quality(audio, f"sounds/{midi_to_note_name(midi)}.{file_format}")
+        notes[str(midi)] = manifest_entry(midi, path, 'batched', seed=BANK_SEED)
+        print(f"生成成功：{os.path.basename(path)}")
+    save_manifest(manifest)
+
+
+# ---- 逆FFT叠加合成（FFT^-1）：在频域放置各分音的加窗谱核，逐帧逆变换后重叠相加 ----
+IFFT_SIZE = 2048
+IFFT_HOP = IFFT_SIZE // 4
+KERNEL_BINS = 4  # Blackman-Harris主瓣半宽（bin），旁瓣约-92dB，之外的谱核忽略
+KERNEL_OVERSAMPLE = 128
+BLACKMAN_HARRIS = (0.35875, 0.48829, 0.14128, 0.01168)
+
+
+@lru_cache(maxsize=None)
+def window_kernel(size=IFFT_SIZE, hop=IFFT_HOP):
+    """
+    返回 (谱核采样点, 谱核值, 合成窗)。
+
+    分析窗为以帧中心为原点的4项Blackman-Harris窗，谱核是其DTFT（实数）在±(KERNEL_BINS+1)
+    bin内的过采样表；合成窗为中心 2*hop 范围内的三角窗除以分析窗，相邻帧按 hop 重叠相加恰为1。
+    """
+    n = np.arange(size) - size // 2
+    window = sum(a * np.cos(2 * np.pi * i * n / size) for i, a in enumerate(BLACKMAN_HARRIS))
+    grid = np.arange(-(KERNEL_BINS + 1) * KERNEL_OVERSAMPLE, (KERNEL_BINS + 1) * KERNEL_OVERSAMPLE + 1) / KERNEL_OVERSAMPLE
+    kernel = np.cos(2 * np.pi * np.outer(grid, n) / size) @ window
+    m = np.arange(-hop, hop)
+    synth = (1 - np.abs(m) / hop) / window[size // 2 + m]
+    return grid, kernel, synth
+
+
+def kernel_columns(bins, amps):
+    """每个分音（位于分数bin处）主瓣内的bin起点与谱核值，形状为 (分音数,) 与 (分音数, 2*KERNEL_BINS+1)"""
+    grid, kernel, _ = window_kernel()
+    starts = np.rint(bins).astype(np.int64) - KERNEL_BINS
+    columns = starts[:, None] + np.arange(2 * KERNEL_BINS + 1)
+    return starts, amps[:, None] * np.interp(columns - bins[:, None], grid, kernel)
+
+
+def synthesize_ifft(step, multipliers, amps, offsets, length, size=IFFT_SIZE, hop=IFFT_HOP):
+    """
+    单个音符的分音之和：Σ amps·sin(step·multipliers·i + offsets)，i = 0..length-1。
+
+    各分音频率在整段内恒定，每帧频谱（complex64）只需把固定的谱核（正、负频率各一项）乘上帧中心相位旋转，
+    累加到主瓣覆盖的几个bin；所有帧同时处理，再批量 irfft 并按 hop 重叠相加。
+    超过奈奎斯特的分音按采样后的混叠频率放置，与逐采样合成的结果一致。
+    """
+    _, _, synth = window_kernel(size, hop)
+    half = size // 2 + 1
+    omega = np.remainder(step * multipliers + np.pi, 2 * np.pi) - np.pi  # 折叠到 (-π, π]
+    bins = omega * size / (2 * np.pi)
+
+    frames = -(-length // hop) + 1
+    centers = np.arange(frames) * hop
+    # sin(x) = cos(x - π/2)，取帧中心处的相位
+    rotation = np.exp(1j * (np.outer(centers, omega) + (offsets - np.pi / 2)))
+    spectrum = np.zeros((frames, half), dtype=np.complex64)
+    for sign, phasor in ((1, rotation), (-1, rotation.conj())):
+        starts, values = kernel_columns(sign * bins, amps / 2)
+        for partial, start in enumerate(starts.tolist()):
+            lo, hi = max(start, 0), min(start + len(values[partial]), half)
+            if lo < hi:
+                spectrum[:, lo:hi] += phasor[:, partial, None] * values[partial, lo - start:hi - start]
+    frames_td = sp_fft.irfft(spectrum, n=size, axis=1)
+    segments = np.concatenate((frames_td[:, -hop:], frames_td[:, :hop]), axis=1)
+    segments *= synth
+    return (segments[:-1, hop:] + segments[1:, :hop]).reshape(-1)[:length]
+
+
+def generate_harmonics_ifft(t, frequency, midi_number, jitter):
+    """与 generate_harmonics 相同的分音构成，以逆FFT叠加合成"""
+    multipliers, amps, offsets = partial_table([midi_number], jitter)
+    step = 2 * np.pi * frequency * (t[1] - t[0])
+    return synthesize_ifft(step, multipliers[0], amps[0], offsets, len(t))
+
+
+def spectral_difference(reference, candidate, size=8192, floor_db=-80.0):
+    """
+    两段波形的谱差（dB）：Hann窗分帧平均功率谱后，在参考谱峰值以下 floor_db 范围内
+    计算对数幅度差的均方根；同时返回时域信噪比（dB）。
+    """
+    def power_spectrum(x):
+        frames = len(x) // size
+        segments = x[:frames * size].reshape(frames, size) * np.hanning(size)
+        return np.mean(np.abs(np.fft.rfft(segments, axis=1)) ** 2, axis=0)
+
+    ref, cand = power_spectrum(reference), power_spectrum(candidate)
+    ref_db = 10 * np.log10(ref + 1e-30)
+    cand_db = 10 * np.log10(cand + 1e-30)
+    mask = ref_db > ref_db.max() + floor_db
+    spectral_db = float(np.sqrt(np.mean((ref_db[mask] - cand_db[mask]) ** 2)))
+    noise = np.sum((reference - candidate) ** 2)
+    snr_db = float(10 * np.log10(np.sum(reference ** 2) / noise)) if noise else float('inf')
+    return spectral_db, snr_db
+
+
+# 逆FFT合成相对 generate_harmonics 的容差
+CHECK_MAX_SPECTRAL_DB = 0.1
+CHECK_MIN_SNR_DB = 80.0
+
+
+def check_synthesis(midi_numbers=range(21, 109, 6)):
+    """
+    以与 generate_piano_note 相同的失谐基频与抖动，分别用 generate_harmonics（逐采样）与
+    逆FFT合成，打印谱差与时域信噪比；全部音符都在容差内时返回True。
+    """
+    length = int(SAMPLE_RATE * DURATION)
+    t = np.linspace(0, DURATION, length, dtype=np.float64)
+    passed = True
+    for midi in midi_numbers:
+        detune, jitter = note_randomness(midi)
+        frequency = np.clip(440 * (2 ** ((midi - 69 + detune) / 12)), 20, NYQUIST * 0.99)
+        reference = generate_harmonics(t, frequency, midi, jitter)
+        candidate = generate_harmonics_ifft(t, frequency, midi, jitter)
+        spectral_db, snr_db = spectral_difference(reference, candidate)
+        ok = spectral_db <= CHECK_MAX_SPECTRAL_DB and snr_db >= CHECK_MIN_SNR_DB
+        passed = passed and ok
+        print(f"{midi_to_note_name(midi):>4}  谱差 {spectral_db:.4f} dB  信噪比 {snr_db:.1f} dB"
+              + ("" if ok else "  未通过"))
+    print(f"{'通过' if passed else '未通过'}：容差为谱差 ≤ {CHECK_MAX_SPECTRAL_DB} dB、信噪比 ≥ {CHECK_MIN_SNR_DB} dB")
+    return passed
+
+
+@lru_cache(maxsize=None)
+def probe_ffmpeg():
+    """
+    探测本机ffmpeg：版本号与FLAC编码器实际支持的采样格式和私有选项（结果缓存）。
+    找不到ffmpeg时返回None。
+    """
     try:
-        # 使用临时WAV文件作为中介
-        temp_wav = "temp_32bit.wav"
-        wavfile.write(temp_wav, SAMPLE_RATE, wave)
-
-        # 显式指定PCM格式
-        audio = AudioSegment.from_wav(temp_wav)
-        audio = audio.set_sample_width(3)  # 24-bit格式
-
-        # 更新FLAC编码参数
-        flac_params = [
-            '-compression_level', '5',  # 修正参数格式
-            '-lpc_type', 'levinson',  # 确保参数值合法
-            '-exact_rice_parameters', '1'
-        ]
-        # 根据FFmpeg版本动态选择参数
-        if ffmpeg_version >= '4.3':
-            flac_params.append('-compression_level')
-            flac_params.append('8')
-        else:
-            flac_params.append('-compression_level')
-            flac_params.append('5')
+        version = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True, check=True).stdout
+        encoder = subprocess.run(['ffmpeg', '-hide_banner', '-h', 'encoder=flac'],
+                                 capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    match = re.search(r'version n?(\d+)\.(\d+)', version)
+    formats = re.search(r'Supported sample formats:(.*)', encoder)
+    return {
+        'version': tuple(map(int, match.groups())) if match else None,
+        'flac': encoder.startswith('Encoder flac'),
+        'sample_formats': formats.group(1).split() if formats else [],
+        'options': set(re.findall(r'^\s+-(\w+)', encoder, re.M)),
+    }
 
-        # 强制覆盖输出文件
-        if os.path.exists(filename):
-            os.remove(filename)
 
-        audio.export(filename, format='flac', parameters=flac_params)
+def flac_parameters(capabilities):
+    """按探测到的编码器能力组装FLAC参数，不支持的选项直接省略"""
+    params = ['-compression_level', '8']
+    if 'lpc_type' in capabilities['options']:
+        params += ['-lpc_type', 'levinson']
+    if 'exact_rice_parameters' in capabilities['options']:
+        params += ['-exact_rice_parameters', '1']
+    return params
 
-    except Exception as e:
+
+def pcm24_bytes(audio):
+    """float32 波形 -> 24位小端交错PCM字节"""
+    ints = np.ascontiguousarray(np.clip(np.rint(audio * 8388607.0), -8388608, 8388607), dtype='<i4')
+    return ints.view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+
+
+def write_wav24(pcm, filename, channels):
+    with wave.open(filename, 'wb') as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(3)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes(pcm)
+
+
+def flac_command(filename, channels):
+    """从标准输入读取24位PCM、编码为FLAC的ffmpeg命令"""
+    capabilities = probe_ffmpeg()
+    if capabilities is None or not capabilities['flac']:
+        raise RuntimeError("未找到支持FLAC编码的ffmpeg")
+    if 's32' not in capabilities['sample_formats']:
+        raise RuntimeError("ffmpeg 的FLAC编码器不支持24位采样")
+    return ['ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 's24le', '-ar', str(SAMPLE_RATE), '-ac', str(channels), '-i', 'pipe:0',
+            '-c:a', 'flac', '-sample_fmt', 's32', '-bits_per_raw_sample', '24',
+            *flac_parameters(capabilities), '-f', 'flac', filename]
+
+
+def encode_flac(pcm, filename, channels):
+    """24位PCM经管道送入ffmpeg编码为FLAC，不经过中间文件"""
+    result = subprocess.run(flac_command(filename, channels), input=pcm, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode(errors='replace').strip())
+
+
+def scratch_path(filename):
+    """在目标目录中创建本进程独享的临时文件，编码完成后原子替换目标，多进程并行生成互不冲突"""
+    directory, name = os.path.split(filename)
+    fd, path = tempfile.mkstemp(prefix=f".{name}.", suffix=f".{os.getpid()}.tmp", dir=directory or '.')
+    os.close(fd)
+    return path
+
+
+def save_high_quality(audio, filename):
+    """在内存中转换为24位PCM后写出：.flac 经管道编码，其余写24位WAV；返回实际写入的路径"""
+    channels = audio.shape[1] if audio.ndim > 1 else 1
+    pcm = pcm24_bytes(audio)
+    scratch = scratch_path(filename)
+    try:
+        if filename.endswith('.flac'):
+            encode_flac(pcm, scratch, channels)
+        else:
+            write_wav24(pcm, scratch, channels)
+        os.replace(scratch, filename)
+        return filename
+    except (OSError, RuntimeError) as e:
         print(f"编码失败详细原因：{str(e)}")
-        # 备用保存方案
-        wavfile.write(filename.replace('.flac', '.wav'), SAMPLE_RATE, wave)
+        # 备用保存方案：24位WAV
+        fallback = os.path.splitext(filename)[0] + '.wav'
+        write_wav24(pcm, scratch, channels)
+        os.replace(scratch, fallback)
+        return fallback
     finally:
-        if os.path.exists(temp_wav):
-            os.remove(temp_wav)
+        if os.path.exists(scratch):
+            os.remove(scratch)
+
+
+class StreamEncoder:
+    """
+    逐块写出24位PCM：.flac 经ffmpeg标准输入流式编码，其余写WAV。
+    写入本进程独享的临时文件，close() 后原子替换目标；找不到ffmpeg时与 save_high_quality 一样回退为WAV。
+    """
+
+    def __init__(self, filename, channels=2):
+        self.filename = filename
+        self.scratch = scratch_path(filename)
+        self.process = None
+        self.wav_file = None
+        if filename.endswith('.flac'):
+            try:
+                self.process = subprocess.Popen(flac_command(self.scratch, channels),
+                                                stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+                return
+            except (OSError, RuntimeError) as e:
+                print(f"编码失败详细原因：{str(e)}")
+                self.filename = os.path.splitext(filename)[0] + '.wav'
+        self.wav_file = wave.open(self.scratch, 'wb')
+        self.wav_file.setnchannels(channels)
+        self.wav_file.setsampwidth(3)
+        self.wav_file.setframerate(SAMPLE_RATE)
+
+    def write(self, audio):
+        pcm = pcm24_bytes(audio)
+        if self.process is not None:
+            self.process.stdin.write(pcm)
+        else:
+            self.wav_file.writeframes(pcm)
+
+    def close(self):
+        """完成编码并替换目标文件，返回实际写入的路径"""
+        try:
+            if self.process is not None:
+                self.process.stdin.close()
+                error = self.process.stderr.read()
+                if self.process.wait() != 0:
+                    raise RuntimeError(error.decode(errors='replace').strip())
+            else:
+                self.wav_file.close()
+            os.replace(self.scratch, self.filename)
+            return self.filename
+        finally:
+            if os.path.exists(self.scratch):
+                os.remove(self.scratch)
+
+    def abort(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+        elif self.wav_file is not None:
+            self.wav_file.close()
+        if os.path.exists(self.scratch):
+            os.remove(self.scratch)
+
+
+def save_streamed(blocks, filename, channels=2):
+    """把逐块产出的波形直接写入编码器，返回实际写入的路径"""
+    encoder = StreamEncoder(filename, channels)
+    try:
+        for block in blocks:
+            encoder.write(block)
+    except BaseException:
+        encoder.abort()
+        raise
+    return encoder.close()
+
+
+# ---- 流式分块合成：每个工作进程的峰值内存只有几个块 ----
+STREAM_BLOCK = 8192
+
+
+class PartialOscillator:
+    """
+    分音振荡器组：按块输出 Σ amps·sin(ω·i + offsets)。
+
+    状态只是当前采样位置；块起点相位 ω·position 以float64精确计算，块内偏移的正余弦表
+    只在构造时计算一次，每块由一次 (1×2P)@(2P×块长) 的矩阵乘得到，与整段合成结果一致。
+    """
+
+    def __init__(self, omega, amps, offsets, block=STREAM_BLOCK):
+        self.omega = omega
+        self.amps = amps
+        self.offsets = offsets
+        inner = omega[:, None] * np.arange(block)
+        self.table = np.concatenate((np.cos(inner), np.sin(inner)))
+        self.position = 0
+
+    def reset(self):
+        self.position = 0
+
+    def render(self, frames):
+        outer = self.omega * self.position + self.offsets
+        weights = np.concatenate((np.sin(outer) * self.amps, np.cos(outer) * self.amps))
+        self.position += frames
+        return weights @ self.table[:, :frames]
+
+
+class DelayLine:
+    """固定延迟线，代替整段 np.roll（不再把音符尾部回绕到开头）"""
+
+    def __init__(self, delay):
+        self.history = np.zeros(delay)
+
+    def process(self, block):
+        buffer = np.concatenate((self.history, block))
+        self.history = buffer[len(block):]
+        return buffer[:len(block)]
+
+
+def envelope_block(start, frames):
+    """与 generate_piano_note 相同的ADSR包络在 [start, start+frames) 上的取值"""
+    attack = int(SAMPLE_RATE * 0.005)
+    decay = int(SAMPLE_RATE * 0.2)
+    sustain = int(SAMPLE_RATE * (DURATION - 0.505))
+    release = int(SAMPLE_RATE * 0.3)
+    index = np.arange(start, start + frames)
+    values = np.zeros(frames)
+    segments = (
+        (0, attack, lambda i: (i / (attack - 1)) ** 3),
+        (attack, decay, lambda i: np.exp(-5 * i / (decay - 1)) * 0.7),
+        (attack + decay, sustain, lambda i: 0.7 - 0.3 * i / (sustain - 1)),
+        (attack + decay + sustain, release, lambda i: np.exp(-8 * i / (release - 1)) * 0.4),
+    )
+    for offset, length, curve in segments:
+        mask = (index >= offset) & (index < offset + length)
+        if mask.any():
+            values[mask] = curve(index[mask] - offset)
+    return values
+
+
+def generate_piano_note_stream(midi_number, block=STREAM_BLOCK, velocity=DEFAULT_VELOCITY):
+    """
+    逐块产出 (帧数, 2) 的float32立体声波形，音色与 generate_piano_note 相同。
+
+    琴槌整形后的归一化需要整段峰值，因此振荡器先空跑一遍只求峰值（不保存波形），
+    再从头逐块合成：包络按块求值，滤波状态跨块延续，立体声延迟由延迟线完成。
+    """
+    detune, jitter = note_randomness(midi_number)
+    frequency = np.clip(440 * (2 ** ((midi_number - 69 + detune) / 12)), 20, NYQUIST * 0.99)
+    length = int(SAMPLE_RATE * DURATION)
+    step = 2 * np.pi * frequency * DURATION / (length - 1)  # 与 np.linspace 时间轴的间距一致
+    multipliers, amps, offsets = partial_table([midi_number], jitter)
+    oscillator = PartialOscillator(step * multipliers[0], amps[0], offsets, block)
+    exponent = 1 + HAMMER_HARDNESS + (midi_number - 60) / 60 * 0.2 + velocity_hardness(velocity)
+
+    peak = 0.0
+    for start in range(0, length, block):
+        peak = max(peak, np.max(np.abs(oscillator.render(min(block, length - start)))))
+    scale = 0.9 / peak ** exponent
+    oscillator.reset()
+
+    equalizer = PIANO_FILTERS.stream(midi_number, velocity)
+    left_delay, right_delay = DelayLine(500), DelayLine(700)
+    warned = False
+    for start in range(0, length, block):
+        frames = min(block, length - start)
+        samples = oscillator.render(frames)
+        samples = np.sign(samples) * np.abs(samples) ** exponent * scale
+        samples *= envelope_block(start, frames)
+        samples = equalizer(samples)
+        stereo = np.empty((frames, 2), dtype=np.float32)
+        stereo[:, 0] = samples * 0.9 + left_delay.process(samples) * 0.1
+        stereo[:, 1] = samples * 0.9 + right_delay.process(samples) * 0.1
+        if np.any(np.isnan(stereo)) or np.any(np.abs(stereo) > 1.0):
+            if not warned:
+                print(f"MIDI {midi_number} 数据异常，正在修正...")
+                warned = True
+            np.nan_to_num(stereo, copy=False)
+            np.clip(stereo, -0.99, 0.99, out=stereo)
+        yield stereo
 
 
 def midi_to_note_name(midi_number):
@@ -199,37 +804,243 @@ def generate_parallel(midi):
         print(f"生成失败（MIDI {midi}）：{str(e)}")
 
 
-def generate_piano_note_with_soundfont():
-    # 初始化FluidSynth
-    fs = fluidsynth.Synth()
-    fs.start()
+# ---- 增量构建：清单记录每个音符的参数哈希、种子、代码版本与输出校验和 ----
+MANIFEST_PATH = os.path.join("sounds", MANIFEST_NAME)
+
+
+@lru_cache(maxsize=None)
+def code_version():
+    """生成器源码的哈希，合成代码改动后所有音符都视为过期"""
+    with open(os.path.abspath(__file__), 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+
+def generation_parameters(midi, synthesis, velocity=DEFAULT_VELOCITY, *, seed):
+    return {
+        'midi': midi,
+        'velocity': velocity,
+        'velocity_hardness': VELOCITY_HARDNESS,
+        'velocity_brightness': VELOCITY_BRIGHTNESS,
+        'sample_rate': SAMPLE_RATE,
+        'duration': DURATION,
+        'hammer_hardness': HAMMER_HARDNESS,
+        'string_loss': STRING_LOSS,
+        'harmonics': HARMONIC_COUNT,
+        'inharmonics': INHARMONIC_COUNT,
+        'synthesis': synthesis,
+        'file_format': file_format,
+        'seed': seed,
+    }
+
+
+def parameter_hash(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(path=MANIFEST_PATH):
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_VERSION:
+            return manifest
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    return {'version': MANIFEST_VERSION, 'notes': {}}
+
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    """先写临时文件再原子替换，构建中断也不会留下损坏的清单"""
+    scratch = scratch_path(path)
+    with open(scratch, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(scratch, path)
+
+
+def is_dirty(entry, midi, synthesis, verify=False, velocity=DEFAULT_VELOCITY, *, seed):
+    """条目缺失、参数或代码版本变化、文件缺失或大小不符（verify 时比对校验和）即需重建"""
+    if not entry:
+        return True
+    if entry.get('params') != parameter_hash(generation_parameters(midi, synthesis, velocity, seed=seed)):
+        return True
+    if entry.get('code_version') != code_version():
+        return True
+    path = os.path.join("sounds", entry.get('file', ''))
+    try:
+        if os.path.getsize(path) != entry.get('size'):
+            return True
+    except OSError:
+        return True
+    return verify and file_checksum(path) != entry.get('sha256')
+
+
+def manifest_entry(midi, path, synthesis, velocity=DEFAULT_VELOCITY, *, seed):
+    return {
+        'file': os.path.basename(path),
+        'velocity': velocity,
+        'params': parameter_hash(generation_parameters(midi, synthesis, velocity, seed=seed)),
+        'seed': seed,
+        'code_version': code_version(),
+        'size': os.path.getsize(path),
+        'sha256': file_checksum(path),
+    }
+
+
+def layer_file_name(midi, velocity=DEFAULT_VELOCITY):
+    """默认力度沿用 sounds/<音名>.<格式>，其他力度层追加 _v<力度>（与 sample_bank 的命名一致）"""
+    name = midi_to_note_name(midi)
+    return name if velocity == DEFAULT_VELOCITY else f"{name}_v{velocity}"
+
+
+def init_build_worker(seed, synthesis):
+    """
+    工作进程初始化：spawn 方式（macOS/Windows 默认）启动的进程会重新导入本模块，
+    命令行设置的种子与合成方式需由主进程显式传入。
+    """
+    global BANK_SEED, SYNTHESIS
+    BANK_SEED = seed
+    SYNTHESIS = synthesis
+
+
+def build_note(job):
+    """工作进程：生成并保存一个（音符, 力度层），返回 (清单键, 清单条目或None)；清单条目按任务中的参数计算"""
+    midi, velocity, synthesis, seed = job
+    filename = f"sounds/{layer_file_name(midi, velocity)}.{file_format}"
+    try:
+        if synthesis == 'stream':
+            path = save_streamed(generate_piano_note_stream(midi, velocity=velocity), filename)
+        else:
+            audio = generate_piano_note(midi, synthesis, velocity)
+            path = save_high_quality(audio, filename)
+    except Exception as e:
+        print(f"生成失败（MIDI {midi}，力度 {velocity}）：{str(e)}")
+        return layer_key(midi, velocity), None
+    print(f"生成成功：{os.path.basename(path)}")
+    return layer_key(midi, velocity), manifest_entry(midi, path, synthesis, velocity, seed=seed)
+
+
+def build_bank(jobs=1, synthesis=None, force=False, verify=False, midi_numbers=range(21, 109),
+               velocities=(DEFAULT_VELOCITY,)):
+    """只重建过期的音符与力度层（jobs>1 时并行），每完成一个即更新清单"""
+    synthesis = synthesis or SYNTHESIS
+    seed = BANK_SEED
+    manifest = load_manifest()
+    notes = manifest['notes']
+    work = [(midi, velocity) for midi in midi_numbers for velocity in velocities]
+    dirty = [(midi, velocity) for midi, velocity in work
+             if force or is_dirty(notes.get(layer_key(midi, velocity)), midi, synthesis, verify, velocity,
+                                  seed=seed)]
+    print(f"需要重建 {len(dirty)} 个采样，{len(work) - len(dirty)} 个保持不变")
+    manifest.update(code_version=code_version(), sample_rate=SAMPLE_RATE, file_format=file_format)
+    if not dirty:
+        save_manifest(manifest)
+        return
+    jobs_list = [(midi, velocity, synthesis, seed) for midi, velocity in dirty]
+    with Pool(processes=max(1, min(jobs, len(dirty))), initializer=init_build_worker,
+              initargs=(seed, synthesis)) as pool:
+        for key, entry in pool.imap_unordered(build_note, jobs_list):
+            if entry is not None:
+                notes[key] = entry
+                save_manifest(manifest)
+
+
+# ---- SoundFont 音色库渲染：不启动音频驱动，直接拉取 get_samples，速度只受CPU限制 ----
+SOUNDFONT_PATH = "sounds_source/FluidR3_GM.sf2"
+SOUNDFONT_HOLD = DURATION - 0.5  # 按住时长（秒）
+SOUNDFONT_RELEASE = 0.5  # 松开后保留的释放尾音（秒）
+SOUNDFONT_FLUSH_LIMIT = 3.0  # 清空混响尾音的最长渲染时间（秒）
+RENDER_BLOCK = 4096
 
-    # 加载SoundFont文件（替换为你的路径）
-    sfid = fs.sfload("sounds_source/FluidR3_GM.sf2")
-    fs.program_select(0, sfid, 0, 0)  # 选择钢琴音色（0号程序）
+_soundfont_synth = None
 
-    # 播放音符（A4，力度100，持续2秒）
-    fs.noteon(0, 69, 100)  # MIDI编号69对应A4（440Hz）
-    fluidsynth.wait(2)
-    fs.noteoff(0, 69)
 
-    # 生成音频数据并保存
-    samples = fs.get_samples(int(2 * 44100))
-    audio = np.frombuffer(samples, dtype=np.int16)
+def init_soundfont_worker(soundfont, program=0, gain=0.2):
+    """工作进程初始化：每个进程各自加载一次SoundFont，不创建音频驱动（加载失败时留空，由渲染时报错）"""
+    global _soundfont_synth
+    synth = fluidsynth.Synth(gain=gain, samplerate=SAMPLE_RATE)
+    sfid = synth.sfload(soundfont)
+    if sfid < 0:
+        synth.delete()
+        return
+    synth.program_select(0, sfid, 0, program)  # 选择钢琴音色（0号程序）
+    _soundfont_synth = synth
 
-    # 保存为WAV文件
-    with wave.open("sounds/real_piano_A4.wav", "wb") as wav_file:
-        wav_file.setnchannels(2)  # FluidSynth输出立体声
-        wav_file.setsampwidth(2)
-        wav_file.setframerate(44100)
-        wav_file.writeframes(audio.tobytes())
 
-    fs.delete()
+def render_soundfont_note(job):
+    """在工作进程中渲染一个（音符, 力度）并保存，返回写入的路径"""
+    midi, velocity = job
+    synth = _soundfont_synth
+    if synth is None:
+        raise RuntimeError("SoundFont 加载失败")
+    synth.noteon(0, midi, velocity)
+    held = synth.get_samples(int(SOUNDFONT_HOLD * SAMPLE_RATE))
+    synth.noteoff(0, midi)
+    tail = synth.get_samples(int(SOUNDFONT_RELEASE * SAMPLE_RATE))
+    # 截断余音并渲染到完全静音，避免混响尾音串入同一进程的下一个音符
+    synth.all_sounds_off(0)
+    for _ in range(int(SOUNDFONT_FLUSH_LIMIT * SAMPLE_RATE) // RENDER_BLOCK):
+        if not np.any(synth.get_samples(RENDER_BLOCK)):
+            break
+    audio = np.concatenate((held, tail)).reshape(-1, 2).astype(np.float32) / 32768.0
+    # 与合成音色一样归一化到0.9峰值：力度层只体现音色差异，响度由混音器的力度曲线决定，不会被衰减两次
+    peak = np.max(np.abs(audio))
+    if peak > 0:
+        audio *= 0.9 / peak
+    path = save_high_quality(audio, f"sounds/{layer_file_name(midi, velocity)}.{file_format}")
+    print(f"生成成功：{os.path.basename(path)}")
+    return path
 
 
+def generate_piano_note_with_soundfont(soundfont=SOUNDFONT_PATH, velocities=(DEFAULT_VELOCITY,),
+                                       jobs=1, midi_numbers=range(21, 109)):
+    """用SoundFont渲染整个键盘（可选多个力度层），按进程分摊音符"""
+    if not os.path.isfile(soundfont):
+        print(f"找不到SoundFont文件：{soundfont}")
+        return
+    work = [(midi, velocity) for midi in midi_numbers for velocity in velocities]
+    with Pool(processes=max(1, min(jobs, len(work))), initializer=init_soundfont_worker,
+              initargs=(soundfont,)) as pool:
+        for _ in pool.imap_unordered(render_soundfont_note, work):
+            pass
 
 
 if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="生成钢琴音色")
+    parser.add_argument('--batch', action='store_true', help="批量向量化合成整个键盘")
+    parser.add_argument('--memory-limit', type=int, default=DEFAULT_MEMORY_LIMIT_MB, help="批量合成的内存上限（MB）")
+    parser.add_argument('--overwrite', action='store_true', help="覆盖已存在的音色文件")
+    parser.add_argument('--synthesis', choices=['direct', 'ifft', 'stream'], default=SYNTHESIS, help="逐音符生成时的谐波合成方式")
+    parser.add_argument('--check-synthesis', action='store_true', help="对比逆FFT与逐采样合成的谱差，超出容差时以非零状态退出")
+    parser.add_argument('--build', action='store_true', help="按清单增量构建音色库，只重建参数或代码变化的音符")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help="并行进程数（增量构建与SoundFont渲染）")
+    parser.add_argument('--force', action='store_true', help="增量构建时重建全部音符")
+    parser.add_argument('--verify', action='store_true', help="增量构建时校验已有文件的SHA-256")
+    parser.add_argument('--seed', type=int, default=BANK_SEED, help="音色库随机种子")
+    parser.add_argument('--soundfont', default=SOUNDFONT_PATH, help="SoundFont文件路径")
+    parser.add_argument('--velocity', type=int, action='append',
+                        help=f"要生成的力度层（增量构建与SoundFont渲染），可重复指定，默认只生成 {DEFAULT_VELOCITY}")
+    args = parser.parse_args()
+    SYNTHESIS = args.synthesis
+    BANK_SEED = args.seed
+    if args.check_synthesis:
+        raise SystemExit(0 if check_synthesis() else 1)
+    if args.build:
+        build_bank(args.jobs, args.synthesis, args.force, args.verify,
+                   velocities=args.velocity or [DEFAULT_VELOCITY])
+        print("音色库构建完成！")
+        raise SystemExit
+    if args.batch:
+        generate_batched(args.memory_limit, args.overwrite)
+        print("所有高音质音频生成完成！")
+        raise SystemExit
     # check_ffmpeg_version()
     # with Pool(processes=8) as pool:  # 使用8进程并行生成
     #     pool.map(generate_parallel, range(21, 109))
@@ -239,6 +1050,6 @@ if __name__ == '__main__':
     #     count = count + 1
     #     print(f'midi_nate: {midi} ,number: {count}')
 
-    generate_piano_note_with_soundfont()
+    generate_piano_note_with_soundfont(args.soundfont, args.velocity or [DEFAULT_VELOCITY], args.jobs)
 
     print("所有高音质音频生成完成！")
\ No newline at end of file
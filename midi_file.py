@@ -0,0 +1,268 @@
+"""标准MIDI文件（SMF）导出与导入（按块产出事件），事件格式与 recording.EVENT_DTYPE 一致"""
+import struct
+from array import array
+
+import numpy as np
+
+from mixer import PEDAL_CONTROLLERS
+from recording import EVENT_CONTROL, EVENT_DTYPE, EVENT_NOTE_OFF, EVENT_NOTE_ON
+
+DEFAULT_TICKS_PER_BEAT = 480
+DEFAULT_TEMPO = 500000  # 微秒/拍，即120 BPM
+
+
+class MidiFileError(ValueError):
+    pass
+
+
+# ---- 导出 ----
+def encode_vlq(value):
+    """编码MIDI变长数"""
+    buffer = [value & 0x7F]
+    value >>= 7
+    while value:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(buffer))
+
+
+def _chunk(kind, payload):
+    return kind + struct.pack('>I', len(payload)) + payload
+
+
+def _tempo_meta(tempo):
+    return b'\x00\xff\x51\x03' + tempo.to_bytes(3, 'big')
+
+
+END_OF_TRACK = b'\x00\xff\x2f\x00'
+
+
+def write_midi_file(path, events, file_type=1, ticks_per_beat=DEFAULT_TICKS_PER_BEAT,
+                    tempo=DEFAULT_TEMPO, channel=0):
+    """
+    把录音事件导出为SMF。
+
+    file_type=0 时速度与音符写入同一音轨；file_type=1 时音轨0只含速度信息，音轨1为音符。
+    事件的MIDI通道为 channel 加上事件来源（输入端口序号）后按16取模，多台键盘的录音导出后仍可按通道区分。
+    """
+    if file_type not in (0, 1):
+        raise MidiFileError(f"不支持的MIDI文件类型: {file_type}")
+    events = events[np.argsort(events['time_ns'], kind='stable')]
+    # 纳秒 -> tick：ticks_per_beat / (tempo微秒 * 1000)
+    ticks = np.rint(events['time_ns'] * (ticks_per_beat / (tempo * 1000))).astype(np.int64)
+    deltas = np.diff(ticks, prepend=0)
+    np.maximum(deltas, 0, out=deltas)
+    channels = ((channel + events['source'].astype(np.int64)) & 0x0F).tolist()
+
+    notes = bytearray()
+    for delta, note, velocity, event_type, event_channel in zip(
+            deltas.tolist(), events['note'].tolist(), events['velocity'].tolist(),
+            events['type'].tolist(), channels):
+        notes += encode_vlq(delta)
+        if event_type == EVENT_NOTE_ON:
+            notes += bytes((0x90 | event_channel, note & 0x7F, max(1, velocity & 0x7F)))
+        elif event_type == EVENT_CONTROL:
+            notes += bytes((0xB0 | event_channel, note & 0x7F, velocity & 0x7F))
+        else:
+            notes += bytes((0x80 | event_channel, note & 0x7F, 0x40))
+
+    if file_type == 0:
+        tracks = [_tempo_meta(tempo) + bytes(notes) + END_OF_TRACK]
+    else:
+        tracks = [_tempo_meta(tempo) + END_OF_TRACK, bytes(notes) + END_OF_TRACK]
+    header = _chunk(b'MThd', struct.pack('>HHH', file_type, len(tracks), ticks_per_beat))
+    with open(path, 'wb') as f:
+        f.write(header)
+        for track in tracks:
+            f.write(_chunk(b'MTrk', track))
+
+
+# ---- 导入 ----
+def _read_vlq(data, pos, end):
+    """解码一个变长数（规范规定最多4字节）"""
+    value = 0
+    for _ in range(4):
+        if pos >= end:
+            raise MidiFileError(f"偏移 {pos} 处变长数被截断")
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+    raise MidiFileError(f"偏移 {pos - 4} 处变长数超过4字节")
+
+
+def _check(pos, end):
+    """确认 pos 之前的字节都在音轨内，音轨被截断或损坏时报错"""
+    if pos > end:
+        raise MidiFileError(f"音轨在偏移 {end} 处被截断")
+
+
+def _data_byte(data, pos):
+    """读取通道消息的数据字节（必须小于0x80）"""
+    byte = data[pos]
+    if byte & 0x80:
+        raise MidiFileError(f"偏移 {pos} 处的数据字节无效: {byte:#04x}")
+    return byte
+
+
+def _scan_track(data, start, end):
+    """
+    扫描一条音轨，只记录每个事件的delta时间与状态/数据字节（紧凑数组，不生成事件对象）。
+    返回 (delta, 状态, 数据1, 数据2, {事件序号: 速度})；音轨被截断或损坏时抛出 MidiFileError。
+    """
+    deltas = array('I')
+    statuses = array('B')
+    data1 = array('B')
+    data2 = array('B')
+    tempos = {}
+    pos = start
+    running = 0
+    while pos < end:
+        delta, pos = _read_vlq(data, pos, end)
+        deltas.append(delta)
+        _check(pos + 1, end)
+        status = data[pos]
+        if status & 0x80:
+            pos += 1
+            if status < 0xF0:
+                running = status
+        elif running:
+            status = running  # 运行状态：沿用上一个通道状态字节
+        else:
+            raise MidiFileError(f"偏移 {pos} 处缺少状态字节")
+        first = second = 0
+        if status == 0xFF:
+            _check(pos + 1, end)
+            meta_type = data[pos]
+            length, pos = _read_vlq(data, pos + 1, end)
+            _check(pos + length, end)
+            if meta_type == 0x51 and length == 3:
+                tempos[len(statuses)] = (data[pos] << 16) | (data[pos + 1] << 8) | data[pos + 2]
+            first = meta_type
+            pos += length
+        elif status in (0xF0, 0xF7):
+            length, pos = _read_vlq(data, pos, end)
+            _check(pos + length, end)
+            pos += length
+        else:
+            if status & 0xF0 in (0xC0, 0xD0):
+                _check(pos + 1, end)
+                first = _data_byte(data, pos)
+                pos += 1
+            else:
+                _check(pos + 2, end)
+                first, second = _data_byte(data, pos), _data_byte(data, pos + 1)
+                pos += 2
+        statuses.append(status)
+        data1.append(first)
+        data2.append(second)
+    return deltas, statuses, data1, data2, tempos
+
+
+def _ticks_to_ns(ticks, tempo_ticks, tempo_values, division):
+    """按速度表把tick向量化换算为纳秒"""
+    if division & 0x8000:
+        # SMPTE时间码：每秒帧数 × 每帧tick
+        fps = 256 - (division >> 8)
+        return (ticks * (1e9 / (fps * (division & 0xFF)))).astype(np.int64)
+    ns_per_tick = np.asarray(tempo_values, dtype=np.float64) * 1000 / division
+    starts = np.asarray(tempo_ticks, dtype=np.int64)
+    segment_ns = np.concatenate(([0.0], np.cumsum(np.diff(starts) * ns_per_tick[:-1])))
+    segment = np.searchsorted(starts, ticks, side='right') - 1
+    return (segment_ns[segment] + (ticks - starts[segment]) * ns_per_tick[segment]).astype(np.int64)
+
+
+def read_midi_header(data):
+    if data[:4] != b'MThd':
+        raise MidiFileError("不是标准MIDI文件")
+    if len(data) < 14:
+        raise MidiFileError("MIDI文件头被截断")
+    length = struct.unpack('>I', data[4:8])[0]
+    file_type, track_count, division = struct.unpack('>HHH', data[8:14])
+    return file_type, track_count, division, 8 + length
+
+
+def iter_midi_events(path, chunk_events=65536):
+    """
+    读取MIDI文件，按时间顺序产出 EVENT_DTYPE 数组块。
+
+    多音轨合并与速度换算需要完整的速度表，因此在产出第一块之前会读入整个文件并扫描全部音轨：
+    扫描是逐字节的Python循环，但每条音轨只保存紧凑的偏移/状态数组，不生成事件对象；
+    之后的tick累加、速度换算与多音轨合并为向量化运算。
+    只有结果按块产出（可直接交给 PlaybackScheduler），解析本身不是流式的。
+    所有通道的 note on/off 与踏板控制器（CC64/66/67）都会导入，力度为0的 note on 视为 note off；
+    事件的MIDI通道记为 source（与 write_midi_file 的通道映射对应）。
+    文件被截断或损坏时抛出 MidiFileError。
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    file_type, track_count, division, pos = read_midi_header(data)
+
+    all_ticks, all_status, all_note, all_velocity = [], [], [], []
+    tempo_ticks, tempo_values = [0], [DEFAULT_TEMPO]
+    tracks = 0
+    while tracks < track_count and pos < len(data):
+        if pos + 8 > len(data):
+            raise MidiFileError(f"偏移 {pos} 处块头被截断")
+        kind = data[pos:pos + 4]
+        length = struct.unpack('>I', data[pos + 4:pos + 8])[0]
+        start, end = pos + 8, min(pos + 8 + length, len(data))
+        pos = end
+        if kind != b'MTrk':
+            continue  # 规范允许未知类型的块，按长度跳过
+        tracks += 1
+        deltas, statuses, data1, data2, tempos = _scan_track(data, start, end)
+        if not deltas:
+            continue
+        ticks = np.cumsum(np.frombuffer(deltas, dtype=np.uint32), dtype=np.int64)
+        for index, tempo in tempos.items():
+            tempo_ticks.append(int(ticks[index]))
+            tempo_values.append(tempo)
+        status = np.frombuffer(statuses, dtype=np.uint8)
+        kind = status & 0xF0
+        first = np.frombuffer(data1, dtype=np.uint8)
+        pedal = (kind == 0xB0) & np.isin(first, PEDAL_CONTROLLERS)
+        mask = (status < 0xF0) & ((kind == 0x90) | (kind == 0x80) | pedal)
+        all_ticks.append(ticks[mask])
+        all_status.append(status[mask])
+        all_note.append(first[mask])
+        all_velocity.append(np.frombuffer(data2, dtype=np.uint8)[mask])
+
+    if not all_ticks:
+        return
+    ticks = np.concatenate(all_ticks)
+    # 多音轨按tick稳定合并，同一tick保持音轨内原有顺序
+    order = np.argsort(ticks, kind='stable')
+    ticks = ticks[order]
+    status = np.concatenate(all_status)[order]
+    kind = status & 0xF0
+    note = np.concatenate(all_note)[order]
+    velocity = np.concatenate(all_velocity)[order]
+
+    # 速度表：按tick排序，同一tick以后出现的为准
+    tempo_order = np.argsort(tempo_ticks, kind='stable')
+    tempo_ticks = np.asarray(tempo_ticks)[tempo_order]
+    tempo_values = np.asarray(tempo_values)[tempo_order]
+    keep = np.append(tempo_ticks[1:] != tempo_ticks[:-1], True)
+    times = _ticks_to_ns(ticks, tempo_ticks[keep], tempo_values[keep], division)
+
+    note_on = (kind == 0x90) & (velocity > 0)
+    for begin in range(0, len(times), chunk_events):
+        stop = begin + chunk_events
+        chunk = np.empty(len(times[begin:stop]), dtype=EVENT_DTYPE)
+        chunk['time_ns'] = times[begin:stop]
+        chunk['note'] = note[begin:stop]
+        chunk['velocity'] = velocity[begin:stop]
+        chunk['type'] = np.where(note_on[begin:stop], EVENT_NOTE_ON,
+                                 np.where(kind[begin:stop] == 0xB0, EVENT_CONTROL, EVENT_NOTE_OFF))
+        chunk['source'] = status[begin:stop] & 0x0F
+        yield chunk
+
+
+def read_midi_file(path):
+    """一次性读取全部音符事件为单个 EVENT_DTYPE 数组"""
+    chunks = list(iter_midi_events(path))
+    if not chunks:
+        return np.zeros(0, dtype=EVENT_DTYPE)
+    return np.concatenate(chunks)
@@ -0,0 +1,349 @@
+"""MIDI输入管道：各端口的rtmidi回调线程写入无锁环形缓冲，界面线程按批取出并解析（不依赖Qt）"""
+import time
+from collections import deque
+from threading import Event, Lock, Thread
+
+import numpy as np
+
+from mixer import CC_ALL_NOTES_OFF, CC_ALL_SOUND_OFF, PEDAL_CONTROLLERS
+from recording import EVENT_CONTROL, EVENT_DTYPE, EVENT_NOTE_OFF, EVENT_NOTE_ON
+
+DEFAULT_CAPACITY = 4096
+# 只转发踏板与通道模式控制器，调制轮等连续控制器不进入界面线程与录音
+INPUT_CONTROLLERS = PEDAL_CONTROLLERS + (CC_ALL_SOUND_OFF, CC_ALL_NOTES_OFF)
+# 设备时钟落后单调时钟超过此值（纳秒）时前移锚点，慢时钟的误差不会随演奏时长累积
+MAX_CLOCK_LAG_NS = 5_000_000
+
+
+class MidiRingBuffer:
+    """
+    单生产者单消费者的无锁环形缓冲。
+
+    生产者（rtmidi回调线程）只写 head，消费者（界面线程）只写 tail；槽位写完后才推进 head，
+    两个下标的读写在GIL下是原子的，无需加锁。缓冲满时丢弃新消息并计数。
+    每条消息保留前3个字节（通道消息的最大长度），更长的系统独占消息只用于维护运行状态。
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.data = np.zeros((capacity, 3), dtype=np.uint8)
+        self.lengths = np.zeros(capacity, dtype=np.uint8)
+        self.head = 0  # 已写入的消息总数
+        self.tail = 0  # 已取出的消息总数
+        self.dropped = 0
+
+    def __len__(self):
+        return self.head - self.tail
+
+    def push(self, time_ns, message):
+        """生产者：写入一条消息，缓冲满时返回False"""
+        if self.head - self.tail >= self.capacity:
+            self.dropped += 1
+            return False
+        slot = self.head % self.capacity
+        length = min(len(message), 3)
+        self.times[slot] = time_ns
+        self.data[slot, :length] = message[:length]
+        self.lengths[slot] = length
+        self.head += 1
+        return True
+
+    def drain(self):
+        """消费者：取出当前全部消息，返回 (时间, 字节, 长度) 的副本"""
+        head = self.head
+        slots = np.arange(self.tail, head) % self.capacity
+        batch = self.times[slots], self.data[slots], self.lengths[slots]
+        self.tail = head
+        return batch
+
+
+def parse_messages(times, data, lengths, running=0):
+    """
+    向量化解析一批原始消息，返回 (EVENT_DTYPE数组, 新的运行状态)。
+
+    缺少状态字节的消息沿用上一个通道状态（运行状态，可跨批次延续）；系统公共消息清除运行状态，
+    系统实时消息（0xF8以上）不影响运行状态。所有通道的 note on/off 与 INPUT_CONTROLLERS 中的
+    控制器被保留，力度为0的 note on 视为 note off。事件时间为单调时钟的绝对纳秒数。
+    """
+    count = len(times)
+    if not count:
+        return np.zeros(0, dtype=EVENT_DTYPE), running
+    first = data[:, 0]
+    has_status = first >= 0x80
+    sets_status = has_status & (first < 0xF8)
+    # 向前填充：每条消息对应的最近一个状态字节
+    source = np.where(sets_status, np.arange(count), -1)
+    np.maximum.accumulate(source, out=source)
+    status = np.where(source >= 0, first[np.maximum(source, 0)], running).astype(np.uint8)
+    status[status >= 0xF0] = 0
+    if sets_status.any():
+        running = int(first[sets_status][-1])
+        running = running if running < 0xF0 else 0
+
+    data1 = np.where(has_status, data[:, 1], first)
+    data2 = np.where(has_status, data[:, 2], data[:, 1])
+    complete = lengths >= np.where(has_status, 3, 2)
+    kind = status & 0xF0
+    note_on = (kind == 0x90) & (data2 > 0)
+    note_off = (kind == 0x80) | ((kind == 0x90) & (data2 == 0))
+    control = (kind == 0xB0) & np.isin(data1, INPUT_CONTROLLERS)
+    keep = complete & (first < 0xF8) & (note_on | note_off | control)
+
+    events = np.empty(int(keep.sum()), dtype=EVENT_DTYPE)
+    events['time_ns'] = times[keep]
+    events['note'] = data1[keep]
+    events['velocity'] = np.where(note_off, 0, data2)[keep]
+    events['type'] = np.where(note_on, EVENT_NOTE_ON, np.where(control, EVENT_CONTROL, EVENT_NOTE_OFF))[keep]
+    events['source'] = 0
+    return events, running
+
+
+class LatencyCounter:
+    """消息从到达（设备或网络时刻）到被消费者取出的延迟统计，单位毫秒"""
+
+    def __init__(self, window=1024):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)  # 最近的延迟，用于估计p95
+
+    def add(self, latencies):
+        if not len(latencies):
+            return
+        self.count += len(latencies)
+        self.total += float(latencies.sum())
+        self.max = max(self.max, float(latencies.max()))
+        self.recent.extend(latencies[-self.recent.maxlen:].tolist())
+
+    def stats(self):
+        """均值、p95、最大值（毫秒）与消息数"""
+        if not self.count:
+            return {}
+        ordered = sorted(self.recent)
+        return {
+            'count': self.count,
+            'mean': self.total / self.count,
+            'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            'max': self.max,
+        }
+
+
+class MidiSource:
+    """一个输入来源（端口）的环形缓冲、运行状态、设备时钟与延迟统计"""
+    __slots__ = ('key', 'index', 'ring', 'running', 'anchor', 'elapsed', 'latency')
+
+    def __init__(self, key, index, capacity):
+        self.key = key
+        self.index = index  # 来源序号，drain() 返回的来源数组中使用
+        self.ring = MidiRingBuffer(capacity)
+        self.running = 0
+        self.anchor = None  # 设备时间0对应的单调时刻
+        self.elapsed = 0.0  # 累计的rtmidi消息间隔（秒）
+        self.latency = LatencyCounter()
+
+
+class MidiInputQueue:
+    """
+    MIDI输入队列。
+
+    callback(event, source) 作为rtmidi回调：把rtmidi提供的消息间隔（秒）累加为设备时间，
+    锚定到单调时钟后写入该来源自己的环形缓冲，不加锁、不发Qt信号。每个来源（端口）
+    各有一个单生产者缓冲，多个端口的回调线程互不争用。缓冲由空变为非空时调用一次
+    notify()（由调用方转为一个跨线程信号），消费者在 drain() 中一次取出全部来源的消息，
+    因此无论消息多密集，同一时刻最多只有少量待处理的通知。
+    """
+
+    def __init__(self, notify=None, capacity=DEFAULT_CAPACITY):
+        self.notify = notify
+        self.capacity = capacity
+        self.pending = False
+        self.sources = {}  # 来源 -> MidiSource，写时复制，读取无需加锁
+        self.keys = []  # 来源序号 -> 来源
+        self.sources_lock = Lock()  # 只在新增来源时使用（端口回调线程与网络输入线程可能同时新增）
+
+    @property
+    def dropped(self):
+        return sum(source.ring.dropped for source in self.sources.values())
+
+    def source(self, key):
+        state = self.sources.get(key)
+        if state is None:
+            with self.sources_lock:
+                state = self.sources.get(key)
+                if state is None:
+                    state = MidiSource(key, len(self.keys), self.capacity)
+                    self.keys = self.keys + [key]
+                    self.sources = {**self.sources, key: state}
+        return state
+
+    @staticmethod
+    def timestamp(state, delta):
+        """
+        由rtmidi的消息间隔推算设备时刻。设备时钟跑到当前时刻之后时重新锚定；
+        落后超过 MAX_CLOCK_LAG_NS 时把锚点前移到恰好落后该值，密集消息之间的相对间隔不变。
+        """
+        now = time.monotonic_ns()
+        if state.anchor is None:
+            state.anchor, state.elapsed = now, 0.0
+            return now
+        state.elapsed += delta
+        stamp = state.anchor + int(state.elapsed * 1e9)
+        if stamp > now:
+            state.anchor, state.elapsed = now, 0.0
+            return now
+        lag = now - stamp - MAX_CLOCK_LAG_NS
+        if lag > 0:
+            state.anchor += lag
+            stamp += lag
+        return stamp
+
+    def callback(self, event, source=None):
+        """rtmidi回调线程：记录设备时间戳并写入该来源的环形缓冲"""
+        message, delta = event
+        state = self.source(source)
+        self._push(state, message, self.timestamp(state, delta))
+
+    def push(self, message, time_ns=None, source=None):
+        """写入一条已知时刻的消息（缺省取当前时刻）"""
+        self._push(self.source(source), message, time.monotonic_ns() if time_ns is None else time_ns)
+
+    def _push(self, state, message, time_ns):
+        if state.ring.push(time_ns, message) and not self.pending:
+            self.pending = True
+            if self.notify is not None:
+                self.notify()
+
+    def reset_clock(self, source=None):
+        """端口重新打开后丢弃旧的设备时间锚点与运行状态"""
+        state = self.sources.get(source)
+        if state is not None:
+            state.anchor = None
+            state.running = 0
+
+    def latency_stats(self):
+        """各来源的消息延迟统计 {来源: {'count', 'mean', 'p95', 'max'}}（毫秒）"""
+        return {key: state.latency.stats() for key, state in self.sources.items() if state.latency.count}
+
+    def drain(self):
+        """
+        消费者：取出并解析全部来源的待处理消息。
+        返回 (EVENT_DTYPE数组, 来源序号数组)，按时间稳定排序；来源序号经 keys 换算为来源，
+        同时写入事件的 source 字段（录音与导出按此区分端口）。
+        """
+        # 先清除标志再读取：此后写入的消息必然会再次通知
+        self.pending = False
+        batches, keys = [], []
+        for state in self.sources.values():
+            if not len(state.ring):
+                continue
+            times, data, lengths = state.ring.drain()
+            state.latency.add((time.monotonic_ns() - times) / 1e6)
+            events, state.running = parse_messages(times, data, lengths, state.running)
+            if len(events):
+                events['source'] = state.index & 0xFF
+                batches.append(events)
+                keys.append(np.full(len(events), state.index, dtype=np.int32))
+        if not batches:
+            return np.zeros(0, dtype=EVENT_DTYPE), np.zeros(0, dtype=np.int32)
+        if len(batches) == 1:
+            return batches[0], keys[0]
+        events = np.concatenate(batches)
+        order = np.argsort(events['time_ns'], kind='stable')
+        return events[order], np.concatenate(keys)[order]
+
+
+class MidiDeviceManager:
+    """
+    MIDI设备管理：打开全部（或名称包含 selected 中任一关键字的）输入端口，
+    后台线程每隔 poll_interval 秒比对一次端口列表，新插入的端口自动打开，拔出的端口关闭。
+
+    每个端口以 (名称, 同名序号) 标识，同型号的多台键盘也能区分；该标识作为
+    MidiInputQueue 的来源，各端口的回调直接写入各自的缓冲，不经过额外的转发线程。
+    """
+
+    def __init__(self, queue, selected=None, poll_interval=1.0, client_name="Pianist"):
+        self.queue = queue
+        self.selected = list(selected or [])
+        self.poll_interval = poll_interval
+        self.client_name = client_name
+        self.ports = {}  # 端口标识 -> 已打开的 rtmidi.MidiIn
+        self.lock = Lock()  # 只保护端口表（扫描与关闭），不在消息路径上
+        self.stopped = Event()
+        self.thread = None
+        self.probe = None
+        self.on_change = None  # 端口变化回调 on_change(已打开, 已关闭)，在轮询线程中调用
+
+    def wanted(self, name):
+        return not self.selected or any(keyword in name for keyword in self.selected)
+
+    @staticmethod
+    def port_keys(names):
+        """端口名称列表 -> [(端口标识, 端口序号)]，同名端口按出现顺序编号"""
+        seen = {}
+        keys = []
+        for index, name in enumerate(names):
+            seen[name] = seen.get(name, 0) + 1
+            keys.append(((name, seen[name]), index))
+        return keys
+
+    def scan(self):
+        """比对端口列表并打开/关闭端口，返回 (新打开的端口, 已关闭的端口)"""
+        import rtmidi
+
+        with self.lock:
+            if self.probe is None:
+                self.probe = rtmidi.MidiIn(name=f"{self.client_name} probe")
+            available = dict(self.port_keys(self.probe.get_ports()))
+            closed = [key for key in self.ports if key not in available]
+            for key in closed:
+                self.ports.pop(key).close_port()
+            opened = []
+            for key, index in available.items():
+                if key in self.ports or not self.wanted(key[0]):
+                    continue
+                try:
+                    midi_in = rtmidi.MidiIn(name=self.client_name)
+                    midi_in.open_port(index)
+                except Exception as e:
+                    print(f"MIDI端口打开失败: {key[0]}，错误：{e}")
+                    continue
+                self.queue.reset_clock(key)
+                midi_in.set_callback(self.queue.callback, key)
+                self.ports[key] = midi_in
+                opened.append(key)
+        if (opened or closed) and self.on_change is not None:
+            self.on_change(opened, closed)
+        return opened, closed
+
+    def start(self):
+        """立即扫描一次，然后在后台线程中轮询热插拔"""
+        self.scan()
+        self.stopped.clear()
+        self.thread = Thread(target=self._poll, name="MidiDeviceManager", daemon=True)
+        self.thread.start()
+        return self
+
+    def _poll(self):
+        while not self.stopped.wait(self.poll_interval):
+            try:
+                self.scan()
+            except Exception as e:
+                print(f"MIDI端口扫描失败: {e}")
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        with self.lock:
+            for midi_in in self.ports.values():
+                midi_in.close_port()
+            self.ports.clear()
+            if self.probe is not None:
+                self.probe.delete()
+                self.probe = None
+
+    def port_names(self):
+        with self.lock:
+            return [name for name, _ in self.ports]
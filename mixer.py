@@ -0,0 +1,435 @@
+"""软件混音器：固定复音池 + NumPy分块混音（不依赖Qt，可离线复用）"""
+from collections import deque
+from functools import lru_cache
+
+import numpy as np
+
+# 命令队列中的指令类型
+CMD_NOTE_ON = 0
+CMD_NOTE_OFF = 1
+CMD_ALL_OFF = 2
+CMD_CONTROL = 3
+
+# 踏板与通道模式控制器（MIDI CC编号）
+CC_SUSTAIN = 64
+CC_SOSTENUTO = 66
+CC_SOFT = 67
+CC_ALL_SOUND_OFF = 120
+CC_ALL_NOTES_OFF = 123
+PEDAL_CONTROLLERS = (CC_SUSTAIN, CC_SOSTENUTO, CC_SOFT)
+
+# 音符状态表中的标志位
+NOTE_HELD = 1  # 琴键按下
+NOTE_SUSTAINED = 2  # 琴键已松开，由踏板延音
+NOTE_SOSTENUTO = 4  # 踩下持音踏板时正按着，持音踏板松开前不释放
+
+SOFT_PEDAL_VELOCITY = 0.75  # 弱音踏板踩下时力度（选层与增益）的缩放
+
+DEFAULT_SAMPLE_RATE = 48000
+DEFAULT_CHANNELS = 2
+MAX_BLOCK_FRAMES = 4096
+# 与 sample_bank.BASE_VELOCITY 一致：不带力度后缀的采样所代表的力度层
+BASE_VELOCITY = 100
+
+
+def velocity_curve(exponent=1.0):
+    """力度 -> 增益的预计算表（128项），增益 = (力度/127)^exponent，exponent=1 为线性"""
+    curve = (np.arange(128, dtype=np.float64) / 127) ** exponent
+    return curve.astype(np.float32)
+
+
+@lru_cache(maxsize=None)
+def layer_table(velocities):
+    """
+    力度层交叉淡化表：velocities 为升序的层力度元组，返回每个力度（0~127）的
+    (下层序号, 上层序号, 上层权重)。两层之间线性淡化，低于最低层或高于最高层时只用端点层。
+    """
+    layers = np.asarray(velocities, dtype=np.float64)
+    velocity = np.arange(128, dtype=np.float64)
+    low = np.clip(np.searchsorted(layers, velocity, side='right') - 1, 0, len(layers) - 1)
+    high = np.minimum(low + 1, len(layers) - 1)
+    span = layers[high] - layers[low]
+    weight = np.where(span > 0, (velocity - layers[low]) / np.where(span > 0, span, 1), 0.0)
+    weight = np.clip(weight, 0.0, 1.0)
+    return tuple(low.tolist()), tuple(high.tolist()), tuple(weight.tolist())
+
+
+def decode_audio_file(path, sample_rate=DEFAULT_SAMPLE_RATE):
+    """通过pydub解码音频文件，返回 (帧数, 声道数) 的int16数组"""
+    from pydub import AudioSegment
+
+    segment = AudioSegment.from_file(path)
+    if segment.frame_rate != sample_rate:
+        segment = segment.set_frame_rate(sample_rate)
+    if segment.sample_width != 2:
+        segment = segment.set_sample_width(2)
+    data = np.array(segment.get_array_of_samples(), dtype=np.int16)
+    return data.reshape(-1, segment.channels)
+
+
+class Voice:
+    """复音池中的单个发声单元"""
+    __slots__ = ('note', 'data', 'scale', 'pos', 'gain', 'blend', 'blend_scale', 'blend_gain', 'length',
+                 'env', 'env_step', 'serial', 'audible')
+
+    def __init__(self):
+        self.note = -1
+        self.data = None
+        self.scale = 1.0
+        self.pos = 0
+        self.gain = 0.0
+        # 交叉淡化时同时播放的第二个力度层
+        self.blend = None
+        self.blend_scale = 1.0
+        self.blend_gain = 0.0
+        self.length = 0
+        self.env = 0.0
+        self.env_step = 0.0  # 每帧包络衰减量，0表示保持
+        self.serial = 0
+        self.audible = False  # 是否已输出过非零采样
+
+    @property
+    def active(self):
+        return self.note >= 0
+
+    @property
+    def releasing(self):
+        return self.env_step > 0
+
+    def reset(self):
+        self.note = -1
+        self.data = None
+        self.blend = None
+
+
+class Mixer:
+    """
+    将所有音符混合到单一输出流。
+
+    note_on/note_off 只向无锁命令队列（deque 的 append/popleft 是原子操作）
+    追加指令，由音频线程在 render 中统一消费，界面线程从不阻塞。
+
+    力度经预计算的增益曲线换算为音量；登记了力度层的音符按力度选择相邻两层，
+    在同一个发声单元内按 layer_table 的权重交叉淡化。各力度层应归一化到相同峰值
+    （generate_piano_sounds 即如此输出），层只提供音色差异，响度只由增益曲线决定。
+
+    踏板（延音CC64、持音CC66、弱音CC67）同样经命令队列进入音频线程：音符状态表
+    note_state 按位记录按下/延音/持音，踏板保持的音符松键时不释放，抬起踏板时统一释放。
+    延音音符数超过 max_sustained 时最早的先释放，复音池抢占时也优先于仍按着的音符。
+    """
+
+    def __init__(self, sample_rate=DEFAULT_SAMPLE_RATE, channels=DEFAULT_CHANNELS,
+                 max_voices=32, release_ms=200, volume=0.8, velocity_exponent=1.0, max_sustained=None):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.volume = volume
+        # 释放淡出时长，与 PianoKey.release 的200ms淡出一致
+        self.release_frames = max(1, int(sample_rate * release_ms / 1000))
+        self.samples = {}  # MIDI编号 -> (数据, 归一化系数)
+        # MIDI编号 -> (交叉淡化表, 各层 (数据, 归一化系数))，基础层为None，发声时取 samples 中的当前数据
+        self.layers = {}
+        self.velocity_gain = velocity_curve(velocity_exponent)
+        self.commands = deque()
+        self.voices = [Voice() for _ in range(max_voices)]
+        # 音符状态表（仅音频线程读写）：标志位、每个音符的发声单元数、按延音先后排列的延音音符
+        self.note_state = bytearray(128)
+        self.sounding = [0] * 128
+        self.sustained = {}
+        self.max_sustained = max_sustained if max_sustained is not None else max_voices * 3 // 4
+        self.pedals = {CC_SUSTAIN: False, CC_SOSTENUTO: False, CC_SOFT: False}
+        self._serial = 0
+        # 延迟追踪：开启后记录本块中首次输出非零采样的音符
+        self.tracing = False
+        self.first_output = []
+        # 预分配混音缓冲，render 过程中不再申请内存
+        self._mix = np.zeros((MAX_BLOCK_FRAMES, channels), dtype=np.float32)
+        self._tmp = np.zeros((MAX_BLOCK_FRAMES, channels), dtype=np.float32)
+        self._env = np.zeros(MAX_BLOCK_FRAMES, dtype=np.float32)
+        self._ramp = np.arange(1, MAX_BLOCK_FRAMES + 1, dtype=np.float32)
+        self._pcm = np.zeros((MAX_BLOCK_FRAMES, channels), dtype=np.int16)
+
+    # ---- 采样管理 ----
+    def _prepare(self, data):
+        if data.ndim == 1:
+            data = data.reshape(-1, 1)
+        if data.shape[1] > self.channels:
+            # 采样声道多于输出声道时先下混
+            data = data.mean(axis=1, keepdims=True).astype(data.dtype)
+        scale = 1.0 / 32768 if data.dtype == np.int16 else 1.0
+        return data, scale
+
+    def set_sample(self, note, data):
+        """登记音符采样，data 为 (帧数, 声道数) 的int16或float32数组"""
+        if data is None:
+            self.samples.pop(note, None)
+            return
+        self.samples[note] = self._prepare(data)
+
+    def set_layers(self, note, layers, base_velocity=BASE_VELOCITY):
+        """
+        登记音符的力度层 {力度: 数据}（不含基础采样，基础采样视为 base_velocity 层）。
+        数据可以是内存映射视图，只有被演奏到的层才会换入内存。
+        """
+        if not layers:
+            self.layers.pop(note, None)
+            return
+        velocities = tuple(sorted(set(layers) | {base_velocity}))
+        data = tuple(None if velocity == base_velocity else self._prepare(layers[velocity])
+                     for velocity in velocities)
+        self.layers[note] = (layer_table(velocities), data)
+
+    def clear_layers(self):
+        self.layers = {}
+
+    def set_velocity_curve(self, exponent):
+        self.velocity_gain = velocity_curve(exponent)
+
+    def has_sample(self, note):
+        return note in self.samples
+
+    # ---- 线程安全的控制接口 ----
+    def note_on(self, note, velocity=127):
+        if 0 <= note < 128:
+            self.commands.append((CMD_NOTE_ON, note, velocity))
+
+    def note_off(self, note):
+        if 0 <= note < 128:
+            self.commands.append((CMD_NOTE_OFF, note, 0))
+
+    def all_notes_off(self):
+        self.commands.append((CMD_ALL_OFF, 0, 0))
+
+    def control_change(self, controller, value):
+        """踏板与通道模式控制（MIDI CC），value>=64 视为踩下"""
+        self.commands.append((CMD_CONTROL, controller, value))
+
+    def set_volume(self, volume):
+        self.volume = max(0.0, min(1.0, volume))
+
+    @property
+    def active_voices(self):
+        return sum(1 for voice in self.voices if voice.active)
+
+    # ---- 音频线程 ----
+    def _drain_commands(self):
+        commands = self.commands
+        while commands:
+            cmd, note, velocity = commands.popleft()
+            if cmd == CMD_NOTE_ON:
+                self._key_down(note, velocity)
+            elif cmd == CMD_NOTE_OFF:
+                self._key_up(note)
+            elif cmd == CMD_CONTROL:
+                self._control(note, velocity)
+            elif cmd == CMD_ALL_OFF:
+                self._all_off()
+
+    # ---- 音符状态与踏板 ----
+    def _key_down(self, note, velocity):
+        if not 0 <= note < 128:
+            return  # 音频线程中不能抛出异常，超出MIDI范围的音符直接忽略
+        if velocity <= 0:
+            self._key_up(note)
+            return
+        state = self.note_state[note]
+        if state & NOTE_SUSTAINED:
+            self.sustained.pop(note, None)
+        self.note_state[note] = (state | NOTE_HELD) & ~NOTE_SUSTAINED
+        if self.pedals[CC_SOFT]:
+            velocity = max(1, int(velocity * SOFT_PEDAL_VELOCITY))
+        self._start_voice(note, velocity)
+
+    def _key_up(self, note):
+        if not 0 <= note < 128:
+            return
+        state = self.note_state[note] & ~NOTE_HELD
+        if self.pedals[CC_SUSTAIN] or state & NOTE_SOSTENUTO:
+            # 踏板保持：只记录，不释放
+            if self.sounding[note]:
+                self.note_state[note] = state | NOTE_SUSTAINED
+                self.sustained[note] = None
+                self._limit_sustained()
+            else:
+                self.note_state[note] = state & ~NOTE_SUSTAINED
+            return
+        self.note_state[note] = state
+        self._release_note(note)
+
+    def _limit_sustained(self):
+        """延音音符超过上限时，按延音先后释放最早的音符"""
+        while len(self.sustained) > self.max_sustained:
+            note = next(iter(self.sustained))
+            self._drop_sustained(note)
+
+    def _drop_sustained(self, note):
+        self.sustained.pop(note, None)
+        self.note_state[note] &= ~NOTE_SUSTAINED
+        self._release_note(note)
+
+    def _control(self, controller, value):
+        if controller in (CC_ALL_NOTES_OFF, CC_ALL_SOUND_OFF):
+            self._all_off()
+            return
+        if controller not in self.pedals:
+            return
+        down = value >= 64
+        if self.pedals[controller] == down:
+            return
+        self.pedals[controller] = down
+        state = self.note_state
+        if controller == CC_SOSTENUTO:
+            if down:
+                # 只捕获此刻按着（或已由延音踏板保持）的音符
+                for note in range(128):
+                    if state[note] & (NOTE_HELD | NOTE_SUSTAINED):
+                        state[note] |= NOTE_SOSTENUTO
+                return
+            for note in range(128):
+                state[note] &= ~NOTE_SOSTENUTO
+        if not down and controller != CC_SOFT:
+            sustain = self.pedals[CC_SUSTAIN]
+            for note in list(self.sustained):
+                if not sustain and not state[note] & NOTE_SOSTENUTO:
+                    self._drop_sustained(note)
+
+    def _all_off(self):
+        for voice in self.voices:
+            if voice.active:
+                self._release_voice(voice)
+        self.note_state[:] = bytes(128)
+        self.sustained.clear()
+
+    def held_notes(self):
+        return [note for note in range(128) if self.note_state[note] & NOTE_HELD]
+
+    def sustained_notes(self):
+        return list(self.sustained)
+
+    def sounding_notes(self):
+        return [note for note in range(128) if self.sounding[note]]
+
+    # ---- 发声单元 ----
+    def _start_voice(self, note, velocity):
+        sample = self.samples.get(note)
+        if sample is None or velocity <= 0:
+            return
+        velocity = min(velocity, 127)
+        gain = float(self.velocity_gain[velocity])
+        blend, weight = None, 0.0
+        layered = self.layers.get(note)
+        if layered is not None:
+            (low, high, weights), layers = layered
+            weight = weights[velocity]
+            if weight > 0:
+                blend = layers[high[velocity]] or sample
+            sample = layers[low[velocity]] or sample
+        # 同一音符重复敲击：旧发声淡出而非截断
+        self._release_note(note)
+        voice = self._allocate_voice()
+        if voice.active:
+            self._free_voice(voice)
+        self.sounding[note] += 1
+        self._serial += 1
+        voice.note = note
+        voice.data, voice.scale = sample
+        voice.pos = 0
+        voice.gain = gain * (1.0 - weight)
+        voice.length = len(voice.data)
+        if blend is not None:
+            voice.blend, voice.blend_scale = blend
+            voice.blend_gain = gain * weight
+            voice.length = max(voice.length, len(voice.blend))
+        else:
+            voice.blend = None
+        voice.env = 1.0
+        voice.env_step = 0.0
+        voice.serial = self._serial
+        voice.audible = False
+
+    def _allocate_voice(self):
+        """优先空闲单元，其次抢占包络最低的释放中单元、最早的踏板延音单元，最后抢占最早发声的单元"""
+        steal = None
+        steal_rank = None
+        for voice in self.voices:
+            if not voice.active:
+                return voice
+            if voice.releasing:
+                rank = (0, voice.env)
+            elif self.note_state[voice.note] & NOTE_SUSTAINED:
+                rank = (1, voice.serial)
+            else:
+                rank = (2, voice.serial)
+            if steal_rank is None or rank < steal_rank:
+                steal, steal_rank = voice, rank
+        return steal
+
+    def _free_voice(self, voice):
+        """发声结束：更新状态表，延音音符已无声时移出延音列表"""
+        note = voice.note
+        voice.reset()
+        self.sounding[note] -= 1
+        if not self.sounding[note] and self.note_state[note] & NOTE_SUSTAINED:
+            self.sustained.pop(note, None)
+            self.note_state[note] &= ~NOTE_SUSTAINED
+
+    def _release_voice(self, voice):
+        if not voice.releasing:
+            voice.env_step = voice.env / self.release_frames
+
+    def _release_note(self, note):
+        for voice in self.voices:
+            if voice.note == note:
+                self._release_voice(voice)
+
+    def render(self, frames):
+        """混合 frames 帧，返回 (frames, channels) 的float32视图（下次调用前有效）"""
+        self._drain_commands()
+        mix = self._mix[:frames]
+        mix.fill(0.0)
+        for voice in self.voices:
+            if voice.active:
+                self._mix_voice(voice, mix, frames)
+        mix *= self.volume
+        np.clip(mix, -1.0, 1.0, out=mix)
+        return mix
+
+    def render_int16(self, frames):
+        """混合并转换为交错的16位PCM字节"""
+        mix = self.render(frames)
+        pcm = self._pcm[:frames]
+        np.multiply(mix, 32767, out=pcm, casting='unsafe')
+        return pcm.tobytes()
+
+    def _mix_voice(self, voice, mix, frames):
+        data = voice.data
+        pos = voice.pos
+        n = min(frames, voice.length - pos)
+        if n <= 0:
+            self._free_voice(voice)
+            return
+        if voice.blend is None:
+            chunk = data[pos:pos + n]
+            tmp = self._tmp[:n, :chunk.shape[1]]
+            np.multiply(chunk, np.float32(voice.gain * voice.scale), out=tmp)
+        else:
+            # 两个力度层长度可能不同，较短的一层结束后以静音补齐
+            tmp = self._tmp[:n]
+            tmp.fill(0.0)
+            for layer, gain in ((data, voice.gain * voice.scale), (voice.blend, voice.blend_gain * voice.blend_scale)):
+                m = min(n, len(layer) - pos)
+                if m > 0:
+                    tmp[:m] += layer[pos:pos + m] * np.float32(gain)
+        if voice.env_step > 0:
+            env = self._env[:n]
+            np.multiply(self._ramp[:n], -voice.env_step, out=env)
+            env += voice.env
+            np.maximum(env, 0.0, out=env)
+            tmp *= env[:, None]
+            voice.env = float(env[-1])
+        mix[:n] += tmp
+        if self.tracing and not voice.audible and tmp.any():
+            voice.audible = True
+            self.first_output.append(voice.note)
+        voice.pos += n
+        if voice.pos >= voice.length or (voice.env_step > 0 and voice.env <= 0.0):
+            self._free_voice(voice)
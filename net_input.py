@@ -0,0 +1,462 @@
+"""
+本机网络输入：asyncio 服务器接收 UDP原始MIDI、OSC 与（可选）WebSocket 消息，
+解码后写入 MidiInputQueue，与硬件MIDI走同一条 drain -> handle_midi_note 路径（不依赖Qt）。
+
+    python net_input.py                          # 在本机监听，打印收到的事件与延迟
+    python net_input.py --send /note 60 100      # 通过OSC发送一条消息
+    python net_input.py --send /pedal 64 127
+
+OSC地址：/note 音符 力度（力度0为松开）、/note_on 音符 力度、/note_off 音符、
+/pedal 控制器 取值、/sustain 取值、/midi m（4字节MIDI消息）或 b（原始MIDI字节）。
+取值为0~1之间的浮点数时按比例换算到0~127。
+WebSocket：二进制帧为原始MIDI字节，文本帧为JSON，如 {"note": 60, "velocity": 100}、
+{"cc": 64, "value": 127}，或由它们组成的列表。
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import socket
+import struct
+import sys
+import time
+from threading import Event, Thread
+
+import numpy as np
+
+from midi_input import MidiInputQueue
+from mixer import CC_SUSTAIN
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_UDP_PORT = 9000
+DEFAULT_OSC_PORT = 9001
+DEFAULT_WEBSOCKET_PORT = 9002
+
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+MAX_FRAME_BYTES = 1 << 20
+
+
+class InputDecodeError(ValueError):
+    pass
+
+
+# ---- 原始MIDI字节流 ----
+def midi_message_length(status):
+    """状态字节对应的消息总长度（含状态字节），系统独占返回0"""
+    if status < 0xF0:
+        return 2 if status & 0xF0 in (0xC0, 0xD0) else 3
+    if status == 0xF0:
+        return 0
+    return {0xF1: 2, 0xF2: 3, 0xF3: 2}.get(status, 1)
+
+
+def split_midi_bytes(data):
+    """
+    把一段MIDI字节切分为消息列表。
+    省略状态字节的消息（运行状态）原样保留为只含数据字节的消息，由 parse_messages 补全；
+    系统独占消息被跳过，实时消息单独成条。
+    """
+    messages = []
+    expected = 3  # 运行状态消息的长度（含被省略的状态字节）
+    current = None
+    in_sysex = False
+    for byte in data:
+        if byte >= 0xF8:
+            messages.append([byte])
+            continue
+        if in_sysex:
+            if byte & 0x80:
+                in_sysex = False
+                if byte == 0xF7:
+                    continue
+            else:
+                continue
+        if byte & 0x80:
+            if byte == 0xF0:
+                in_sysex = True
+                current = None
+                continue
+            length = midi_message_length(byte)
+            if byte < 0xF0:
+                expected = length
+            current = [byte]
+        elif current is None or len(current) >= (midi_message_length(current[0]) if current[0] & 0x80 else expected - 1):
+            current = [byte]  # 运行状态：新消息从数据字节开始
+        else:
+            current.append(byte)
+        target = midi_message_length(current[0]) if current[0] & 0x80 else expected - 1
+        if len(current) == target:
+            messages.append(current)
+    return messages
+
+
+# ---- OSC ----
+def _osc_string(data, pos):
+    end = data.index(b'\0', pos)
+    return data[pos:end].decode('utf-8', 'replace'), (end + 4) & ~3
+
+
+def decode_osc(data):
+    """解码OSC消息或包（可嵌套），返回 [(地址, 参数列表)]；包的时间标签被忽略，立即执行"""
+    try:
+        if data.startswith(b'#bundle\0'):
+            messages = []
+            pos = 16  # '#bundle\0' + 8字节时间标签
+            while pos + 4 <= len(data):
+                size = struct.unpack_from('>i', data, pos)[0]
+                messages += decode_osc(data[pos + 4:pos + 4 + size])
+                pos += 4 + size
+            return messages
+        address, pos = _osc_string(data, 0)
+        if pos >= len(data):
+            return [(address, [])]
+        tags, pos = _osc_string(data, pos)
+        args = []
+        for tag in tags[1:]:
+            if tag == 'i':
+                args.append(struct.unpack_from('>i', data, pos)[0])
+                pos += 4
+            elif tag == 'f':
+                args.append(struct.unpack_from('>f', data, pos)[0])
+                pos += 4
+            elif tag == 'm':
+                args.append(bytes(data[pos + 1:pos + 4]))  # 端口号 + 状态 + 数据1 + 数据2
+                pos += 4
+            elif tag == 'b':
+                size = struct.unpack_from('>i', data, pos)[0]
+                args.append(bytes(data[pos + 4:pos + 4 + size]))
+                pos += (4 + size + 3) & ~3
+            elif tag == 's':
+                value, pos = _osc_string(data, pos)
+                args.append(value)
+            elif tag in 'TFNI':
+                args.append({'T': True, 'F': False}.get(tag))
+            else:
+                raise InputDecodeError(f"不支持的OSC类型: {tag}")
+        return [(address, args)]
+    except (ValueError, struct.error) as e:
+        raise InputDecodeError(f"OSC消息格式错误: {e}") from e
+
+
+def _osc_pad(data):
+    return data + b'\0' * (4 - len(data) % 4)
+
+
+def encode_osc(address, *args):
+    """编码一条OSC消息，参数支持 int、float、bytes（blob）与 str"""
+    tags = ','
+    payload = b''
+    for arg in args:
+        if isinstance(arg, bool) or not isinstance(arg, (int, float, bytes, str)):
+            raise TypeError(f"不支持的OSC参数: {arg!r}")
+        if isinstance(arg, int):
+            tags += 'i'
+            payload += struct.pack('>i', arg)
+        elif isinstance(arg, float):
+            tags += 'f'
+            payload += struct.pack('>f', arg)
+        elif isinstance(arg, bytes):
+            tags += 'b'
+            payload += struct.pack('>i', len(arg)) + arg + b'\0' * (-len(arg) % 4)
+        else:
+            tags += 's'
+            payload += _osc_pad(arg.encode())
+    return _osc_pad(address.encode()) + _osc_pad(tags.encode()) + payload
+
+
+def _midi_value(value):
+    """OSC取值换算为0~127：0~1的浮点数按比例换算"""
+    if isinstance(value, float) and 0.0 <= value <= 1.0:
+        return int(round(value * 127))
+    return max(0, min(127, int(value)))
+
+
+def osc_to_midi(address, args):
+    """OSC消息 -> MIDI消息列表，未知地址返回空列表"""
+    try:
+        if address == '/note':
+            velocity = _midi_value(args[1]) if len(args) > 1 else 127
+            return [[0x90, int(args[0]) & 0x7F, velocity]]
+        if address == '/note_on':
+            return [[0x90, int(args[0]) & 0x7F, _midi_value(args[1]) if len(args) > 1 else 127]]
+        if address == '/note_off':
+            return [[0x80, int(args[0]) & 0x7F, 0]]
+        if address in ('/pedal', '/cc'):
+            return [[0xB0, int(args[0]) & 0x7F, _midi_value(args[1])]]
+        if address == '/sustain':
+            return [[0xB0, CC_SUSTAIN, _midi_value(args[0])]]
+        if address == '/midi':
+            messages = []
+            for arg in args:
+                if isinstance(arg, bytes):
+                    messages += split_midi_bytes(arg)
+            return messages
+    except (IndexError, TypeError, ValueError) as e:
+        raise InputDecodeError(f"OSC参数错误: {address} {args}") from e
+    return []
+
+
+def decode_osc_midi(data):
+    messages = []
+    for address, args in decode_osc(data):
+        messages += osc_to_midi(address, args)
+    return messages
+
+
+# ---- WebSocket（仅本机，无扩展、无子协议） ----
+def json_to_midi(text):
+    """WebSocket文本帧：单个或一组 {"note", "velocity"} / {"cc", "value"} 对象"""
+    try:
+        items = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise InputDecodeError(f"JSON格式错误: {e}") from e
+    messages = []
+    for item in items if isinstance(items, list) else [items]:
+        if not isinstance(item, dict):
+            raise InputDecodeError(f"无法识别的消息: {item!r}")
+        if 'note' in item:
+            velocity = _midi_value(item.get('velocity', 127))
+            messages.append([0x90 if velocity else 0x80, int(item['note']) & 0x7F, velocity])
+        elif 'cc' in item:
+            messages.append([0xB0, int(item['cc']) & 0x7F, _midi_value(item.get('value', 0))])
+        else:
+            raise InputDecodeError(f"无法识别的消息: {item!r}")
+    return messages
+
+
+def websocket_accept(key):
+    return base64.b64encode(hashlib.sha1(key.encode() + WEBSOCKET_GUID).digest()).decode()
+
+
+async def read_websocket_frame(reader):
+    """读取一帧，返回 (FIN, 操作码, 负载)；客户端帧的掩码已去除"""
+    head = await reader.readexactly(2)
+    fin, opcode = head[0] & 0x80, head[0] & 0x0F
+    masked, length = head[1] & 0x80, head[1] & 0x7F
+    if length == 126:
+        length = struct.unpack('>H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('>Q', await reader.readexactly(8))[0]
+    if length > MAX_FRAME_BYTES:
+        raise InputDecodeError(f"WebSocket帧过大: {length}")
+    mask = await reader.readexactly(4) if masked else None
+    payload = await reader.readexactly(length)
+    if mask is not None:
+        data = np.frombuffer(payload, dtype=np.uint8)
+        payload = (data ^ np.resize(np.frombuffer(mask, dtype=np.uint8), len(data))).tobytes()
+    return bool(fin), opcode, payload
+
+
+def websocket_frame(opcode, payload=b''):
+    """服务器端帧（不加掩码）"""
+    length = len(payload)
+    if length < 126:
+        head = struct.pack('>BB', 0x80 | opcode, length)
+    elif length < 1 << 16:
+        head = struct.pack('>BBH', 0x80 | opcode, 126, length)
+    else:
+        head = struct.pack('>BBQ', 0x80 | opcode, 127, length)
+    return head + payload
+
+
+# ---- 服务器 ----
+class _DatagramInput(asyncio.DatagramProtocol):
+    def __init__(self, server, source, decode):
+        self.server = server
+        self.source = source
+        self.decode = decode
+
+    def datagram_received(self, data, addr):
+        self.server.feed(self.source, self.decode, data)
+
+
+class NetInputServer:
+    """
+    本机网络输入服务器。
+
+    在独立线程中运行 asyncio 事件循环，同时监听 UDP原始MIDI、OSC 与可选的 WebSocket。
+    每个数据报或WebSocket帧作为一批解码，全部消息以到达时刻写入 MidiInputQueue，
+    来源分别为 'udp'、'osc'、'websocket'（事件循环是各来源唯一的生产者）；
+    端口为 None 的协议不启用。延迟统计见 MidiInputQueue.latency_stats()。
+    """
+
+    def __init__(self, queue, host=DEFAULT_HOST, udp_port=DEFAULT_UDP_PORT, osc_port=DEFAULT_OSC_PORT,
+                 websocket_port=None):
+        self.queue = queue
+        self.host = host
+        self.udp_port = udp_port
+        self.osc_port = osc_port
+        self.websocket_port = websocket_port
+        self.loop = None
+        self.thread = None
+        self.ready = Event()
+        self.transports = []
+        self.websocket_server = None
+        self.errors = 0  # 无法解码的数据报/帧数
+        self.addresses = {}  # 来源 -> 实际监听的 (主机, 端口)
+
+    def feed(self, source, decode, data):
+        """解码一批数据并写入输入队列，所有消息共用到达时刻"""
+        now = time.monotonic_ns()
+        try:
+            messages = decode(data)
+        except InputDecodeError as e:
+            self.errors += 1
+            print(f"网络输入解码失败（{source}）: {e}")
+            return
+        for message in messages:
+            self.queue.push(message, now, source)
+
+    def start(self, timeout=5.0):
+        """在后台线程中启动事件循环，监听就绪后返回"""
+        self.ready.clear()
+        self.thread = Thread(target=self._run, name="NetInputServer", daemon=True)
+        self.thread.start()
+        self.ready.wait(timeout)
+        return self
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._open())
+        finally:
+            self.ready.set()
+        self.loop.run_forever()
+        self.loop.run_until_complete(self._close())
+        self.loop.close()
+
+    async def _open(self):
+        datagram = (('udp', self.udp_port, split_midi_bytes), ('osc', self.osc_port, decode_osc_midi))
+        for source, port, decode in datagram:
+            if port is None:
+                continue
+            try:
+                transport, _ = await self.loop.create_datagram_endpoint(
+                    lambda source=source, decode=decode: _DatagramInput(self, source, decode),
+                    local_addr=(self.host, port))
+            except OSError as e:
+                print(f"网络输入监听失败（{source} {self.host}:{port}）: {e}")
+                continue
+            self.transports.append(transport)
+            self.addresses[source] = transport.get_extra_info('sockname')[:2]
+        if self.websocket_port is not None:
+            try:
+                self.websocket_server = await asyncio.start_server(
+                    self._websocket_client, self.host, self.websocket_port)
+            except OSError as e:
+                print(f"网络输入监听失败（websocket {self.host}:{self.websocket_port}）: {e}")
+            else:
+                self.addresses['websocket'] = self.websocket_server.sockets[0].getsockname()[:2]
+
+    async def _close(self):
+        for transport in self.transports:
+            transport.close()
+        self.transports = []
+        if self.websocket_server is not None:
+            self.websocket_server.close()
+            await self.websocket_server.wait_closed()
+            self.websocket_server = None
+
+    async def _websocket_client(self, reader, writer):
+        try:
+            request = await reader.readuntil(b'\r\n\r\n')
+            headers = {}
+            for line in request.decode('latin-1').split('\r\n')[1:]:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            key = headers.get('sec-websocket-key')
+            if headers.get('upgrade', '').lower() != 'websocket' or not key:
+                writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n')
+                return
+            writer.write(('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                          f'Sec-WebSocket-Accept: {websocket_accept(key)}\r\n\r\n').encode())
+            await writer.drain()
+            fragments, fragment_opcode = [], 0
+            while True:
+                fin, opcode, payload = await read_websocket_frame(reader)
+                if opcode == 0x8:
+                    writer.write(websocket_frame(0x8, payload[:2]))
+                    break
+                if opcode == 0x9:
+                    writer.write(websocket_frame(0xA, payload))
+                    continue
+                if opcode in (0x1, 0x2):
+                    fragments, fragment_opcode = [payload], opcode
+                elif opcode == 0x0:
+                    fragments.append(payload)
+                else:
+                    continue
+                if not fin:
+                    continue
+                data = b''.join(fragments)
+                if fragment_opcode == 0x1:
+                    self.feed('websocket', json_to_midi, data.decode('utf-8', 'replace'))
+                else:
+                    self.feed('websocket', split_midi_bytes, data)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        except InputDecodeError as e:
+            print(f"WebSocket连接已关闭: {e}")
+        finally:
+            writer.close()
+
+    def stop(self):
+        if self.loop is not None and self.thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+        self.thread = None
+        self.loop = None
+
+
+def send_osc(address, *args, host=DEFAULT_HOST, port=DEFAULT_OSC_PORT):
+    """发送一条OSC消息（供测试工具与其他进程使用）"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.sendto(encode_osc(address, *args), (host, port))
+
+
+def _number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pianist 本机网络输入：监听并打印事件，或发送OSC消息")
+    parser.add_argument('--host', default=DEFAULT_HOST, help="监听/发送地址")
+    parser.add_argument('--udp-port', type=int, default=DEFAULT_UDP_PORT, help="原始MIDI的UDP端口")
+    parser.add_argument('--osc-port', type=int, default=DEFAULT_OSC_PORT, help="OSC的UDP端口")
+    parser.add_argument('--websocket-port', type=int, help="WebSocket端口（缺省不启用）")
+    parser.add_argument('--send', nargs='+', metavar='ARG', help="发送一条OSC消息：地址 参数...")
+    args = parser.parse_args(argv)
+
+    if args.send:
+        send_osc(args.send[0], *map(_number, args.send[1:]), host=args.host, port=args.osc_port)
+        return 0
+
+    queue = MidiInputQueue()
+    server = NetInputServer(queue, args.host, args.udp_port, args.osc_port, args.websocket_port).start()
+    for source, (host, port) in server.addresses.items():
+        print(f"正在监听 {source}: {host}:{port}")
+    if not server.addresses:
+        return 1
+    try:
+        while True:
+            time.sleep(0.01)
+            events, sources = queue.drain()
+            for event, source in zip(events.tolist(), sources.tolist()):
+                print(f"{queue.keys[source]}: 类型 {event[3]} 音符/控制器 {event[1]} 力度/取值 {event[2]}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+    for source, stats in queue.latency_stats().items():
+        print(f"{source}: {stats['count']} 条消息，延迟平均 {stats['mean']:.3f}ms，"
+              f"p95 {stats['p95']:.3f}ms，最大 {stats['max']:.3f}ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,31 @@
+"""音符名称与MIDI编号的预计算查找表（不依赖Qt，可在无界面环境中复用）"""
+
+NOTE_NAMES = ('C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B')
+
+# 钢琴88键范围 A0-C8
+PIANO_START = 21
+PIANO_END = 108
+MIDI_RANGE = 128
+
+# MIDI编号 -> 音符名称（如 60 -> 'C4'）
+MIDI_TO_NOTE = tuple(f"{NOTE_NAMES[midi % 12]}{midi // 12 - 1}" for midi in range(MIDI_RANGE))
+# 音符名称 -> MIDI编号（如 'C4' -> 60）
+NOTE_TO_MIDI = {name: midi for midi, name in enumerate(MIDI_TO_NOTE)}
+# MIDI编号 -> 是否为黑键
+IS_BLACK = tuple('#' in name for name in MIDI_TO_NOTE)
+
+
+def midi_to_note(midi_number):
+    return MIDI_TO_NOTE[midi_number]
+
+
+def note_to_midi(note_name, default=0):
+    return NOTE_TO_MIDI.get(note_name, default)
+
+
+def compile_keymap(key_map):
+    """将 {音符: 按键} 映射反转为 {按键+音程: 音符}，重复按键保留第一个"""
+    lookup = {}
+    for note, key in key_map.items():
+        lookup.setdefault(key, note)
+    return lookup
@@ -0,0 +1,241 @@
+"""
+离线渲染：用采样库与混音器把录音事件快于实时地混音为WAV/FLAC，分块流式写出。
+
+也可作为无界面的命令行批量渲染器使用，不依赖Qt、显示器或音频设备：
+    python offline_render.py song.mid -o song.flac
+    python offline_render.py midi/*.mid -o renders/ --format wav --jobs 8
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import wave
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from midi_file import MidiFileError, iter_midi_events
+from mixer import DEFAULT_SAMPLE_RATE, MAX_BLOCK_FRAMES, Mixer
+from recording import EVENT_CONTROL, EVENT_NOTE_ON
+from sample_bank import SampleBank
+
+DEFAULT_BLOCK_FRAMES = 4096
+# 最后一个事件之后最多再渲染的余音时长（秒）
+DEFAULT_TAIL_SECONDS = 8.0
+
+
+def render_blocks(events, bank, channels=2, block_frames=DEFAULT_BLOCK_FRAMES, volume=0.8,
+                  max_voices=64, tail_seconds=DEFAULT_TAIL_SECONDS, velocity_exponent=1.0):
+    """
+    逐块产出 (帧数, 声道数) 的float32混音结果。
+
+    events 为 EVENT_DTYPE 数组或按时间顺序产出此类数组的迭代器（如 iter_midi_events），
+    每个事件在其对应的采样帧处生效；释放淡出与实时引擎一致（200ms），
+    力度层、力度增益曲线（velocity_exponent）与踏板处理也与实时引擎相同。
+    产出的块会被复用，调用方需在取下一块前处理完。
+    block_frames 可大于混音器单次渲染上限 MAX_BLOCK_FRAMES，此时每块分多次渲染填满。
+    """
+    if block_frames < 1:
+        raise ValueError(f"block_frames 必须为正数: {block_frames}")
+    sample_rate = bank.sample_rate
+    mixer = Mixer(sample_rate, channels, max_voices=max_voices, volume=volume,
+                  velocity_exponent=velocity_exponent)
+    for midi in bank.notes():
+        mixer.set_sample(midi, bank.get(midi))
+    for midi in bank.layered_notes():
+        mixer.set_layers(midi, bank.layers(midi))
+
+    block = np.zeros((block_frames, channels), dtype=np.float32)
+    filled = 0
+    position = 0  # 已渲染的总帧数
+
+    def advance(frames):
+        """渲染 frames 帧，写满一块即产出"""
+        nonlocal filled, position
+        while frames > 0:
+            # 混音器的预分配缓冲只有 MAX_BLOCK_FRAMES 帧
+            n = min(frames, block_frames - filled, MAX_BLOCK_FRAMES)
+            block[filled:filled + n] = mixer.render(n)
+            filled += n
+            position += n
+            frames -= n
+            if filled == block_frames:
+                yield block
+                filled = 0
+
+    if isinstance(events, np.ndarray):
+        events = [events[np.argsort(events['time_ns'], kind='stable')]]
+    for chunk in events:
+        if not len(chunk):
+            continue
+        frames = (chunk['time_ns'] * sample_rate // 1_000_000_000).tolist()
+        for frame, note, velocity, event_type in zip(frames, chunk['note'].tolist(),
+                                                     chunk['velocity'].tolist(), chunk['type'].tolist()):
+            if frame > position:
+                yield from advance(frame - position)
+            if event_type == EVENT_NOTE_ON and velocity > 0:
+                mixer.note_on(note, velocity)
+            elif event_type == EVENT_CONTROL:
+                mixer.control_change(note, velocity)
+            else:
+                mixer.note_off(note)
+
+    # 余音：渲染到所有发声结束或达到上限
+    tail_end = position + int(tail_seconds * sample_rate)
+    while position < tail_end and (mixer.commands or mixer.active_voices):
+        yield from advance(min(block_frames - filled, tail_end - position))
+    if filled:
+        yield block[:filled]
+
+
+def pcm_bytes(block, bit_depth=16):
+    """float32块转换为小端交错PCM字节（16或24位）"""
+    if bit_depth == 24:
+        ints = (block * 8388607).astype('<i4')
+        return ints.view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    return (block * 32767).astype('<i2').tobytes()
+
+
+def write_wav(path, blocks, sample_rate, channels, bit_depth=16):
+    with wave.open(path, 'wb') as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(bit_depth // 8)
+        wav_file.setframerate(sample_rate)
+        for block in blocks:
+            wav_file.writeframes(pcm_bytes(block, bit_depth))
+
+
+def write_flac(path, blocks, sample_rate, channels, bit_depth=16):
+    """优先使用 soundfile 编码，未安装时通过管道交给 ffmpeg"""
+    try:
+        import soundfile
+    except ImportError:
+        soundfile = None
+
+    if soundfile is not None:
+        subtype = 'PCM_24' if bit_depth == 24 else 'PCM_16'
+        with soundfile.SoundFile(path, 'w', sample_rate, channels, subtype=subtype, format='FLAC') as f:
+            for block in blocks:
+                f.write(block)
+        return
+
+    if bit_depth == 24:
+        # 24位采样以左对齐的32位整数送入，编码为24位FLAC
+        input_format, encode = 's32le', ['-sample_fmt', 's32', '-bits_per_raw_sample', '24']
+    else:
+        input_format, encode = 's16le', ['-sample_fmt', 's16']
+    command = ['ffmpeg', '-y', '-loglevel', 'error', '-f', input_format, '-ar', str(sample_rate),
+               '-ac', str(channels), '-i', 'pipe:0', '-c:a', 'flac', *encode, path]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    try:
+        for block in blocks:
+            if bit_depth == 24:
+                process.stdin.write(((block * 8388607).astype('<i4') << 8).tobytes())
+            else:
+                process.stdin.write(pcm_bytes(block, 16))
+    finally:
+        process.stdin.close()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg 编码失败：{path}")
+
+
+def render_to_file(events, bank, path, channels=2, bit_depth=16, **options):
+    """按扩展名把事件渲染为 .wav 或 .flac 文件"""
+    blocks = render_blocks(events, bank, channels=channels, **options)
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.flac':
+        write_flac(path, blocks, bank.sample_rate, channels, bit_depth)
+    elif extension == '.wav':
+        write_wav(path, blocks, bank.sample_rate, channels, bit_depth)
+    else:
+        raise ValueError(f"不支持的输出格式: {extension}")
+
+
+# ---- 命令行批量渲染 ----
+_worker_bank = None
+
+
+def _init_worker(sound_dir, sample_rate, file_format):
+    """工作进程初始化：映射主进程已写好的采样缓存，各进程共享同一份页缓存"""
+    global _worker_bank
+    _worker_bank = SampleBank(sound_dir, sample_rate, file_format)
+    if not _worker_bank.load_cached():
+        _worker_bank.load()
+
+
+def render_midi_file(midi_path, output_path, bit_depth=16, volume=0.8, velocity_exponent=1.0):
+    """在工作进程中渲染单个MIDI文件，返回 (输入, 输出, 错误信息)"""
+    try:
+        render_to_file(iter_midi_events(midi_path), _worker_bank, output_path,
+                       bit_depth=bit_depth, volume=volume, velocity_exponent=velocity_exponent)
+    except (OSError, MidiFileError, RuntimeError, ValueError) as e:
+        return midi_path, output_path, str(e)
+    return midi_path, output_path, None
+
+
+def output_paths(inputs, output, file_format):
+    """单个输入且 -o 带扩展名时视为文件名，否则视为输出目录（缺省与输入同目录）"""
+    if len(inputs) == 1 and output and os.path.splitext(output)[1]:
+        return [output]
+    paths = []
+    for path in inputs:
+        name = os.path.splitext(os.path.basename(path))[0] + '.' + file_format
+        paths.append(os.path.join(output or os.path.dirname(path), name))
+    return paths
+
+
+def load_settings(path='config.json'):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def main(argv=None):
+    settings = load_settings()
+    parser = argparse.ArgumentParser(description="Pianist 离线渲染：把MIDI文件批量渲染为WAV/FLAC")
+    parser.add_argument('inputs', nargs='+', help="输入MIDI文件")
+    parser.add_argument('-o', '--output', help="输出文件（单个输入）或输出目录")
+    parser.add_argument('--format', choices=['flac', 'wav'], default='flac', help="输出格式")
+    parser.add_argument('--bit-depth', type=int, choices=[16, 24], default=16, help="输出位深")
+    parser.add_argument('--sound-dir', default='sounds', help="采样目录")
+    parser.add_argument('--sample-format', default=settings.get('file_format', 'm4a'), help="优先使用的采样格式")
+    parser.add_argument('--sample-rate', type=int, default=DEFAULT_SAMPLE_RATE, help="渲染采样率")
+    parser.add_argument('--volume', type=float, default=0.8, help="主音量")
+    parser.add_argument('--velocity-curve', type=float, default=settings.get('velocity_curve', 1.0),
+                        help="力度增益曲线指数，1为线性")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help="并行渲染的进程数")
+    args = parser.parse_args(argv)
+
+    outputs = output_paths(args.inputs, args.output, args.format)
+    for path in outputs:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    # 主进程先加载一次采样库，冷启动时解码并写入缓存，工作进程只需映射
+    bank = SampleBank(args.sound_dir, args.sample_rate, args.sample_format).load(jobs=args.jobs)
+    if not len(bank):
+        print(f"未找到采样：{args.sound_dir}")
+        return 1
+
+    failed = 0
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(outputs))), mp_context=context,
+                             initializer=_init_worker,
+                             initargs=(args.sound_dir, args.sample_rate, args.sample_format)) as pool:
+        futures = [pool.submit(render_midi_file, source, target, args.bit_depth, args.volume, args.velocity_curve)
+                   for source, target in zip(args.inputs, outputs)]
+        for future in as_completed(futures):
+            source, target, error = future.result()
+            if error:
+                failed += 1
+                print(f"渲染失败：{source}，错误：{error}")
+            else:
+                print(f"已渲染：{source} -> {target}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,22 +1,33 @@
 import sys, os, tempfile, markdown
+import math
+import multiprocessing
 import json
-import time
-from threading import Thread, Lock
 from PySide6.QtWidgets import (
     QApplication, QWidget, QHBoxLayout, QVBoxLayout,
     QPushButton, QLabel, QDialog, QGridLayout,
     QLineEdit, QGraphicsDropShadowEffect, QSizePolicy,
     QGraphicsView, QGraphicsScene, QGraphicsWidget, QGraphicsProxyWidget, QSlider, QComboBox, QScrollArea, QGroupBox,
-    QStyle, QTextEdit, QTextBrowser, QGraphicsRectItem, QGraphicsOpacityEffect
+    QStyle, QTextEdit, QTextBrowser, QGraphicsRectItem, QGraphicsOpacityEffect, QFileDialog, QGraphicsObject
 )
 from PySide6.QtCore import (
-    Qt, QUrl, QTimer, QPoint, Signal, QObject,
-    QSize, QPropertyAnimation, QEasingCurve, QRectF, QEvent, QTranslator, Property
+    Qt, QUrl, QTimer, QPoint, QPointF, Signal, QObject,
+    QSize, QSizeF, QPropertyAnimation, QEasingCurve, QRectF, QEvent, QTranslator, Property
 )
 from PySide6.QtMultimedia import QSoundEffect, QMediaPlayer, QAudioOutput
-from PySide6.QtGui import QColor, QPainter, QKeyEvent, QFont, QLinearGradient, QTransform
-import rtmidi
+from PySide6.QtGui import (
+    QColor, QPainter, QKeyEvent, QFont, QLinearGradient, QTransform, QPainterPath, QPixmap, QRadialGradient
+)
 from pydub import AudioSegment
+from note_tables import MIDI_RANGE, MIDI_TO_NOTE, NOTE_TO_MIDI, NOTE_NAMES, compile_keymap
+from audio_engine import AudioEngine
+from sample_bank import SampleBank, SampleResidency
+from playback import PlaybackScheduler
+from recording import EVENT_CONTROL, EVENT_NOTE_OFF, EVENT_NOTE_ON, EventLog
+from midi_file import MidiFileError, iter_midi_events, write_midi_file
+from midi_input import MidiDeviceManager, MidiInputQueue
+from net_input import NetInputServer
+from mixer import DEFAULT_SAMPLE_RATE
+from offline_render import render_to_file
 
 
 class CoverAnimProxy(QObject):
@@ -34,25 +45,184 @@ class CoverAnimProxy(QObject):
 
 
 class PianoSignal(QObject):
-    midi_note_on = Signal(int, int)  # MIDI音符按下信号
-    midi_note_off = Signal(int)  # MIDI音符释放信号
+    midi_batch = Signal()  # MIDI输入队列中有待处理的消息（每批只发一次）
+    sample_loaded = Signal(int)  # 后台解码完成的音符
+    samples_progress = Signal(int, int)  # 采样解码进度（完成数，总数）
+
+
+class KeySound:
+    """琴键发声：优先交给共享混音引擎，否则为该键创建 QMediaPlayer/QSoundEffect（逐键播放器）"""
+
+    def init_key_sound(self, note, volume, file_format, engine=None):
+        self.audio_output = None
+        self.note = note
+        self.midi = NOTE_TO_MIDI.get(note, 0)
+        # 共享混音引擎，为None时使用逐键播放器
+        self.engine = engine
+        self.sound = None
+        self.file_format = file_format if file_format else 'wav'
+        # 默认音量设为80%
+        self.volume = volume if volume else 0.8
+
+    def init_sound(self):
+        # 每次初始化前清除旧资源
+        if self.sound:
+            self.sound.deleteLater()
+            self.sound = None
+
+        # 采样库已提供（或正在后台解码）该音符时无需逐格式探测文件
+        if self.uses_engine() or self.audio_pending():
+            return
+
+        # 支持更多高音质格式
+        supported_formats = ['wav', 'flac', 'mp3', 'ogg', 'm4a']
+        if self.file_format not in supported_formats:
+            self.file_format = 'wav'  # 默认回退到wav格式
+
+        # 优先加载配置的格式，其次尝试无损格式
+        format_priority = [self.file_format] + [fmt for fmt in ['flac', 'wav', 'm4a', 'ogg', 'mp3']
+                                                if fmt != self.file_format]
+        sound_file = None
+        for fmt in format_priority:
+            sound_file = self.load_audio_file(fmt)
+            self.file_format = fmt
+            if sound_file:
+                break
+
+        if not sound_file:
+            print(f"错误：{self.note} 的所有格式音频文件缺失！")
+            self.sound = None  # 显式设置为None
+            return
+
+        # 混音引擎可用时由单一输出流发声，不再为每个键创建媒体管线
+        if self.engine is not None and self.engine.load_note(self.midi, sound_file):
+            return
+
+        try:
+            if self.file_format in ['mp3', 'ogg', 'flac', 'm4a']:
+                # 初始化QMediaPlayer及其音频输出
+                self.sound = QMediaPlayer()
+                self.audio_output = QAudioOutput()  # 必须显式创建音频输出对象
+                self.sound.setAudioOutput(self.audio_output)
+                self.audio_output.setVolume(self.volume)  # 在此处设置音量
+            else:
+                # 初始化QSoundEffect
+                self.sound = QSoundEffect()
+                self.sound.setVolume(self.volume)
 
+            # 加载音频源
+            self.sound.setSource(QUrl.fromLocalFile(sound_file))
+            # print(f"成功加载音频：{sound_file}")
+
+        except Exception as e:
+            print(f"音频加载失败：{sound_file}，错误：{str(e)}")
+            self.generate_fallback_sound()  # 确保失败时设为None
 
-class PianoKey(QPushButton):
-    def __init__(self, note, volume, file_format, is_black=False, parent=None):
+    def generate_fallback_sound(self):
+        """生成应急正弦波音频"""
+        try:
+            from scipy.io.wavfile import write
+            import numpy as np
+
+            # 生成1秒440Hz正弦波
+            sample_rate = 44100
+            t = np.linspace(0, 1, sample_rate)
+            waveform = 0.5 * np.sin(2 * np.pi * 440 * t)
+
+            # 保存临时文件
+            temp_file = os.path.join(tempfile.gettempdir(), f"{self.note}_fallback.wav")
+            write(temp_file, sample_rate, waveform)
+
+            self.sound = QSoundEffect()
+            self.sound.setVolume(self.volume)  # 添加音量设置
+            self.sound.setSource(QUrl.fromLocalFile(temp_file))
+            print(f"已生成应急音频：{temp_file}")
+        except ImportError:
+            print('警告：scipy未安装，无法生成应急音频')
+            return
+        except Exception as e:
+            print(f"应急音频生成失败: {str(e)}")
+            # 添加基本蜂鸣声作为最后的应急方案
+            self.sound = QSoundEffect()
+            self.sound.setVolume(0.1)
+            self.sound.setSource(QUrl.fromLocalFile('sounds/beep.wav'))
+
+    def uses_engine(self):
+        return self.engine is not None and self.engine.has_sample(self.midi)
+
+    def audio_pending(self):
+        return self.engine is not None and self.engine.is_loading(self.midi)
+
+    def play_sound(self, velocity=127):
+        """开始发声，音频尚未初始化时返回False"""
+        if self.uses_engine():
+            self.engine.note_on(self.midi, velocity)
+        elif self.sound is None:
+            print(f"警告：{self.note} 音频未初始化，跳过播放")
+            self.init_sound()
+            return False
+        else:
+            try:
+                # 分类控制音频
+                if isinstance(self.sound, QSoundEffect):
+                    if self.sound.status() == QSoundEffect.Status.Ready:
+                        self.sound.play()  # 确保音频已加载
+                elif isinstance(self.sound, QMediaPlayer):
+                    self.sound.stop()
+                    self.sound.setPosition(0)  # 重置播放位置
+                    self.sound.play()
+            except Exception as e:
+                print(f"播放失败 [{self.note}]: {str(e)}")
+        return True
+
+    def stop_sound(self):
+        # 停止音频播放
+        if self.uses_engine():
+            # 由引擎执行200ms淡出
+            self.engine.note_off(self.midi)
+        elif self.sound is not None:
+            # 创建淡出动画
+            if isinstance(self.sound, QMediaPlayer):
+                self.sound.stop()
+            elif isinstance(self.sound, QSoundEffect):
+                fade_anim = QPropertyAnimation(self.sound, b"volume")
+                fade_anim.setDuration(200)
+                fade_anim.setStartValue(self.volume)
+                fade_anim.setEndValue(0)
+                fade_anim.finished.connect(self.sound.stop)
+                fade_anim.start()
+
+    def load_audio_file(self, fmt):
+        current_file = f'sounds/{self.note}.{fmt}'
+        if os.path.exists(current_file):
+            return current_file
+        return None
+
+
+class KeyVoice(KeySound):
+    """自绘琴键使用的发声对象，不含控件"""
+
+    def __init__(self, note, volume, file_format, engine=None):
+        self.init_key_sound(note, volume, file_format, engine)
+        self.init_sound()
+
+    def press(self, velocity=127):
+        return self.play_sound(velocity)
+
+    def release(self):
+        self.stop_sound()
+
+
+class PianoKey(QPushButton, KeySound):
+    def __init__(self, note, volume, file_format, is_black=False, parent=None, engine=None):
         super().__init__(parent)
+        self.init_key_sound(note, volume, file_format, engine)
         # 新增原始位置记录
         self.edge_highlight = None
         self.shadow = None
-        self.audio_output = None
         self.shadow_anim = None
         self.original_geometry = None
-        self.note = note
-        self.sound = None
-        self.file_format = file_format if file_format else 'wav'
         self.is_black = is_black
-        # 默认音量设为80%
-        self.volume = volume if volume else 0.8
         self.press_anim = QPropertyAnimation(self, b"geometry")
         self.release_anim = QPropertyAnimation(self, b'geometry')
 
@@ -164,80 +334,6 @@ class PianoKey(QPushButton):
             texture.setColorAt(0.7, QColor(200, 200, 200, 10))
             self.setGraphicsEffect(QGraphicsOpacityEffect(opacity=0.8))
 
-    def init_sound(self):
-        # 每次初始化前清除旧资源
-        if self.sound:
-            self.sound.deleteLater()
-            self.sound = None
-
-        # 支持更多高音质格式
-        supported_formats = ['wav', 'flac', 'mp3', 'ogg', 'm4a']
-        if self.file_format not in supported_formats:
-            self.file_format = 'wav'  # 默认回退到wav格式
-
-        # 优先尝试加载无损格式
-        format_priority = ['flac', 'wav', 'm4a', 'ogg', 'mp3']
-        sound_file = None
-        for fmt in format_priority:
-            sound_file = self.load_audio_file(fmt)
-            self.file_format = fmt
-            if sound_file:
-                break
-
-        if not sound_file:
-            print(f"错误：{self.note} 的所有格式音频文件缺失！")
-            self.sound = None  # 显式设置为None
-            return
-
-        try:
-            if self.file_format in ['mp3', 'ogg', 'flac', 'm4a']:
-                # 初始化QMediaPlayer及其音频输出
-                self.sound = QMediaPlayer()
-                self.audio_output = QAudioOutput()  # 必须显式创建音频输出对象
-                self.sound.setAudioOutput(self.audio_output)
-                self.audio_output.setVolume(self.volume)  # 在此处设置音量
-            else:
-                # 初始化QSoundEffect
-                self.sound = QSoundEffect()
-                self.sound.setVolume(self.volume)
-
-            # 加载音频源
-            self.sound.setSource(QUrl.fromLocalFile(sound_file))
-            # print(f"成功加载音频：{sound_file}")
-
-        except Exception as e:
-            print(f"音频加载失败：{sound_file}，错误：{str(e)}")
-            self.generate_fallback_sound()  # 确保失败时设为None
-
-    def generate_fallback_sound(self):
-        """生成应急正弦波音频"""
-        try:
-            from scipy.io.wavfile import write
-            import numpy as np
-
-            # 生成1秒440Hz正弦波
-            sample_rate = 44100
-            t = np.linspace(0, 1, sample_rate)
-            waveform = 0.5 * np.sin(2 * np.pi * 440 * t)
-
-            # 保存临时文件
-            temp_file = os.path.join(tempfile.gettempdir(), f"{self.note}_fallback.wav")
-            write(temp_file, sample_rate, waveform)
-
-            self.sound = QSoundEffect()
-            self.sound.setVolume(self.volume)  # 添加音量设置
-            self.sound.setSource(QUrl.fromLocalFile(temp_file))
-            print(f"已生成应急音频：{temp_file}")
-        except ImportError:
-            print('警告：scipy未安装，无法生成应急音频')
-            return
-        except Exception as e:
-            print(f"应急音频生成失败: {str(e)}")
-            # 添加基本蜂鸣声作为最后的应急方案
-            self.sound = QSoundEffect()
-            self.sound.setVolume(0.1)
-            self.sound.setSource(QUrl.fromLocalFile('sounds/beep.wav'))
-
     def init_animations(self):
         # 确保图形效果已初始化后再创建动画
         if self.graphicsEffect() is None:
@@ -251,7 +347,7 @@ class PianoKey(QPushButton):
         self.release_anim.setDuration(220)
         self.release_anim.setEasingCurve(QEasingCurve.Type.OutBack)
 
-    def press(self):
+    def press(self, velocity=127):
         # 在调用动画前检查是否存在
         if self.shadow_anim is not None:
             self.shadow_anim.start()
@@ -261,21 +357,8 @@ class PianoKey(QPushButton):
         if self.release_anim.state() == QPropertyAnimation.State.Running:
             self.release_anim.stop()
 
-        if self.sound is None:
-            print(f"警告：{self.note} 音频未初始化，跳过播放")
-            self.init_sound()
+        if not self.play_sound(velocity):
             return
-        try:
-            # 分类控制音频
-            if isinstance(self.sound, QSoundEffect):
-                if self.sound.status() == QSoundEffect.Status.Ready:
-                    self.sound.play()  # 确保音频已加载
-            elif isinstance(self.sound, QMediaPlayer):
-                self.sound.stop()
-                self.sound.setPosition(0)  # 重置播放位置
-                self.sound.play()
-        except Exception as e:
-            print(f"播放失败 [{self.note}]: {str(e)}")
         self.press_anim.setStartValue(self.original_geometry)
         self.press_anim.setEndValue(self.original_geometry.translated(0, 5))
         self.press_anim.start()
@@ -284,41 +367,24 @@ class PianoKey(QPushButton):
         if self.shadow_anim is not None:
             self.shadow_anim.setDirection(QPropertyAnimation.Direction.Backward)
             self.shadow_anim.start()
-        # 停止音频播放
-        if self.sound is not None:
-            # 创建淡出动画
-            if isinstance(self.sound, QMediaPlayer):
-                self.sound.stop()
-            elif isinstance(self.sound, QSoundEffect):
-                fade_anim = QPropertyAnimation(self.sound, b"volume")
-                fade_anim.setDuration(200)
-                fade_anim.setStartValue(self.volume)
-                fade_anim.setEndValue(0)
-                fade_anim.finished.connect(self.sound.stop)
-                fade_anim.start()
+        self.stop_sound()
         # 使用记录的原始位置
         self.release_anim.setStartValue(self.geometry())
         self.release_anim.setEndValue(self.original_geometry.translated(0, -5))
         self.release_anim.start()
 
-    def load_audio_file(self, fmt):
-        current_file = f'sounds/{self.note}.{fmt}'
-        if os.path.exists(current_file):
-            return current_file
-        return None
-
 
 class PianoKeyItem(QGraphicsWidget):
     # 定义信号
     rotation_angle_changed: Signal = Signal(float)
     perspective_depth_changed: Signal = Signal(int)
 
-    def __init__(self, note, volume, file_format, is_black=False, parent=None):
+    def __init__(self, note, volume, file_format, is_black=False, parent=None, engine=None):
         super().__init__(parent)
         self.note = note
         self.is_black = is_black
         self.proxy = QGraphicsProxyWidget(self)
-        self.key_widget = PianoKey(note, volume, file_format, is_black)
+        self.key_widget = PianoKey(note, volume, file_format, is_black, engine=engine)
         self.proxy.setWidget(self.key_widget)
         self.setZValue(1 if is_black else 0)
         self.setAcceptHoverEvents(True)
@@ -332,6 +398,8 @@ class PianoKeyItem(QGraphicsWidget):
         self.cover.setZValue(3)  # 确保在最上层
         self.cover.hide()
         self.current_octave = 0  # 初始音程
+        self.cover_octave = None  # 最近一次应用到覆盖层的音程
+        self.loading = False  # 采样加载中时置灰
         # 创建动画代理
         self.cover_proxy = CoverAnimProxy(self.cover)
         self.cover_anim = QPropertyAnimation(self.cover_proxy, b"opacity")
@@ -409,6 +477,9 @@ class PianoKeyItem(QGraphicsWidget):
 
     def update_cover(self, current_octave):
         """根据当前音程更新覆盖层可见性"""
+        self.cover_octave = current_octave
+        if self.loading:
+            return
         try:
             note_octave = int(self.note[-1])
             if note_octave != current_octave:
@@ -426,13 +497,33 @@ class PianoKeyItem(QGraphicsWidget):
         except:
             pass
 
+    def set_loading(self, loading):
+        """采样加载中时用覆盖层置灰并禁用琴键，加载完成后恢复音程覆盖状态"""
+        if loading == self.loading:
+            return
+        self.loading = loading
+        self.key_widget.setEnabled(not loading)
+        self.cover_anim.stop()
+        if loading:
+            self.cover.setOpacity(0.7)
+            self.cover.show()
+        elif self.cover_octave is not None:
+            self.update_cover(self.cover_octave)
+        else:
+            self.cover_anim.setStartValue(self.cover.opacity())
+            self.cover_anim.setEndValue(0.0)
+            self.cover_anim.finished.connect(self.cover.hide)
+            self.cover_anim.start()
+
     def hoverEnterEvent(self, event):
         self.setZValue(self.zValue() + 0.1)
 
     def hoverLeaveEvent(self, event):
         self.setZValue(1 if self.is_black else 0)
 
-    def press(self):
+    def press(self, velocity=127):
+        if self.loading:
+            return
         # 启动动画
         self.rotate_anim.start()
         self.perspective_anim.start()
@@ -446,7 +537,7 @@ class PianoKeyItem(QGraphicsWidget):
             volume_anim.setEndValue(min(self.key_widget.volume * 1.2, 1.0))
             volume_anim.start()
 
-        self.key_widget.press()
+        self.key_widget.press(velocity)
 
     def release(self):
         self.rotate_anim.setDirection(QPropertyAnimation.Direction.Backward)
@@ -456,11 +547,203 @@ class PianoKeyItem(QGraphicsWidget):
         self.key_widget.release()
 
 
+class PaintedKeyItem(QGraphicsObject):
+    """
+    自绘琴键：不使用按钮控件、样式表与图形效果。
+
+    白键/黑键的常态与按下状态各渲染一次为QPixmap（阴影直接绘入位图），在同尺寸同标签的琴键间共享；
+    按下/松开只重绘本键所在区域。鼠标命中由图元形状判断（不含阴影），按下/松开通过信号交给 PianoWidget。
+    对外接口与 PianoKeyItem 一致。
+    """
+    mouse_pressed = Signal(int)
+    mouse_released = Signal(int)
+
+    SHADOW_OFFSET = (3, 5)  # 常态阴影偏移，按下时减半
+    PRESS_DEPTH = 2  # 按下时键面下沉的像素
+    _pixmaps = {}  # (黑键, 按下, 标签, 宽, 高, 像素比) -> QPixmap
+
+    def __init__(self, note, volume, file_format, is_black=False, parent=None, engine=None):
+        super().__init__(parent)
+        self.note = note
+        self.is_black = is_black
+        self.key_widget = KeyVoice(note, volume, file_format, engine=engine)
+        self.size = QSizeF(22, 102) if is_black else QSizeF(34, 140)
+        self.pressed = False
+        self.hovered = False
+        self.loading = False  # 采样加载中时置灰
+        self.current_octave = 0  # 初始音程
+        self.cover_octave = None  # 最近一次应用到覆盖层的音程
+        self._cover_opacity = 0.0
+        self.cover_anim = QPropertyAnimation(self, b"cover_opacity")
+        self.cover_anim.setDuration(300)
+        self.setZValue(1 if is_black else 0)
+        self.setAcceptHoverEvents(True)
+        self.setAcceptedMouseButtons(Qt.MouseButton.LeftButton)
+
+    def get_cover_opacity(self):
+        return self._cover_opacity
+
+    def set_cover_opacity(self, value):
+        if self._cover_opacity != value:
+            self._cover_opacity = value
+            self.update()
+
+    cover_opacity = Property(float, get_cover_opacity, set_cover_opacity)
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.size.width() + self.SHADOW_OFFSET[0], self.size.height() + self.SHADOW_OFFSET[1])
+
+    def shape(self):
+        path = QPainterPath()
+        path.addRect(QRectF(0, 0, self.size.width(), self.size.height()))
+        return path
+
+    def paint(self, painter, option, widget=None):
+        painter.drawPixmap(0, 0, self.pixmap(painter.device().devicePixelRatioF()))
+        face = QRectF(0, self.PRESS_DEPTH if self.pressed else 0, self.size.width(), self.size.height())
+        if self.hovered and not self.pressed and not self.loading:
+            painter.fillRect(face, QColor(255, 255, 255, 24) if self.is_black else QColor(0, 0, 0, 10))
+        if self._cover_opacity > 0:
+            painter.fillRect(face, QColor(160, 160, 160, int(120 * self._cover_opacity)))
+
+    def pixmap(self, ratio):
+        key = (self.is_black, self.pressed, self.note[:-1], self.size.width(), self.size.height(), ratio)
+        pixmap = self._pixmaps.get(key)
+        if pixmap is None:
+            pixmap = self.render_pixmap(*key)
+            self._pixmaps[key] = pixmap
+        return pixmap
+
+    @classmethod
+    def render_pixmap(cls, is_black, pressed, label, width, height, ratio):
+        """渲染一个琴键状态：分层半透明矩形近似模糊阴影，渐变键面、边线与标签"""
+        shadow_x, shadow_y = cls.SHADOW_OFFSET
+        pixmap = QPixmap(math.ceil((width + shadow_x) * ratio), math.ceil((height + shadow_y) * ratio))
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(Qt.GlobalColor.transparent)
+        painter = QPainter(pixmap)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+
+        depth = cls.PRESS_DEPTH if pressed else 0
+        face = QRectF(0, depth, width, height - depth)
+        offset_x, offset_y = (shadow_x / 2, shadow_y / 2) if pressed else (shadow_x, shadow_y)
+        for spread, alpha in ((2, 30), (1, 50), (0, 80 if is_black else 50)):
+            shadow = face.translated(offset_x, offset_y).adjusted(-spread, -spread, spread, spread)
+            painter.fillRect(shadow, QColor(0, 0, 0, alpha))
+
+        if is_black:
+            gradient = QRadialGradient(face.left() + face.width() * (0.4 if pressed else 0.3),
+                                       face.top() + face.height() * (0.4 if pressed else 0.3), face.height())
+            stops = ((0, '#202020'), (1, '#101010')) if pressed else ((0, '#404040'), (0.6, '#303030'),
+                                                                      (1, '#202020'))
+        elif pressed:
+            gradient = QRadialGradient(face.left() + face.width() * 0.4, face.top() + face.height() * 0.4,
+                                       face.height())
+            stops = ((0, '#d0d0d0'), (1, '#c0c0c0'))
+        else:
+            gradient = QLinearGradient(0, face.top(), 0, face.bottom())
+            stops = ((0, '#f8f8f8'), (0.3, '#f0f0f0'), (0.7, '#e8e8e8'), (1, '#e0e0e0'))
+        for position, color in stops:
+            gradient.setColorAt(position, QColor(color))
+        painter.fillRect(face, gradient)
+
+        if is_black:
+            painter.setPen(QColor('#000000'))
+            painter.drawRect(face.adjusted(0.5, 0.5, -0.5, -0.5))
+            painter.setPen(QColor('#606060'))
+            painter.drawLine(face.topLeft() + QPointF(1, 0.5), face.topRight() + QPointF(-1, 0.5))
+        else:
+            painter.fillRect(QRectF(face.left(), face.top(), 1, face.height()), QColor('#f0f0f0'))
+            painter.fillRect(QRectF(face.right() - 2, face.top(), 2, face.height()), QColor('#c0c0c0'))
+            border = 1 if pressed else 3
+            painter.fillRect(QRectF(face.left(), face.bottom() - border, face.width(), border),
+                             QColor('#808080' if pressed else '#a0a0a0'))
+
+        font = QFont("Arial", 8 if is_black else 10)
+        font.setItalic(True)
+        painter.setFont(font)
+        painter.setPen(QColor('#FFFFFF' if is_black else '#060606'))
+        painter.drawText(face, Qt.AlignmentFlag.AlignCenter, label)
+        painter.end()
+        return pixmap
+
+    def geometry(self):
+        return QRectF(self.pos(), self.size)
+
+    def set_geometry(self, rect):
+        if rect.size() != self.size:
+            self.prepareGeometryChange()
+            self.size = rect.size()
+        self.setPos(rect.topLeft())
+
+    def update_cover(self, current_octave):
+        """根据当前音程淡入/淡出覆盖层"""
+        self.cover_octave = current_octave
+        if self.loading:
+            return
+        try:
+            target = 0.7 if int(self.note[-1]) != current_octave else 0.0
+        except ValueError:
+            return
+        self.cover_anim.stop()
+        self.cover_anim.setStartValue(self._cover_opacity)
+        self.cover_anim.setEndValue(target)
+        self.cover_anim.start()
+
+    def set_loading(self, loading):
+        """采样加载中时置灰并忽略鼠标，加载完成后恢复音程覆盖状态"""
+        if loading == self.loading:
+            return
+        self.loading = loading
+        self.cover_anim.stop()
+        if loading:
+            self.set_cover_opacity(0.7)
+        elif self.cover_octave is not None:
+            self.update_cover(self.cover_octave)
+        else:
+            self.cover_anim.setStartValue(self._cover_opacity)
+            self.cover_anim.setEndValue(0.0)
+            self.cover_anim.start()
+
+    def set_pressed(self, pressed):
+        if pressed != self.pressed:
+            self.pressed = pressed
+            self.update()
+
+    def press(self, velocity=127):
+        if self.loading:
+            return
+        if self.key_widget.press(velocity):
+            self.set_pressed(True)
+
+    def release(self):
+        self.key_widget.release()
+        self.set_pressed(False)
+
+    def hoverEnterEvent(self, event):
+        self.hovered = True
+        self.update()
+
+    def hoverLeaveEvent(self, event):
+        self.hovered = False
+        self.update()
+
+    def mousePressEvent(self, event):
+        if self.loading:
+            event.ignore()
+            return
+        event.accept()
+        self.mouse_pressed.emit(self.key_widget.midi)
+
+    def mouseReleaseEvent(self, event):
+        self.mouse_released.emit(self.key_widget.midi)
+
+
 class PianoWidget(QWidget):
     # 类级别信号声明
     octave_changed = Signal(int)
 
-    notes = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+    notes = list(NOTE_NAMES)
     key_sequence = [
         'C', 'D', 'E', 'F', 'G', 'A', 'B',
         # 白键映射
@@ -468,10 +751,9 @@ class PianoWidget(QWidget):
         # 黑键映射
     ]
 
-    def __init__(self):
+    def __init__(self, config=None):
         super().__init__()
 
-        self.record_start = None
         self.icons = self.init_icons()
         # 初始化布局参数
         self.x_pos = 0  # 初始横坐标
@@ -487,23 +769,50 @@ class PianoWidget(QWidget):
         self.position_ratio = 0.25
 
         # 加载全局配置
-        config = self.load_config()
+        config = config if config is not None else self.load_config()
         self.global_volume = config.get('volume', 0.8)  # 默认音量
         self.current_octave = 0  # 默认音程为0
         self.black_key_pattern = [
             0, 1, 0, 1, 0, 0, 1, 0, 1, 0, 1, 0  # 标准钢琴黑键模式
         ]
         self.file_format = config.get('file_format', 'flac')
+        # 'mixer'：单一输出流混音引擎；'qt'：逐键QMediaPlayer/QSoundEffect
+        self.audio_backend = config.get('audio_backend', 'mixer')
+        self.velocity_curve = config.get('velocity_curve', 1.0)  # 力度增益曲线指数，1为线性
+        # 'painted'：自绘琴键（缓存位图，按键只重绘一个键）；'widget'：按钮控件+图形效果
+        self.keyboard_renderer = config.get('keyboard_renderer', 'painted')
+        # 采样常驻策略：活动音程±N个音程常驻内存，超出预算按LRU淘汰
+        self.residency_config = config.get('sample_residency', {})
+        # MIDI输入：ports 为空时打开全部输入端口，否则只打开名称包含其中关键字的端口
+        self.midi_config = config.get('midi', {})
+        # 本机网络输入（UDP原始MIDI / OSC / WebSocket），端口为 null 的协议不启用
+        self.network_config = config.get('network_input', {})
+        self.audio_engine = self.init_audio_engine()
+        self.sample_bank = None
         # print(f'file_format:{self.file_format}')
         self.key_map = self.load_keymap(config.get('keymap'))
+        # 反向键位表：按键+音程 -> 音符，键位保存时重建
+        self.keymap_lookup = compile_keymap(self.key_map)
         self.white_keys_data = []  # 存储白键位置信息
         self.black_keys_data = []  # 存储黑键位置信息
         self.white_items = []
         self.black_items = []
+        # MIDI编号 -> PianoKeyItem 的直接索引表，输入事件O(1)定位琴键
+        self.key_items = [None] * MIDI_RANGE
+        self.all_items = []
         self.recording = False
-        self.record_data = []
-        self.midi_in = None
+        # 录音事件日志（单调时钟纳秒时间戳）
+        self.record_log = EventLog()
+        # 录音回放调度器（界面线程派发）
+        self.player = PlaybackScheduler(self.dispatch_note, parent=self, control=self.dispatch_control)
+        self.player.finished.connect(self.on_playback_finished)
+        self.midi_devices = None
+        self.net_input = None
         self.signals = PianoSignal()
+        # rtmidi回调只写入无锁环形缓冲，界面线程按批取出
+        self.midi_input = MidiInputQueue(notify=self.signals.midi_batch.emit)
+        # 采样库在琴键创建前加载（琴键据此跳过逐键探测），其回调用到上面的信号与琴键索引表
+        self.load_sample_bank()
         self.resize_timer = QTimer()
         self.resize_timer.setSingleShot(True)
         self.resize_timer.timeout.connect(self.adjust_layout)
@@ -520,6 +829,8 @@ class PianoWidget(QWidget):
         self.control_layout = QHBoxLayout()
         self.record_btn = None
         self.play_btn = None
+        self.export_btn = None
+        self.import_btn = None
         self.settings_btn = None
         self.help_btn = None
         self.octave_label = QLabel(f"{self.current_octave}")
@@ -530,15 +841,17 @@ class PianoWidget(QWidget):
         self.main_layout = QVBoxLayout()
         self.init_ui()
         self.init_midi()
+        self.init_net_input()
         # 初始化加载音频文件
         self.preload_audio()
+        self.update_loading_keys()
         self.current_path = "help.md"
         self.help_view = QTextEdit()
         self.help_dialog = QDialog(self)
         self.init_help_dialog()
-        self.midi_lock = Lock()
         # 正确连接信号
         self.octave_changed.connect(self.update_key_covers)
+        self.octave_changed.connect(self.update_sample_residency)
 
     def init_ui(self):
         # 添加全局样式
@@ -635,6 +948,13 @@ class PianoWidget(QWidget):
         btn_group.addWidget(self.record_btn)
         btn_group.addWidget(self.play_btn)
         left_layout.addLayout(btn_group)
+        # MIDI文件导入导出
+        file_group = QHBoxLayout()
+        self.export_btn = self.create_styled_button(self.tr("Export MIDI"), "save", "control")
+        self.import_btn = self.create_styled_button(self.tr("Import MIDI"), "open", "control")
+        file_group.addWidget(self.export_btn)
+        file_group.addWidget(self.import_btn)
+        left_layout.addLayout(file_group)
         left_group.setLayout(left_layout)
         # 右侧控制组
         right_group = QGroupBox(self.tr("Settings"))
@@ -668,11 +988,11 @@ class PianoWidget(QWidget):
             if midi_note >= 65:
                 current_y_pos = 0
             if '#' not in note_name:
-                item = PianoKeyItem(note=note_name, volume=self.global_volume, file_format=self.file_format,
-                                    is_black=False)
+                item = self.create_key_item(note_name, is_black=False)
                 self.scene.addItem(item)
                 item.set_geometry(QRectF(current_x_pos, current_y_pos, self.white_width, self.white_height))
                 self.white_items.append(item)
+                self.key_items[midi_note] = item
                 self.white_keys_data.append({
                     'midi': midi_note,
                     'x_start': current_x_pos,
@@ -694,8 +1014,7 @@ class PianoWidget(QWidget):
                 # 计算黑键位置（位于两个白键之间的1/4处）
                 x_center = current['x_start'] + (next_['x_start'] - current['x_start']) * self.position_ratio
 
-                item = PianoKeyItem(note=black_note, volume=self.global_volume, file_format=self.file_format,
-                                    is_black=True)
+                item = self.create_key_item(black_note, is_black=True)
                 self.scene.addItem(item)
                 balck_x_start = x_center + 7
                 item.set_geometry(QRectF(
@@ -705,6 +1024,7 @@ class PianoWidget(QWidget):
                     self.black_hight
                 ))
                 self.black_items.append(item)
+                self.key_items[black_midi] = item
                 self.black_keys_data.append({
                     'white_pair': (i, i + 1),
                     'position_ratio': self.position_ratio,
@@ -714,6 +1034,7 @@ class PianoWidget(QWidget):
                     'y_pos': current['y_pos']
                 })
         self.scene.setSceneRect(0, 0, 900, 330)
+        self.all_items = self.white_items + self.black_items
 
         # 主布局
         self.main_layout.addLayout(self.control_layout)
@@ -723,19 +1044,35 @@ class PianoWidget(QWidget):
         # 信号连接
         self.record_btn.clicked.connect(self.toggle_recording)
         self.play_btn.clicked.connect(self.play_recording)
+        self.export_btn.clicked.connect(self.export_recording)
+        self.import_btn.clicked.connect(self.import_midi)
         self.settings_btn.clicked.connect(self.show_settings)
-        self.signals.midi_note_on.connect(self.handle_midi_note)
-        self.signals.midi_note_off.connect(lambda note: self.handle_midi_note(note, 0))
+        self.signals.midi_batch.connect(self.drain_midi_input)
+        self.signals.sample_loaded.connect(self.on_sample_loaded)
+        self.signals.samples_progress.connect(self.on_samples_progress)
         self.volume_slider.valueChanged.connect(self.update_global_volume)
         self.help_btn.clicked.connect(self.show_help)  # 新增连接
 
+    def create_key_item(self, note, is_black):
+        """按配置创建琴键图元；自绘琴键的鼠标按下/松开与MIDI输入走同一路径（发声并录音）"""
+        if self.keyboard_renderer == 'widget':
+            return PianoKeyItem(note=note, volume=self.global_volume, file_format=self.file_format,
+                                is_black=is_black, engine=self.audio_engine)
+        item = PaintedKeyItem(note=note, volume=self.global_volume, file_format=self.file_format,
+                              is_black=is_black, engine=self.audio_engine)
+        item.mouse_pressed.connect(lambda midi: self.handle_midi_note(midi, 127))
+        item.mouse_released.connect(lambda midi: self.handle_midi_note(midi, 0))
+        return item
+
     def update_key_covers(self, octave):
         """更新所有琴键的覆盖层状态"""
-        for item in self.white_items + self.black_items:
+        for item in self.all_items:
             item.update_cover(octave)
 
     def update_global_volume(self, value):
         self.global_volume = value / 100
+        if self.audio_engine is not None:
+            self.audio_engine.set_volume(self.global_volume)
         for item in self.white_items + self.black_items:
             if item.key_widget.sound:
                 if isinstance(item.key_widget.sound, QMediaPlayer):
@@ -752,12 +1089,95 @@ class PianoWidget(QWidget):
             if isinstance(item.key_widget.sound, QSoundEffect):
                 item.key_widget.sound.play()
                 item.key_widget.sound.stop()
-            if item.key_widget.sound is None:
+            if item.key_widget.sound is None and not (item.key_widget.uses_engine() or item.key_widget.audio_pending()):
                 missing_notes.append(item.note)
 
         if missing_notes:
             print(f"警告：以下音符加载失败：{', '.join(missing_notes)}")
 
+    def init_audio_engine(self):
+        """创建单一输出流混音引擎，不可用时回退到逐键播放器"""
+        if self.audio_backend != 'mixer':
+            return None
+        engine = AudioEngine(volume=self.global_volume, velocity_exponent=self.velocity_curve)
+        if not engine.start():
+            print("未找到可用音频输出设备，回退到逐键播放器")
+            return None
+        return engine
+
+    def load_sample_bank(self):
+        """映射采样缓存；未命中时由进程池在后台解码，界面先行显示，琴键随采样到达逐个启用"""
+        if self.audio_engine is None:
+            return
+        bank = SampleBank('sounds', self.audio_engine.mixer.sample_rate, self.file_format)
+        self.sample_bank = bank
+        if bank.load_cached():
+            print(f"采样库已加载（缓存）：{len(bank)} 个音符")
+            self.init_residency(bank)
+        else:
+            # 回调绑定本次的采样库：重新加载（如切换格式）后，旧解码线程的结果不再进入混音器
+            bank.load_async(
+                on_note=lambda midi, data: self.on_sample_decoded(bank, midi, data),
+                on_progress=lambda done, total: self.on_sample_progress(bank, done, total),
+                on_done=lambda: self.on_sample_bank_ready(bank)
+            )
+        self.audio_engine.load_bank(bank)
+        self.update_loading_keys()
+
+    def on_sample_decoded(self, bank, midi, data):
+        """后台线程回调：采样到达后立即交给混音器，并通知界面启用琴键"""
+        if self.sample_bank is bank:
+            self.audio_engine.mixer.set_sample(midi, data)
+            self.signals.sample_loaded.emit(midi)
+
+    def on_sample_progress(self, bank, done, total):
+        if self.sample_bank is bank:
+            self.signals.samples_progress.emit(done, total)
+
+    def on_sample_bank_ready(self, bank):
+        """后台线程回调：切换到写入缓存后的连续采样数组"""
+        if self.sample_bank is bank:
+            self.audio_engine.load_bank(bank)
+            self.init_residency(bank)
+
+    def init_residency(self, bank):
+        """按配置为映射的采样库启用音程窗口常驻策略"""
+        settings = self.residency_config
+        if not settings.get('enabled') or not bank.mapped:
+            return
+        if self.audio_engine.residency is not None:
+            self.audio_engine.residency.shutdown()
+        residency = SampleResidency(
+            bank,
+            octave_radius=settings.get('octave_radius', 1),
+            memory_budget_mb=settings.get('memory_budget_mb', 64)
+        )
+        self.audio_engine.residency = residency
+        residency.set_active_octave(self.current_octave)
+
+    def update_sample_residency(self, octave):
+        if self.audio_engine is not None and self.audio_engine.residency is not None:
+            self.audio_engine.residency.set_active_octave(octave)
+
+    def on_sample_loaded(self, midi):
+        item = self.key_items[midi]
+        if item is not None:
+            item.set_loading(False)
+
+    def on_samples_progress(self, done, total):
+        if done < total:
+            self.setWindowTitle(f"{self.tr('Pianist')} ({done}/{total})")
+        else:
+            self.setWindowTitle(self.tr('Pianist'))
+            # 解码失败的音符不会单独通知，统一刷新一次
+            self.update_loading_keys()
+            print(f"采样库已加载（解码）：{total} 个音符")
+
+    def update_loading_keys(self):
+        """按采样加载状态置灰/启用琴键"""
+        for item in self.all_items:
+            item.set_loading(self.audio_engine is not None and self.audio_engine.is_loading(item.key_widget.midi))
+
     # 在 PianoWidget 类中新增图标初始化方法
     def init_icons(self):
         # 使用Qt标准图标
@@ -766,7 +1186,9 @@ class PianoWidget(QWidget):
             "play": self.style().standardIcon(QStyle.StandardPixmap.SP_MediaPlay),
             "settings": self.style().standardIcon(QStyle.StandardPixmap.SP_FileDialogDetailedView),
             "volume": self.style().standardIcon(QStyle.StandardPixmap.SP_MediaVolume),
-            "help": self.style().standardIcon(QStyle.StandardPixmap.SP_DialogHelpButton)
+            "help": self.style().standardIcon(QStyle.StandardPixmap.SP_DialogHelpButton),
+            "save": self.style().standardIcon(QStyle.StandardPixmap.SP_DialogSaveButton),
+            "open": self.style().standardIcon(QStyle.StandardPixmap.SP_DialogOpenButton)
         }
         return icons
 
@@ -846,9 +1268,7 @@ class PianoWidget(QWidget):
         return btn
 
     def midi_to_note(self, midi_number):
-        octave = (midi_number // 12) - 1
-        note_index = midi_number % 12
-        return f"{self.notes[note_index]}{octave}"
+        return MIDI_TO_NOTE[midi_number]
 
     def load_keymap(self, keymap):
         try:
@@ -866,7 +1286,26 @@ class PianoWidget(QWidget):
         default_config = {
             'volume': 0.8,
             'file_format': 'flac',
-            'keymap': 'keymap.json'
+            'keymap': 'keymap.json',
+            'audio_backend': 'mixer',
+            'velocity_curve': 1.0,
+            'keyboard_renderer': 'painted',
+            'sample_residency': {
+                'enabled': False,
+                'octave_radius': 1,
+                'memory_budget_mb': 64
+            },
+            'midi': {
+                'ports': [],
+                'poll_interval': 1.0
+            },
+            'network_input': {
+                'enabled': False,
+                'host': '127.0.0.1',
+                'udp_port': 9000,
+                'osc_port': 9001,
+                'websocket_port': None
+            }
         }
         try:
             with open(config_path) as f:
@@ -878,7 +1317,13 @@ class PianoWidget(QWidget):
         config = {
             'volume': self.global_volume,
             'file_format': self.file_format,
-            'keymap': 'keymap.json'
+            'keymap': 'keymap.json',
+            'audio_backend': self.audio_backend,
+            'velocity_curve': self.velocity_curve,
+            'keyboard_renderer': self.keyboard_renderer,
+            'sample_residency': self.residency_config,
+            'midi': self.midi_config,
+            'network_input': self.network_config
         }
         with open('config.json', 'w') as f:
             json.dump(config, f, indent=2)
@@ -901,10 +1346,19 @@ class PianoWidget(QWidget):
         with open('keymap.json', 'w') as f:
             json.dump(new_map, f, indent=2)
         self.key_map = new_map
+        self.keymap_lookup = compile_keymap(new_map)
 
     # 优化内存管理：添加资源清理方法
     def cleanup(self):
-        """清理音频资源"""
+        """清理音频与MIDI资源"""
+        if self.midi_devices is not None:
+            self.midi_devices.stop()
+            self.midi_devices = None
+        if self.net_input is not None:
+            self.net_input.stop()
+            self.net_input = None
+        if self.audio_engine is not None:
+            self.audio_engine.stop()
         for item in self.white_items + self.black_items:
             if item.key_widget.sound:
                 item.key_widget.sound.stop()
@@ -975,79 +1429,154 @@ class PianoWidget(QWidget):
 
     def note_to_midi(self, note_name: str) -> int:
         """将音符名称转换为MIDI编号"""
-        try:
-            base = note_name[:-1]
-            octave = int(note_name[-1])
-            return (octave + 1) * 12 + self.notes.index(base)
-        except:
-            return 0  # 默认值
+        return NOTE_TO_MIDI.get(note_name, 0)  # 默认值
 
     def init_midi(self):
+        """打开全部（或配置选定的）MIDI输入端口，并在后台轮询热插拔"""
         try:
-            self.midi_in = rtmidi.MidiIn()
-            ports = self.midi_in.get_ports()
-            if ports:
-                self.midi_in.open_port(0)
-                self.midi_in.set_callback(self.midi_callback)
-                print(f"已连接MIDI设备: {ports[0]}")
-            else:
-                print("未找到可用MIDI设备")
+            manager = MidiDeviceManager(
+                self.midi_input,
+                selected=self.midi_config.get('ports'),
+                poll_interval=self.midi_config.get('poll_interval', 1.0)
+            )
+            manager.on_change = self.on_midi_ports_changed
+            self.midi_devices = manager.start()
         except Exception as e:
             print(f"MIDI初始化失败: {e}")
+            return
+        if not manager.ports:
+            print("未找到可用MIDI设备，插入后将自动连接")
 
-    def midi_callback(self, event, data=None):
-        with self.midi_lock:
-            message, _ = event
-            if message[0] == 0x90:  # Note On
-                self.signals.midi_note_on.emit(message[1], message[2])
-            elif message[0] == 0x80:  # Note Off
-                self.signals.midi_note_off.emit(message[1])
+    @staticmethod
+    def on_midi_ports_changed(opened, closed):
+        """轮询线程回调：端口热插拔"""
+        for name, number in opened:
+            print(f"已连接MIDI设备: {name}" + (f" #{number}" if number > 1 else ""))
+        for name, number in closed:
+            print(f"MIDI设备已断开: {name}" + (f" #{number}" if number > 1 else ""))
+
+    def init_net_input(self):
+        """按配置启动本机网络输入服务器，消息与硬件MIDI进入同一输入队列"""
+        if not self.network_config.get('enabled'):
+            return
+        server = NetInputServer(
+            self.midi_input,
+            host=self.network_config.get('host', '127.0.0.1'),
+            udp_port=self.network_config.get('udp_port'),
+            osc_port=self.network_config.get('osc_port'),
+            websocket_port=self.network_config.get('websocket_port')
+        ).start()
+        for source, (host, port) in server.addresses.items():
+            print(f"网络输入已监听 {source}: {host}:{port}")
+        self.net_input = server
+
+    def drain_midi_input(self):
+        """界面线程：一次处理输入队列中积压的全部MIDI事件，录音使用设备时间戳"""
+        # 各端口的事件已按设备时间合并；来源序号（可经 midi_input.keys 换算为端口）随事件写入录音
+        events, sources = self.midi_input.drain()
+        for time_ns, note, velocity, event_type, source in zip(
+                events['time_ns'].tolist(), events['note'].tolist(), events['velocity'].tolist(),
+                events['type'].tolist(), sources.tolist()):
+            if event_type == EVENT_CONTROL:
+                self.handle_midi_control(note, velocity, time_ns, source)
+            else:
+                self.handle_midi_note(note, velocity, time_ns, source)
 
-    def handle_midi_note(self, note, velocity):
-        note_name = self.midi_to_note(note)
-        for item in self.white_items + self.black_items:
-            if item.note == note_name:
-                if velocity > 0:
-                    item.press()
-                else:
-                    item.release()
-                if self.recording:
-                    self.record_data.append({
-                        'time': time.monotonic() - self.record_start,  # 修复：使用 monotonic
-                        'type': 'on' if velocity > 0 else 'off',
-                        'note': note_name
-                    })
-                break
+    def handle_midi_note(self, note, velocity, time_ns=None, source=0):
+        """time_ns 为事件发生的单调时钟时刻，缺省取当前时刻；source 为输入端口序号，随事件录音"""
+        item = self.key_items[note] if 0 <= note < MIDI_RANGE else None
+        if item is None:
+            return
+        if velocity > 0:
+            item.press(velocity)
+        else:
+            item.release()
+        if self.recording:
+            self.record_log.append(EVENT_NOTE_ON if velocity > 0 else EVENT_NOTE_OFF, note, velocity, time_ns, source)
+
+    def handle_midi_control(self, controller, value, time_ns=None, source=0):
+        """踏板交给音频引擎，由混音器推迟或集中释放；逐键播放器不支持踏板"""
+        if self.audio_engine is not None:
+            self.audio_engine.control_change(controller, value)
+        if self.recording:
+            self.record_log.append(EVENT_CONTROL, controller, value, time_ns, source)
 
     def toggle_recording(self):
         self.recording = not self.recording
         self.record_btn.setText(self.tr("Stop Recording") if self.recording else self.tr("Start Recording"))
         if self.recording:
-            self.record_data = []
-            self.record_start = time.time()
+            self.record_log.start()
             print("录音开始...")
         else:
-            print(f"录音结束，共记录{len(self.record_data)}个事件")
+            print(f"录音结束，共记录{len(self.record_log)}个事件")
 
     def play_recording(self):
-        if not self.record_data:
+        if not len(self.record_log):
             return
+        self.player.load(self.record_log.view())
+        self.player.play()
 
-        def playback():
-            start_time = self.record_data[0]['time']
-            for event in self.record_data:
-                elapsed = event['time'] - start_time
-                time.sleep(max(0, elapsed))
-                for item in self.white_items + self.black_items:
-                    if item.note == event['note']:
-                        if event['type'] == 'on':
-                            item.press()
-                        else:
-                            item.release()
-                        break
-                start_time = event['time']
-
-        Thread(target=playback).start()
+    def export_recording(self):
+        """把最近一次录音导出为标准MIDI文件，或离线渲染为WAV/FLAC"""
+        if not len(self.record_log):
+            return
+        path, _ = QFileDialog.getSaveFileName(
+            self, self.tr("Export Recording"), "recording.mid",
+            "MIDI (*.mid *.midi);;WAV (*.wav);;FLAC (*.flac)"
+        )
+        if not path:
+            return
+        try:
+            if path.lower().endswith(('.wav', '.flac')):
+                render_to_file(self.record_log.view(), self.offline_bank(), path,
+                               velocity_exponent=self.velocity_curve)
+            else:
+                write_midi_file(path, self.record_log.view())
+            print(f"录音已导出：{path}")
+        except (OSError, RuntimeError, ValueError) as e:
+            print(f"录音导出失败: {e}")
+
+    def offline_bank(self):
+        """离线渲染用的采样库：已加载完成时直接复用，否则同步加载（优先映射缓存）"""
+        bank = self.sample_bank
+        if bank is not None and len(bank) and not bank.pending:
+            return bank
+        sample_rate = self.audio_engine.mixer.sample_rate if self.audio_engine else DEFAULT_SAMPLE_RATE
+        return SampleBank('sounds', sample_rate, self.file_format).load(jobs=os.cpu_count() or 1)
+
+    def import_midi(self):
+        path, _ = QFileDialog.getOpenFileName(self, self.tr("Import MIDI"), "", "MIDI (*.mid *.midi)")
+        if path:
+            self.play_midi_file(path)
+
+    def play_midi_file(self, path):
+        """流式读取MIDI文件并交给回放调度器"""
+        try:
+            self.player.load(iter_midi_events(path))
+        except (OSError, MidiFileError) as e:
+            print(f"MIDI导入失败: {e}")
+            return
+        self.player.play()
+
+    def dispatch_note(self, midi, velocity):
+        """回放派发：只驱动琴键，不写入录音"""
+        item = self.key_items[midi]
+        if item is None:
+            return
+        if velocity > 0:
+            item.press(velocity)
+        else:
+            item.release()
+
+    def dispatch_control(self, controller, value):
+        """回放派发踏板事件，不写入录音"""
+        if self.audio_engine is not None:
+            self.audio_engine.control_change(controller, value)
+
+    def on_playback_finished(self):
+        stats = self.player.lateness_stats()
+        if stats:
+            print(f"回放结束，事件迟到：平均 {stats['mean']:.2f}ms，p95 {stats['p95']:.2f}ms，最大 {stats['max']:.2f}ms")
 
     def show_settings(self):
         dialog = SettingsDialog(
@@ -1072,6 +1601,7 @@ class PianoWidget(QWidget):
 
     def reload_audio_format(self):
         """重新加载音频文件格式"""
+        self.load_sample_bank()
         for item in self.white_items + self.black_items:
             item.key_widget.file_format = self.file_format
             item.key_widget.init_sound()
@@ -1100,15 +1630,13 @@ class PianoWidget(QWidget):
         # 组合音符和音程
         note_with_octave = f"{key}{self.current_octave}"
         # print(f'组合键：{note_with_octave}')
-        if note_with_octave in self.key_map.values():
-
-            note = next(k for k, v in self.key_map.items() if v == note_with_octave)
-            for item in self.white_items + self.black_items:
-                if item.note == note:
-                    item.press()
-                    if self.recording:
-                        self.record_data.append({'time': time.time() - self.record_start, 'type': 'on', 'note': note})
-                        break
+        note = self.keymap_lookup.get(note_with_octave)
+        if note is not None:
+            item = self.key_items[NOTE_TO_MIDI.get(note, 0)]
+            if item is not None:
+                item.press()
+                if self.recording:
+                    self.record_log.append(EVENT_NOTE_ON, item.key_widget.midi, 127)
 
     def keyReleaseEvent(self, event: QKeyEvent):
         # 忽略自动重复事件
@@ -1122,14 +1650,13 @@ class PianoWidget(QWidget):
 
         # 组合音符和音程
         note_with_octave = f'{key}{self.current_octave}'
-        if note_with_octave in self.key_map.values():
-            note = next(k for k, v in self.key_map.items() if v == note_with_octave)
-            for item in self.white_items + self.black_items:
-                if item.note == note:
-                    item.release()
-                    if self.recording:
-                        self.record_data.append({'time': time.time() - self.record_start, 'type': 'off', 'note': note})
-                        break
+        note = self.keymap_lookup.get(note_with_octave)
+        if note is not None:
+            item = self.key_items[NOTE_TO_MIDI.get(note, 0)]
+            if item is not None:
+                item.release()
+                if self.recording:
+                    self.record_log.append(EVENT_NOTE_OFF, item.key_widget.midi)
 
     def note_to_index(self, note_name: str) -> int:
         """精确转换音符名称到索引"""
@@ -1429,6 +1956,8 @@ class SettingsDialog(QDialog):
 
 
 if __name__ == '__main__':
+    # 打包后的程序需要支持采样解码进程池
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     # 加载翻译
     translator = QTranslator()
@@ -0,0 +1,209 @@
+"""录音回放调度器：基于单调时钟的绝对截止时间，在界面线程按批次派发事件"""
+import statistics
+import time
+
+import numpy as np
+from PySide6.QtCore import QObject, QTimer, Qt, Signal
+
+from recording import EVENT_CONTROL, EVENT_NOTE_OFF, EventLog
+
+
+class PlaybackScheduler(QObject):
+    """
+    回放调度器。
+
+    每个事件的截止时间 = 开始时刻 + 事件时间，均由 time.monotonic_ns 计算，
+    不会像逐段 sleep 那样累积误差；同一时刻（容差内）的事件在一次回调中批量派发，
+    和弦不会被拆散。dispatch(midi, velocity) 在界面线程中调用，velocity 为0表示释放；
+    踏板事件交给 control(控制器, 取值)，停止/跳转时已踩下的踏板会被抬起。
+
+    事件来源可以是完整数组，也可以是按时间顺序产出数组块的迭代器（如MIDI文件流式导入），
+    后者只在播放进度接近已载入末尾时才读取下一块。
+    """
+    finished = Signal()
+    # 每批事件派发后报告最大迟到毫秒数
+    lateness_reported = Signal(float)
+
+    def __init__(self, dispatch, tolerance_ms=1.0, parent=None, control=None):
+        super().__init__(parent)
+        self.dispatch = dispatch
+        self.control = control
+        self.tolerance_ns = int(tolerance_ms * 1_000_000)
+        self.source = iter(())  # 尚未载入的事件块
+        self.origin = None  # 第一个事件的时间，作为回放时间0
+        self.loaded = EventLog()  # 已载入的事件（时间相对 origin，释放事件力度为0）
+        self.times = self.notes = self.velocities = self.types = np.zeros(0, dtype=np.int64)
+        self.index = 0
+        self.start_ns = None  # 对应回放时间0的单调时钟时刻
+        self.paused_at = None  # 暂停时的回放位置（纳秒）
+        self.held = set()  # 回放中处于按下状态的音符
+        self.pedals = set()  # 回放中处于踩下状态的踏板控制器
+        self.lateness = []  # 每个事件的迟到毫秒数
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self._fire)
+
+    @property
+    def is_playing(self):
+        return self.start_ns is not None
+
+    @property
+    def is_paused(self):
+        return self.paused_at is not None
+
+    @property
+    def position(self):
+        """当前回放位置（秒）"""
+        if self.paused_at is not None:
+            return self.paused_at / 1e9
+        if self.start_ns is None:
+            return 0.0
+        return (time.monotonic_ns() - self.start_ns) / 1e9
+
+    def load(self, events):
+        """载入 EVENT_DTYPE 事件数组，或按时间顺序产出此类数组的迭代器"""
+        self.stop()
+        if isinstance(events, np.ndarray):
+            events = [events[np.argsort(events['time_ns'], kind='stable')]]
+        self.source = iter(events)
+        self.origin = None
+        self.loaded.clear()
+        self._refresh()
+        self._pull()
+
+    def _pull(self):
+        """从来源再读取一块事件，读到返回True"""
+        for chunk in self.source:
+            if not len(chunk):
+                continue
+            if self.origin is None:
+                self.origin = int(chunk['time_ns'][0])
+            chunk = chunk.copy()
+            chunk['time_ns'] -= self.origin
+            chunk['velocity'][chunk['type'] == EVENT_NOTE_OFF] = 0
+            self.loaded.extend(chunk)
+            self._refresh()
+            return True
+        return False
+
+    def _refresh(self):
+        view = self.loaded.view()
+        self.times = view['time_ns']
+        self.notes = view['note']
+        self.velocities = view['velocity']
+        self.types = view['type']
+
+    def _locate(self, position_ns):
+        """定位到不早于 position_ns 的第一个事件，必要时继续读取后续块"""
+        while (not len(self.times) or self.times[-1] < position_ns) and self._pull():
+            pass
+        self.index = int(np.searchsorted(self.times, position_ns, side='left'))
+
+    def play(self, position=0.0):
+        """从指定位置（秒）开始回放"""
+        self.release_held()
+        self.lateness = []
+        self.paused_at = None
+        self._start_at(int(position * 1e9))
+
+    def pause(self):
+        if self.start_ns is None:
+            return
+        self.paused_at = time.monotonic_ns() - self.start_ns
+        self.start_ns = None
+        self.timer.stop()
+        self.release_held()
+
+    def resume(self):
+        if self.paused_at is None:
+            return
+        position, self.paused_at = self.paused_at, None
+        self._start_at(position)
+
+    def stop(self):
+        self.timer.stop()
+        self.start_ns = None
+        self.paused_at = None
+        self.index = 0
+        self.release_held()
+
+    def seek(self, position):
+        """跳转到指定位置（秒），暂停状态下仅移动位置"""
+        position_ns = int(max(0.0, position) * 1e9)
+        self.release_held()
+        if self.paused_at is not None:
+            self.paused_at = position_ns
+            self._locate(position_ns)
+        elif self.start_ns is not None:
+            self.timer.stop()
+            self._start_at(position_ns)
+
+    def release_held(self):
+        """释放回放中仍按下的音符并抬起踏板，避免停止/跳转后残留"""
+        for midi in list(self.held):
+            self.dispatch(midi, 0)
+        self.held.clear()
+        for controller in list(self.pedals):
+            self.control(controller, 0)
+        self.pedals.clear()
+
+    def lateness_stats(self):
+        """迟到统计（毫秒）：均值、p95、最大值"""
+        if not self.lateness:
+            return {}
+        ordered = sorted(self.lateness)
+        return {
+            'mean': statistics.fmean(ordered),
+            'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            'max': ordered[-1],
+        }
+
+    def _start_at(self, position_ns):
+        self._locate(position_ns)
+        self.start_ns = time.monotonic_ns() - position_ns
+        self._schedule()
+
+    def _has_next(self):
+        return self.index < len(self.times) or self._pull()
+
+    def _schedule(self):
+        if not self._has_next():
+            self.start_ns = None
+            self.finished.emit()
+            return
+        remaining = self.start_ns + int(self.times[self.index]) - time.monotonic_ns()
+        # 向下取整到毫秒，提前醒来的部分由容差窗口吸收
+        self.timer.start(max(0, remaining // 1_000_000))
+
+    def _fire(self):
+        if self.start_ns is None:
+            return
+        now = time.monotonic_ns()
+        due = now - self.start_ns + self.tolerance_ns
+        worst = 0.0
+        fired = 0
+        while self._has_next() and self.times[self.index] <= due:
+            midi = int(self.notes[self.index])
+            velocity = int(self.velocities[self.index])
+            if self.types[self.index] == EVENT_CONTROL:
+                if self.control is not None:
+                    self.control(midi, velocity)
+                    if velocity >= 64:
+                        self.pedals.add(midi)
+                    else:
+                        self.pedals.discard(midi)
+            else:
+                self.dispatch(midi, velocity)
+                if velocity > 0:
+                    self.held.add(midi)
+                else:
+                    self.held.discard(midi)
+            late = max(0.0, (now - self.start_ns - int(self.times[self.index])) / 1e6)
+            self.lateness.append(late)
+            worst = max(worst, late)
+            self.index += 1
+            fired += 1
+        if fired:
+            self.lateness_reported.emit(worst)
+        self._schedule()
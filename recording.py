@@ -0,0 +1,86 @@
+"""紧凑的录音事件日志：按列存储的结构化数组，只追加，容量倍增"""
+import time
+
+import numpy as np
+
+# 事件类型
+EVENT_NOTE_OFF = 0
+EVENT_NOTE_ON = 1
+EVENT_CONTROL = 2  # 控制器（踏板）事件：note 为控制器编号，velocity 为取值
+
+# 每个事件12字节：纳秒时间戳（相对录音开始）、MIDI音符、力度、类型、来源
+# 来源为输入端口序号（MidiInputQueue.keys 的下标，电脑键盘与回放为0），导出MIDI文件时映射为通道
+EVENT_DTYPE = np.dtype([
+    ('time_ns', '<i8'),
+    ('note', 'u1'),
+    ('velocity', 'u1'),
+    ('type', 'u1'),
+    ('source', 'u1'),
+])
+
+
+class EventLog:
+    """
+    录音事件缓冲。
+
+    所有时间戳统一取自 time.monotonic_ns；容量不足时倍增，追加为均摊O(1)。
+    view() 返回已记录事件的只读视图，供回放与导出使用，不复制数据。
+    """
+
+    def __init__(self, capacity=4096):
+        self._buffer = np.zeros(capacity, dtype=EVENT_DTYPE)
+        self._size = 0
+        self.start_ns = None
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def nbytes(self):
+        return self._buffer.nbytes
+
+    @property
+    def duration(self):
+        """最后一个事件的时间（秒）"""
+        if not self._size:
+            return 0.0
+        return self._buffer['time_ns'][self._size - 1] / 1e9
+
+    def start(self):
+        """清空并以当前时刻作为录音起点"""
+        self._size = 0
+        self.start_ns = time.monotonic_ns()
+
+    def clear(self):
+        self._size = 0
+        self.start_ns = None
+
+    def append(self, event_type, note, velocity=0, time_ns=None, source=0):
+        """追加一个事件；time_ns 为单调时钟的绝对时刻，缺省取当前时刻；source 为输入端口序号"""
+        if self.start_ns is None:
+            self.start_ns = time.monotonic_ns() if time_ns is None else time_ns
+        if time_ns is None:
+            time_ns = time.monotonic_ns()
+        if self._size == len(self._buffer):
+            self._grow()
+        self._buffer[self._size] = (time_ns - self.start_ns, note, velocity, event_type, source & 0xFF)
+        self._size += 1
+
+    def extend(self, events):
+        """批量追加 EVENT_DTYPE 数组（时间已相对录音起点）"""
+        needed = self._size + len(events)
+        while needed > len(self._buffer):
+            self._grow()
+        self._buffer[self._size:needed] = events
+        self._size = needed
+
+    def _grow(self):
+        buffer = np.zeros(max(16, len(self._buffer) * 2), dtype=EVENT_DTYPE)
+        buffer[:self._size] = self._buffer[:self._size]
+        self._buffer = buffer
+
+    def view(self):
+        """已记录事件的只读视图"""
+        events = self._buffer[:self._size]
+        events.flags.writeable = False
+        return events
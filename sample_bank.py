@@ -0,0 +1,539 @@
+"""解码后的PCM采样库：全部音符存放在一块连续数组中，并缓存为可内存映射的文件"""
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
+import re
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from threading import Lock, Thread
+
+import numpy as np
+
+from mixer import DEFAULT_SAMPLE_RATE, decode_audio_file
+from note_tables import MIDI_TO_NOTE, NOTE_TO_MIDI, PIANO_END, PIANO_START
+
+# 与 PianoKey.init_sound 相同的格式回退顺序
+FORMAT_PRIORITY = ['flac', 'wav', 'm4a', 'ogg', 'mp3']
+# 缓存布局变化时递增，使旧缓存自动失效
+BANK_VERSION = 2
+# 音色生成器（generate_piano_sounds.py --build）写出的清单
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+# 不带 _v<力度> 后缀的采样文件（<音名>.<格式>）视为此力度层
+BASE_VELOCITY = 100
+LAYER_NAME = re.compile(r'^(?P<note>[A-G]#?-?\d+)_v(?P<velocity>\d+)$')
+
+
+def layer_key(midi, velocity=BASE_VELOCITY):
+    """清单与缓存索引中的键：基础层为MIDI编号，其他力度层追加 _v<力度>"""
+    return str(midi) if velocity == BASE_VELOCITY else f"{midi}_v{velocity}"
+
+
+def source_key(key):
+    """清单键 -> 采样库内部键：基础层为MIDI编号，其他力度层为 (MIDI编号, 力度)"""
+    midi, _, velocity = key.partition('_v')
+    if not velocity or int(velocity) == BASE_VELOCITY:
+        return int(midi)
+    return int(midi), int(velocity)
+
+
+def source_order(key):
+    """基础层在前、力度层在后的排序键"""
+    return (1, key) if isinstance(key, tuple) else (0, (key, 0))
+
+
+def read_manifest(sound_dir):
+    """读取采样目录中的生成清单，返回 {采样库内部键: 条目}；不存在、损坏或版本不符时返回空字典"""
+    try:
+        with open(os.path.join(sound_dir, MANIFEST_NAME), 'r') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return {source_key(key): entry for key, entry in manifest.get('notes', {}).items()}
+
+
+def decode_to_shared_memory(midi, path, sample_rate):
+    """进程池任务：解码（含重采样、转int16）一个音符并放入共享内存，返回 (midi, 名称, 形状)"""
+    data = decode_audio_file(path, sample_rate)
+    # 共享内存的所有权交给主进程，由主进程读取后 unlink，工作进程的 resource_tracker 不应再登记它
+    if sys.version_info >= (3, 13):
+        shm = SharedMemory(create=True, size=max(1, data.nbytes), track=False)
+    else:
+        shm = SharedMemory(create=True, size=max(1, data.nbytes))
+        if os.name == 'posix':
+            # 创建时以带前导斜杠的POSIX名称登记
+            resource_tracker.unregister('/' + shm.name, 'shared_memory')
+    np.ndarray(data.shape, dtype=np.int16, buffer=shm.buf)[:] = data
+    shm.close()
+    return midi, shm.name, data.shape
+
+
+def take_shared_memory(name, shape):
+    """主进程取出工作进程放入共享内存的采样并释放该共享内存"""
+    shm = SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype=np.int16, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+class SampleBank:
+    """
+    采样库。
+
+    data 为 (总帧数, 声道数) 的int16数组，index 记录 MIDI编号 -> (起始帧, 帧数)。
+    首次加载时解码 sounds 目录并写入缓存；之后以源文件的大小和修改时间为键，
+    命中缓存时直接以只读方式映射缓存文件，无需解码。
+
+    力度层（<音名>_v<力度>.<格式>）存放在同一数组中全部基础层之后，由 layer_index 记录
+    (MIDI编号, 力度) -> (起始帧, 帧数)。缓存为内存映射，从未演奏过的力度层不会被换入内存。
+    映射时可用 fault_in/release 按音符换入或归还页面（见 SampleResidency）。
+    """
+
+    def __init__(self, sound_dir='sounds', sample_rate=DEFAULT_SAMPLE_RATE, file_format='m4a', cache_dir=None):
+        self.sound_dir = sound_dir
+        self.sample_rate = sample_rate
+        self.file_format = file_format
+        self.cache_dir = cache_dir or os.path.join(sound_dir, '.cache')
+        self.data = None
+        self.index = {}
+        self.layer_index = {}
+        self.channels = 1
+        self.from_cache = False
+        # 缓存文件的只读映射，以及数组在文件中的字节偏移（.npy 文件头之后）
+        self.mmap = None
+        self.data_offset = 0
+        # 冷启动并行解码期间：已到达但尚未写入缓存的音符，以及仍在解码的音符
+        self.loaded = {}
+        self.pending = set()
+        # 清单中记录的源文件校验和，用作内容寻址的缓存键
+        self.checksums = {}
+
+    def __contains__(self, midi):
+        return midi in self.index or midi in self.loaded
+
+    def __len__(self):
+        return len(self.index)
+
+    def notes(self):
+        return list(self.index)
+
+    def get(self, midi):
+        """返回音符采样的只读视图，不存在时返回None"""
+        entry = self.index.get(midi)
+        if entry is None:
+            return self.loaded.get(midi)
+        offset, length = entry
+        return self.data[offset:offset + length]
+
+    def layers(self, midi):
+        """音符基础层以外的力度层 {力度: 只读视图}，没有力度层时为空字典"""
+        return {key[1]: self.data[offset:offset + length]
+                for key, (offset, length) in self.layer_index.items() if key[0] == midi}
+
+    def layered_notes(self):
+        return sorted({midi for midi, _ in self.layer_index})
+
+    # ---- 源文件 ----
+    def manifest_sources(self):
+        """生成清单中格式与配置一致、且文件大小与记录相符的音符与力度层"""
+        sources = {}
+        self.checksums = {}
+        for key, entry in read_manifest(self.sound_dir).items():
+            name = entry.get('file', '')
+            path = os.path.join(self.sound_dir, name)
+            if not name.endswith(f".{self.file_format}"):
+                continue
+            try:
+                if os.path.getsize(path) != entry.get('size'):
+                    continue
+            except OSError:
+                continue
+            sources[key] = path
+            self.checksums[key] = entry.get('sha256')
+        return sources
+
+    def find_sources(self):
+        """
+        优先采用生成清单中校验通过的文件，其余音符与力度层按配置格式优先、其余格式回退的顺序定位。
+        返回 {MIDI编号或 (MIDI编号, 力度): 路径}。
+        """
+        sources = self.manifest_sources()
+        formats = [self.file_format] + [fmt for fmt in FORMAT_PRIORITY if fmt != self.file_format]
+        try:
+            existing = set(os.listdir(self.sound_dir))
+        except FileNotFoundError:
+            return sources
+        for midi in range(PIANO_START, PIANO_END + 1):
+            if midi in sources:
+                continue
+            for fmt in formats:
+                name = f"{MIDI_TO_NOTE[midi]}.{fmt}"
+                if name in existing:
+                    sources[midi] = os.path.join(self.sound_dir, name)
+                    break
+        # 力度层：同一 (音符, 力度) 存在多种格式时按格式优先级取一个
+        ranks = {}
+        for name in existing:
+            stem, fmt = os.path.splitext(name)
+            match = LAYER_NAME.match(stem)
+            fmt = fmt[1:]
+            if match is None or fmt not in formats:
+                continue
+            midi = NOTE_TO_MIDI.get(match['note'])
+            if midi is None or not PIANO_START <= midi <= PIANO_END or midi not in sources:
+                continue
+            key = source_key(f"{midi}_v{match['velocity']}")
+            if key in sources and key not in ranks:
+                continue  # 清单已提供，或为基础层
+            if key not in ranks or formats.index(fmt) < ranks[key]:
+                ranks[key] = formats.index(fmt)
+                sources[key] = os.path.join(self.sound_dir, name)
+        return sources
+
+    def signature(self, sources):
+        """由源文件名与校验和（清单）或大小、修改时间，以及解码参数计算缓存键"""
+        digest = hashlib.sha1(f"{BANK_VERSION}:{self.sample_rate}".encode())
+        for key in sorted(sources, key=source_order):
+            name = os.path.basename(sources[key])
+            label = key if isinstance(key, int) else layer_key(*key)
+            checksum = self.checksums.get(key)
+            if checksum:
+                digest.update(f"{label}:{name}:{checksum}".encode())
+            else:
+                stat = os.stat(sources[key])
+                digest.update(f"{label}:{name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return digest.hexdigest()[:16]
+
+    def cache_paths(self, signature):
+        base = os.path.join(self.cache_dir, f"bank-{signature}")
+        return base + '.npy', base + '.json'
+
+    def is_loading(self, midi):
+        return midi in self.pending
+
+    # ---- 加载 ----
+    def load_cached(self):
+        """仅尝试映射缓存，命中返回True"""
+        sources = self.find_sources()
+        return bool(sources) and self.load_cache(self.signature(sources))
+
+    def load(self, jobs=1):
+        """优先映射缓存，未命中时解码全部源文件（jobs>1 时使用进程池）并写入缓存"""
+        sources = self.find_sources()
+        if not sources:
+            return self
+        signature = self.signature(sources)
+        if self.load_cache(signature):
+            return self
+        if jobs > 1:
+            self.decode_parallel(sources, jobs)
+        else:
+            for key in sorted(sources, key=source_order):
+                path = sources[key]
+                try:
+                    self.loaded[key] = decode_audio_file(path, self.sample_rate)
+                except Exception as e:
+                    print(f"音频解码失败：{path}，错误：{str(e)}")
+        self.store(signature)
+        return self
+
+    def load_async(self, jobs=None, on_note=None, on_progress=None, on_done=None):
+        """
+        后台线程中完成冷启动解码，调用方不阻塞。
+
+        每个音符的基础层解码完成即回调 on_note(midi, data)，每个文件完成回调 on_progress(完成数, 总数)；
+        力度层在全部基础层之后解码，且只在写入缓存后随整个采样库提供。
+        全部完成后逐个写入缓存文件并改为映射（见 store），然后回调 on_done()。回调均在后台线程执行。
+        """
+        sources = self.find_sources()
+        self.pending = set(sources)
+
+        def run():
+            self.decode_parallel(sources, jobs, on_note, on_progress)
+            if sources:
+                self.store(self.signature(sources))
+            if on_done is not None:
+                on_done()
+
+        thread = Thread(target=run, name="SampleBankLoader", daemon=True)
+        thread.start()
+        return thread
+
+    def decode_parallel(self, sources, jobs=None, on_note=None, on_progress=None):
+        """把逐音符的解码、重采样与格式转换分发到进程池，结果经共享内存流式返回（基础层优先提交）"""
+        self.pending = set(sources)
+        total = len(sources)
+        # spawn 启动方式避免在已有Qt线程的进程中 fork
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as pool:
+            futures = {pool.submit(decode_to_shared_memory, key, sources[key], self.sample_rate): key
+                       for key in sorted(sources, key=source_order)}
+            for done, future in enumerate(as_completed(futures), 1):
+                midi = futures[future]
+                try:
+                    _, name, shape = future.result()
+                    data = take_shared_memory(name, shape)
+                except Exception as e:
+                    print(f"音频解码失败：{sources[midi]}，错误：{str(e)}")
+                    data = None
+                if data is not None:
+                    self.loaded[midi] = data
+                    if on_note is not None and not isinstance(midi, tuple):
+                        on_note(midi, data)
+                self.pending.discard(midi)
+                if on_progress is not None:
+                    on_progress(done, total)
+
+    def layout(self, keys, decoded):
+        """基础层按音高排列在前、力度层紧随其后，返回 (声道数, 总帧数, 基础层索引, 力度层索引)"""
+        channels = max(decoded[key].shape[1] for key in keys)
+        index, layer_index = {}, {}
+        offset = 0
+        for key in keys:
+            length = len(decoded[key])
+            (layer_index if isinstance(key, tuple) else index)[key] = (offset, length)
+            offset += length
+        return channels, offset, index, layer_index
+
+    def store(self, signature):
+        """
+        把 loaded 中的解码结果按 layout 顺序逐个写入缓存文件，每个音符写入后即释放，
+        不在内存中另行拼接，完成后改为映射该文件。缓存写入失败时才在内存中拼接（见 assemble）。
+        """
+        decoded = self.loaded
+        if not decoded:
+            return
+        keys = sorted(decoded, key=source_order)
+        channels, total, index, layer_index = self.layout(keys, decoded)
+        data_path, index_path = self.cache_paths(signature)
+        written, header = 0, 0
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for name in os.listdir(self.cache_dir):
+                if name.startswith('bank-') and not name.startswith(f"bank-{signature}"):
+                    os.remove(os.path.join(self.cache_dir, name))
+            with open(data_path + '.tmp', 'wb') as f:
+                np.lib.format.write_array_header_1_0(
+                    f, {'descr': '<i2', 'fortran_order': False, 'shape': (total, channels)})
+                header = f.tell()
+                for key in keys:
+                    data = decoded[key]
+                    # 单声道与立体声混存时，单声道复制到所有声道
+                    np.ascontiguousarray(np.broadcast_to(data, (len(data), channels)), dtype='<i2').tofile(f)
+                    del decoded[key], data
+                    written += 1
+            os.replace(data_path + '.tmp', data_path)
+            with open(index_path + '.tmp', 'w') as f:
+                json.dump({
+                    'version': BANK_VERSION,
+                    'sample_rate': self.sample_rate,
+                    'channels': channels,
+                    'index': {str(midi): list(entry) for midi, entry in index.items()},
+                    'layers': {layer_key(*key): list(entry) for key, entry in layer_index.items()}
+                }, f)
+            os.replace(index_path + '.tmp', index_path)
+        except OSError as e:
+            print(f"采样缓存写入失败: {e}")
+            partial = data_path + '.tmp' if os.path.exists(data_path + '.tmp') else data_path
+            data = self.assemble(keys, written, decoded, partial, header, total, channels, index, layer_index)
+            self.use_array(data, index, layer_index)
+            return
+        if not self.load_cache(signature):
+            self.use_array(np.load(data_path), index, layer_index)
+
+    def use_array(self, data, index, layer_index):
+        """改用内存中的采样数组（未能映射缓存时）；索引最后替换，读取方不会看到新索引配旧数组"""
+        self.data = data
+        self.channels = data.shape[1]
+        self.mmap = None
+        self.from_cache = False
+        self.index = index
+        self.layer_index = layer_index
+
+    @staticmethod
+    def assemble(keys, written, decoded, partial, header, total, channels, index, layer_index):
+        """
+        缓存写入失败时在内存中拼接：前 written 个音符已写入文件 partial，从文件读回，
+        其余音符逐个放入、逐个释放，峰值内存不超过解码结果本身。
+        """
+        data = np.zeros((total, channels), dtype=np.int16)
+        if written:
+            frames = total if written == len(keys) else (layer_index.get(keys[written]) or index[keys[written]])[0]
+            data[:frames] = np.memmap(partial, dtype='<i2', mode='r', offset=header, shape=(frames, channels))
+        for key in keys[written:]:
+            offset, length = layer_index[key] if isinstance(key, tuple) else index[key]
+            data[offset:offset + length] = decoded.pop(key)
+        if partial.endswith('.tmp'):
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+        return data
+
+    def load_cache(self, signature):
+        data_path, index_path = self.cache_paths(signature)
+        try:
+            with open(index_path) as f:
+                meta = json.load(f)
+            # 自行映射而非 np.load(mmap_mode='r')，以便对映射调用 madvise
+            with open(data_path, 'rb') as f:
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+                offset = f.tell()
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            data = np.ndarray(shape, dtype=dtype, buffer=mapping, offset=offset,
+                              order='F' if fortran_order else 'C')
+        except (OSError, ValueError, TypeError):
+            return False
+        self.data = data
+        self.mmap = mapping
+        self.data_offset = offset
+        self.channels = data.shape[1]
+        self.index = {int(midi): tuple(entry) for midi, entry in meta['index'].items()}
+        self.layer_index = {source_key(key): tuple(entry) for key, entry in meta.get('layers', {}).items()}
+        self.from_cache = True
+        return True
+
+    @property
+    def mapped(self):
+        """采样数据是否为内存映射（页面由操作系统按需换入换出）"""
+        return self.mmap is not None
+
+    # ---- 页面常驻 ----
+    def page_spans(self, midi):
+        """音符基础层与各力度层在缓存文件中的字节范围 [(起, 止)]，未映射时为空"""
+        if self.mmap is None:
+            return []
+        frame = self.channels * self.data.itemsize
+        entries = [self.index[midi]] if midi in self.index else []
+        entries += [entry for key, entry in self.layer_index.items() if key[0] == midi]
+        return [(self.data_offset + offset * frame, self.data_offset + (offset + length) * frame)
+                for offset, length in entries]
+
+    def resident_size(self, midi):
+        """音符全部页面换入后占用的字节数（按页向外取整）"""
+        page = mmap.PAGESIZE
+        return sum((end + page - 1) // page * page - start // page * page for start, end in self.page_spans(midi))
+
+    def fault_in(self, midi):
+        """把音符的页面换入进程（每页读一个字节），音频线程随后读取时不会缺页；返回占用字节数"""
+        page = mmap.PAGESIZE
+        for start, end in self.page_spans(midi):
+            first = start // page * page
+            if hasattr(self.mmap, 'madvise'):
+                self.mmap.madvise(mmap.MADV_WILLNEED, first, end - first)
+            np.frombuffer(self.mmap, dtype=np.uint8, count=end - start, offset=start)[::page].sum()
+        return self.resident_size(midi)
+
+    def release(self, midi):
+        """
+        归还音符的页面：MADV_DONTNEED 把只属于该音符的整页移出进程，再次读取时从文件换入。
+        不支持 madvise 的平台（Windows）上由操作系统自行管理。
+        """
+        if not hasattr(mmap, 'MADV_DONTNEED'):
+            return
+        page = mmap.PAGESIZE
+        for start, end in self.page_spans(midi):
+            # 与相邻音符共用的首尾页保留
+            first = (start + page - 1) // page * page
+            last = end // page * page
+            if last > first:
+                self.mmap.madvise(mmap.MADV_DONTNEED, first, last - first)
+
+
+class SampleResidency:
+    """
+    采样常驻策略（仅用于映射的采样库）。
+
+    活动音程±octave_radius 内的音符预先换入页面（音频线程读取时不会缺页），
+    切换音程时在后台预取相邻音程；常驻总量超过 memory_budget_mb 时按最近最少
+    演奏的顺序淘汰，被淘汰的音符以 MADV_DONTNEED 归还页面，仍可发声，再次演奏时从文件换入。
+    预算按实际换入的页面计算，不复制采样，混音器始终读取映射视图。
+    """
+
+    def __init__(self, bank, octave_radius=1, memory_budget_mb=64):
+        self.bank = bank
+        self.octave_radius = octave_radius
+        self.budget = int(memory_budget_mb * 1024 * 1024)
+        self.resident = OrderedDict()  # MIDI编号 -> 已换入的字节数，按最近演奏排序
+        self.resident_bytes = 0
+        self.window = set()
+        self.lock = Lock()
+        self.loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="SampleResidency")
+
+    def octave_notes(self, octave):
+        """活动音程窗口内、采样库中存在的音符"""
+        low = octave - self.octave_radius
+        high = octave + self.octave_radius
+        return {midi for midi in self.bank.notes() if low <= midi // 12 - 1 <= high}
+
+    def set_active_octave(self, octave):
+        """切换活动音程：后台预取窗口内音符，并按预算淘汰"""
+        # 由近及远预取：活动音程优先，窗口超出预算时只取预算内最近的音符
+        order = self.within_budget(sorted(self.octave_notes(octave), key=lambda midi: abs(midi // 12 - 1 - octave)))
+        with self.lock:
+            self.window = set(order)
+        self.loader.submit(self.prefetch, order)
+
+    def within_budget(self, notes):
+        """按顺序截取总大小不超过预算的音符，避免预取后又立即淘汰刚载入的窗口内音符"""
+        selected = []
+        total = 0
+        for midi in notes:
+            size = self.bank.resident_size(midi)
+            if total + size > self.budget:
+                break
+            selected.append(midi)
+            total += size
+        return selected
+
+    def touch(self, midi):
+        """记录一次演奏；未常驻的音符交给后台加载"""
+        with self.lock:
+            if midi in self.resident:
+                self.resident.move_to_end(midi)
+                return
+        if midi in self.bank:
+            self.loader.submit(self.prefetch, [midi])
+
+    def prefetch(self, notes):
+        for midi in notes:
+            with self.lock:
+                if midi in self.resident:
+                    continue
+            size = self.bank.fault_in(midi)  # 可能读盘，不持锁
+            if not size:
+                continue
+            with self.lock:
+                if midi in self.resident:
+                    continue
+                self.resident[midi] = size
+                self.resident_bytes += size
+            self.evict()
+
+    def evict(self):
+        """超出预算时淘汰最久未演奏的音符，窗口外音符优先；淘汰的音符在锁内归还页面"""
+        with self.lock:
+            for in_window in (False, True):
+                for midi in list(self.resident):
+                    if self.resident_bytes <= self.budget:
+                        break
+                    if (midi in self.window) != in_window:
+                        continue
+                    self.resident_bytes -= self.resident.pop(midi)
+                    self.bank.release(midi)
+
+    def shutdown(self):
+        self.loader.shutdown(wait=False, cancel_futures=True)
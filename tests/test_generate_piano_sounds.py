@@ -0,0 +1,75 @@
+"""音色生成器：SoundFont力度层归一化、逆FFT合成与逐采样合成的一致性"""
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+from scipy.io import wavfile
+
+
+@pytest.fixture(scope='module')
+def gps(tmp_path_factory):
+    """
+    导入音色生成器：测试不渲染SoundFont，fluidsynth 以空模块代替；
+    导入时创建的 sounds 与 ~/tmp 目录放在临时目录中。
+    """
+    home = tmp_path_factory.mktemp('home')
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setitem(sys.modules, 'fluidsynth', types.ModuleType('fluidsynth'))
+        patch.setenv('HOME', str(home))
+        patch.chdir(home)
+        sys.modules.pop('generate_piano_sounds', None)
+        import generate_piano_sounds
+        yield generate_piano_sounds
+        sys.modules.pop('generate_piano_sounds', None)
+
+
+class FakeSynth:
+    """按力度输出不同响度的正弦波，代替 fluidsynth.Synth"""
+
+    def __init__(self):
+        self.velocity = 0
+        self.phase = 0
+
+    def noteon(self, channel, midi, velocity):
+        self.velocity = velocity
+
+    def noteoff(self, channel, midi):
+        self.velocity = 0
+
+    def all_sounds_off(self, channel):
+        self.velocity = 0
+
+    def get_samples(self, frames):
+        t = np.arange(self.phase, self.phase + frames)
+        self.phase += frames
+        wave = np.sin(t * 0.05) * self.velocity * 100
+        return np.repeat(wave, 2).astype(np.int16)
+
+
+def test_soundfont_layers_are_normalized(gps, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('sounds')
+    monkeypatch.setattr(gps, '_soundfont_synth', FakeSynth())
+    monkeypatch.setattr(gps, 'file_format', 'wav')
+    peaks = []
+    for velocity in (40, 120):
+        path = gps.render_soundfont_note((60, velocity))
+        _, data = wavfile.read(path)
+        peaks.append(np.abs(data).max() / 2 ** 31)
+    # 原始响度相差3倍，写出的力度层峰值一致，响度交给混音器的力度曲线
+    assert peaks == pytest.approx([0.9, 0.9], abs=1e-3)
+
+
+def test_check_synthesis_passes(gps, capsys):
+    assert gps.check_synthesis((21, 60, 108))
+    assert "未通过" not in capsys.readouterr().out
+
+
+def test_check_synthesis_detects_mismatch(gps, monkeypatch, capsys):
+    ifft = gps.generate_harmonics_ifft
+    # 逆FFT结果整体偏差0.1%：谱差仍小，但信噪比只有60dB
+    monkeypatch.setattr(gps, 'generate_harmonics_ifft', lambda *args: ifft(*args) * 1.001)
+    assert not gps.check_synthesis((60,))
+    assert "未通过" in capsys.readouterr().out
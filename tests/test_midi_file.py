@@ -0,0 +1,118 @@
+"""标准MIDI文件导出/导入：往返、文件类型0/1、速度表与损坏文件"""
+import struct
+
+import numpy as np
+import pytest
+
+from midi_file import (DEFAULT_TICKS_PER_BEAT, END_OF_TRACK, MidiFileError, _chunk, _tempo_meta,
+                       iter_midi_events, read_midi_file, write_midi_file)
+from mixer import CC_SUSTAIN
+from recording import EVENT_CONTROL, EVENT_DTYPE, EVENT_NOTE_OFF, EVENT_NOTE_ON
+
+
+def make_events(rows, source=0):
+    events = np.zeros(len(rows), dtype=EVENT_DTYPE)
+    for i, (time_ns, note, velocity, kind) in enumerate(rows):
+        events[i] = (time_ns, note, velocity, kind, source)
+    return events
+
+
+def write_raw(path, tracks, file_type=1, division=DEFAULT_TICKS_PER_BEAT, extra=b''):
+    header = _chunk(b'MThd', struct.pack('>HHH', file_type, len(tracks), division))
+    path.write_bytes(header + extra + b''.join(_chunk(b'MTrk', track) for track in tracks))
+    return path
+
+
+EVENTS = make_events([
+    (0, 60, 100, EVENT_NOTE_ON),
+    (250_000_000, CC_SUSTAIN, 127, EVENT_CONTROL),
+    (500_000_000, 60, 0, EVENT_NOTE_OFF),
+    (500_000_000, 64, 80, EVENT_NOTE_ON),
+    (1_500_000_000, 64, 0, EVENT_NOTE_OFF),
+    (1_750_000_000, CC_SUSTAIN, 0, EVENT_CONTROL),
+])
+
+
+@pytest.mark.parametrize('file_type', [0, 1])
+def test_round_trip(tmp_path, file_type):
+    path = tmp_path / 'take.mid'
+    write_midi_file(path, EVENTS, file_type=file_type)
+    events = read_midi_file(path)
+    assert np.array_equal(events['note'], EVENTS['note'])
+    assert np.array_equal(events['type'], EVENTS['type'])
+    on = events['type'] != EVENT_NOTE_OFF
+    assert np.array_equal(events['velocity'][on], EVENTS['velocity'][on])
+    # 120 BPM、480 tick/拍时一个tick约1.04ms
+    assert np.abs(events['time_ns'] - EVENTS['time_ns']).max() < 1_100_000
+
+
+def test_sources_round_trip_as_channels(tmp_path):
+    # 两个输入端口的录音：来源序号导出为MIDI通道，导入后还原
+    events = np.concatenate((make_events([(0, 60, 90, EVENT_NOTE_ON), (500_000_000, 60, 0, EVENT_NOTE_OFF)]),
+                             make_events([(250_000_000, 67, 70, EVENT_NOTE_ON)], source=1)))
+    path = tmp_path / 'ports.mid'
+    write_midi_file(path, events)
+    assert path.read_bytes().count(b'\x91\x43\x46') == 1
+    imported = read_midi_file(path)
+    assert imported['source'].tolist() == [0, 1, 0]
+    assert imported['note'].tolist() == [60, 67, 60]
+
+
+def test_chunks_are_in_order(tmp_path):
+    path = tmp_path / 'take.mid'
+    write_midi_file(path, EVENTS)
+    chunks = list(iter_midi_events(path, chunk_events=4))
+    assert [len(chunk) for chunk in chunks] == [4, 2]
+    assert np.array_equal(np.concatenate(chunks), read_midi_file(path))
+
+
+def test_tempo_map(tmp_path):
+    # 第0拍120 BPM，第1拍起60 BPM；第2拍处的音符应在 0.5s + 1s
+    notes = (b'\x00\x90\x3c\x40'
+             b'\x83\x60\xff\x51\x03\x0f\x42\x40'
+             b'\x83\x60\x80\x3c\x40')
+    path = write_raw(tmp_path / 'tempo.mid', [_tempo_meta(500000) + END_OF_TRACK, notes + END_OF_TRACK])
+    events = read_midi_file(path)
+    assert events['time_ns'].tolist() == [0, 1_500_000_000]
+
+
+def test_running_status_and_zero_velocity_note_on(tmp_path):
+    path = write_raw(tmp_path / 'running.mid', [b'\x00\x90\x3c\x40\x60\x3c\x00' + END_OF_TRACK], file_type=0)
+    events = read_midi_file(path)
+    assert events['type'].tolist() == [EVENT_NOTE_ON, EVENT_NOTE_OFF]
+    assert events['time_ns'][1] == 96 * 500000 * 1000 // DEFAULT_TICKS_PER_BEAT
+
+
+def test_unknown_chunk_is_skipped(tmp_path):
+    tracks = [_tempo_meta(500000) + END_OF_TRACK, b'\x00\x90\x3c\x40' + END_OF_TRACK]
+    path = write_raw(tmp_path / 'extra.mid', tracks, extra=_chunk(b'XFIH', b'vendor data'))
+    assert read_midi_file(path)['note'].tolist() == [60]
+
+
+def test_empty_file_has_no_events(tmp_path):
+    path = write_raw(tmp_path / 'empty.mid', [END_OF_TRACK], file_type=0)
+    assert len(read_midi_file(path)) == 0
+
+
+@pytest.mark.parametrize('payload', [
+    b'\x00\x90\xc8\x40',  # 数据字节带最高位（音符200）
+    b'\x00\x90\x3c\xff',
+    b'\x00\x90\x3c',  # 截断的note on
+    b'\x00\xff\x51\x03\x07',  # 截断的meta事件
+    b'\x80\x80\x80\x80\x00\x90\x3c\x40',  # 超过4字节的变长数
+    b'\x00\x3c\x40',  # 没有运行状态时缺少状态字节
+])
+def test_corrupt_track_raises(tmp_path, payload):
+    path = write_raw(tmp_path / 'bad.mid', [payload], file_type=0)
+    with pytest.raises(MidiFileError):
+        read_midi_file(path)
+
+
+def test_truncated_header_raises(tmp_path):
+    path = tmp_path / 'short.mid'
+    path.write_bytes(b'MThd\x00\x00\x00\x06\x00')
+    with pytest.raises(MidiFileError):
+        read_midi_file(path)
+    path.write_bytes(b'RIFF')
+    with pytest.raises(MidiFileError):
+        read_midi_file(path)
@@ -0,0 +1,52 @@
+"""MIDI输入时间戳：由rtmidi消息间隔推算的设备时刻应始终贴近单调时钟"""
+import midi_input
+from midi_input import MAX_CLOCK_LAG_NS, MidiInputQueue, MidiSource
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000_000
+
+    def __call__(self):
+        return self.now
+
+
+def stamps(monkeypatch, deltas_ns, rate):
+    """真实时间按 deltas_ns 前进，设备报告的间隔为其 rate 倍，返回 (时间戳, 当时的单调时刻) 列表"""
+    clock = FakeClock()
+    monkeypatch.setattr(midi_input.time, 'monotonic_ns', clock)
+    state = MidiSource(None, 0, 16)
+    result = [(MidiInputQueue.timestamp(state, 0.0), clock.now)]
+    for delta in deltas_ns:
+        clock.now += delta
+        result.append((MidiInputQueue.timestamp(state, delta * rate / 1e9), clock.now))
+    return result
+
+
+def test_slow_device_clock_does_not_drift(monkeypatch):
+    # 设备时钟慢1%，一分钟后误差会累积到600ms
+    result = stamps(monkeypatch, [10_000_000] * 6000, 0.99)
+    assert all(0 <= now - stamp <= MAX_CLOCK_LAG_NS for stamp, now in result)
+    times = [stamp for stamp, _ in result]
+    assert times == sorted(times)
+
+
+def test_accurate_clock_is_unchanged(monkeypatch):
+    result = stamps(monkeypatch, [3_000_000, 1_000_000, 4_000_000], 1.0)
+    assert all(stamp == now for stamp, now in result)
+
+
+def test_fast_device_clock_reanchors(monkeypatch):
+    result = stamps(monkeypatch, [10_000_000] * 10, 1.5)
+    assert all(stamp == now for stamp, now in result)
+
+
+def test_drain_keeps_port_identity():
+    queue = MidiInputQueue()
+    queue.push([0x90, 60, 100], time_ns=10, source='keyboard A')
+    queue.push([0x90, 64, 90], time_ns=5, source='keyboard B')
+    queue.push([0x80, 60, 0], time_ns=20, source='keyboard A')
+    events, sources = queue.drain()
+    assert events['note'].tolist() == [64, 60, 60]
+    assert [queue.keys[index] for index in sources] == ['keyboard B', 'keyboard A', 'keyboard A']
+    assert events['source'].tolist() == sources.tolist()
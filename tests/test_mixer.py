@@ -0,0 +1,37 @@
+"""混音器：音符状态表与踏板在音频线程中的行为"""
+import numpy as np
+
+from mixer import CC_SUSTAIN, CMD_NOTE_OFF, CMD_NOTE_ON, Mixer
+
+
+def make_mixer():
+    mixer = Mixer(max_voices=4)
+    for note in (60, 64):
+        mixer.set_sample(note, np.full((48000, 2), 0.5, dtype=np.float32))
+    return mixer
+
+
+def test_out_of_range_notes_are_ignored():
+    mixer = make_mixer()
+    for note in (-1, 128, 200):
+        mixer.note_on(note, 100)
+        mixer.note_off(note)
+    # 绕过公开接口直接进入命令队列的音符也不能让音频线程抛出异常
+    mixer.commands.extend([(CMD_NOTE_ON, 200, 100), (CMD_NOTE_OFF, 255, 0)])
+    mixer.note_on(60, 100)
+    mixer.render(256)
+    assert mixer.held_notes() == [60]
+    assert mixer.active_voices == 1
+
+
+def test_sustain_defers_release():
+    mixer = make_mixer()
+    mixer.control_change(CC_SUSTAIN, 127)
+    mixer.note_on(60, 100)
+    mixer.note_off(60)
+    mixer.render(256)
+    assert mixer.sustained_notes() == [60]
+    mixer.control_change(CC_SUSTAIN, 0)
+    mixer.render(256)
+    assert mixer.sustained_notes() == []
+    assert all(voice.releasing for voice in mixer.voices if voice.active)
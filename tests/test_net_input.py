@@ -0,0 +1,117 @@
+"""本机网络输入：MIDI字节切分、OSC解码，以及经本机回环的 UDP/OSC/WebSocket 往返"""
+import asyncio
+import os
+import socket
+import struct
+import time
+
+import pytest
+
+from midi_input import MidiInputQueue
+from mixer import CC_SUSTAIN
+from net_input import (InputDecodeError, NetInputServer, decode_osc, decode_osc_midi, encode_osc,
+                       split_midi_bytes, websocket_accept)
+from recording import EVENT_CONTROL, EVENT_NOTE_OFF, EVENT_NOTE_ON
+
+
+# ---- 字节流与OSC ----
+def test_running_status():
+    assert split_midi_bytes(bytes([0x90, 60, 100, 62, 90, 64, 0])) == [[0x90, 60, 100], [62, 90], [64, 0]]
+    # 两字节的通道消息（音色切换）同样可以省略状态字节
+    assert split_midi_bytes(bytes([0xC0, 5, 6])) == [[0xC0, 5], [6]]
+
+
+def test_sysex_is_skipped():
+    data = bytes([0xF0, 0x7E, 0x7F, 0x06, 0x01, 0xF7, 0x90, 60, 1])
+    assert split_midi_bytes(data) == [[0x90, 60, 1]]
+    # 未以0xF7结束的系统独占被下一个状态字节终止
+    assert split_midi_bytes(bytes([0xF0, 1, 2, 0x80, 60, 0])) == [[0x80, 60, 0]]
+
+
+def test_realtime_bytes_interleave():
+    assert split_midi_bytes(bytes([0x90, 0xF8, 60, 0xFE, 100])) == [[0xF8], [0xFE], [0x90, 60, 100]]
+
+
+def osc_bundle(*messages):
+    data = b'#bundle\0' + struct.pack('>Q', 1)
+    for message in messages:
+        data += struct.pack('>i', len(message)) + message
+    return data
+
+
+def test_osc_bundle():
+    inner = osc_bundle(encode_osc('/note_off', 60))
+    data = osc_bundle(encode_osc('/note', 60, 100), encode_osc('/sustain', 1.0), inner)
+    assert decode_osc_midi(data) == [[0x90, 60, 100], [0xB0, CC_SUSTAIN, 127], [0x80, 60, 0]]
+
+
+def test_osc_midi_blob():
+    assert decode_osc(encode_osc('/midi', bytes([0x90, 60, 100]))) == [('/midi', [bytes([0x90, 60, 100])])]
+    assert decode_osc_midi(encode_osc('/midi', bytes([0x90, 60, 100, 62, 0]))) == [[0x90, 60, 100], [62, 0]]
+
+
+def test_malformed_osc_raises():
+    with pytest.raises(InputDecodeError):
+        decode_osc(b'/note\0\0\0,x\0\0')
+
+
+# ---- 本机回环往返 ----
+@pytest.fixture
+def server():
+    queue = MidiInputQueue()
+    server = NetInputServer(queue, udp_port=0, osc_port=0, websocket_port=0).start()
+    assert set(server.addresses) == {'udp', 'osc', 'websocket'}
+    yield server
+    server.stop()
+
+
+def drain_until(queue, count, timeout=5.0):
+    events, sources = [], []
+    deadline = time.monotonic() + timeout
+    while len(events) < count and time.monotonic() < deadline:
+        batch, batch_sources = queue.drain()
+        events += batch.tolist()
+        sources += [queue.keys[index] for index in batch_sources.tolist()]
+        time.sleep(0.005)
+    return events, sources
+
+
+def masked_frame(opcode, payload):
+    mask = os.urandom(4)
+    masked = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+    return struct.pack('>BB', 0x80 | opcode, 0x80 | len(payload)) + mask + masked
+
+
+async def websocket_send(host, port, payload):
+    reader, writer = await asyncio.open_connection(host, port)
+    key = 'dGhlIHNhbXBsZSBub25jZQ=='
+    writer.write((f'GET / HTTP/1.1\r\nHost: {host}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                  f'Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n').encode())
+    response = await reader.readuntil(b'\r\n\r\n')
+    assert response.startswith(b'HTTP/1.1 101')
+    assert websocket_accept(key).encode() in response
+    writer.write(masked_frame(0x1, payload))
+    writer.write(masked_frame(0x8, b'\x03\xe8'))
+    await writer.drain()
+    await reader.read()  # 等待服务器回应关闭帧并断开
+    writer.close()
+
+
+def test_localhost_round_trip(server):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.sendto(bytes([0x90, 60, 100, 60, 0]), server.addresses['udp'])
+        sock.sendto(encode_osc('/note', 64, 90), server.addresses['osc'])
+        sock.sendto(encode_osc('/sustain', 127), server.addresses['osc'])
+    asyncio.run(websocket_send(*server.addresses['websocket'], b'[{"note": 67, "velocity": 80}, {"cc": 64}]'))
+
+    events, sources = drain_until(server.queue, 6)
+    received = sorted((source, event[1], event[2], event[3]) for event, source in zip(events, sources))
+    assert received == sorted([
+        ('udp', 60, 100, EVENT_NOTE_ON),
+        ('udp', 60, 0, EVENT_NOTE_OFF),
+        ('osc', 64, 90, EVENT_NOTE_ON),
+        ('osc', CC_SUSTAIN, 127, EVENT_CONTROL),
+        ('websocket', 67, 80, EVENT_NOTE_ON),
+        ('websocket', CC_SUSTAIN, 0, EVENT_CONTROL),
+    ])
+    assert server.errors == 0
@@ -0,0 +1,103 @@
+"""界面启动：混音引擎后端且存在采样库时（冷/热缓存）构造 PianoWidget 不应出错"""
+import os
+import time
+import wave
+
+import numpy as np
+import pytest
+
+# 缺少系统音频库（如libpulse）时 QtMultimedia 无法导入
+pytest.importorskip('PySide6.QtMultimedia', exc_type=ImportError)
+
+from PySide6.QtWidgets import QApplication
+
+import pianist
+from audio_engine import AudioEngine
+from sample_bank import SampleBank
+
+CONFIG = {
+    'volume': 0.5,
+    'file_format': 'wav',
+    'keymap': 'keymap.json',
+    'audio_backend': 'mixer',
+    'keyboard_renderer': 'painted',
+}
+
+
+@pytest.fixture
+def app():
+    return QApplication.instance() or QApplication([])
+
+
+@pytest.fixture
+def sound_dir(tmp_path, monkeypatch):
+    """在临时目录中写入几个短采样，并假装存在可用输出设备（不启动音频线程）"""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('sounds')
+    for note in ('A0', 'C4', 'C#4'):
+        with wave.open(os.path.join('sounds', f'{note}.wav'), 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(48000)
+            f.writeframes((np.sin(np.arange(4800) * 0.05) * 8000).astype('<i2').tobytes())
+    monkeypatch.setattr(AudioEngine, 'available', property(lambda self: True))
+    monkeypatch.setattr(AudioEngine, 'start', lambda self: True)
+    return tmp_path
+
+
+def make_widget():
+    widget = pianist.PianoWidget(config=dict(CONFIG))
+    assert widget.audio_engine is not None
+    assert widget.sample_bank is not None
+    assert widget.key_items[60] is not None
+    return widget
+
+
+def test_cold_cache(app, sound_dir):
+    widget = make_widget()
+    # 后台解码完成后切换为映射的缓存，琴键随之启用
+    deadline = time.monotonic() + 60
+    while not widget.sample_bank.mapped and time.monotonic() < deadline:
+        app.processEvents()
+        time.sleep(0.01)
+    app.processEvents()
+    assert widget.sample_bank.mapped
+    assert not widget.key_items[60].loading
+    widget.cleanup()
+
+
+def test_warm_cache(app, sound_dir):
+    SampleBank('sounds', 48000, 'wav').load()
+    widget = make_widget()
+    assert widget.sample_bank.mapped
+    assert widget.audio_engine.has_sample(60)
+    assert not widget.key_items[60].loading
+    widget.cleanup()
+
+
+def test_stale_loader_is_ignored(app, sound_dir):
+    SampleBank('sounds', 48000, 'wav').load()
+    widget = make_widget()
+    mixer = widget.audio_engine.mixer
+    current = mixer.samples[60][0]
+    # 重新加载（如切换格式）后，旧采样库的解码线程仍可能回调
+    stale = SampleBank('sounds', 48000, 'wav')
+    widget.on_sample_decoded(stale, 60, np.zeros((10, 2), dtype=np.int16))
+    assert mixer.samples[60][0] is current
+    widget.on_sample_decoded(widget.sample_bank, 60, np.zeros((10, 2), dtype=np.int16))
+    assert len(mixer.samples[60][0]) == 10
+    widget.cleanup()
+
+
+def test_recording_keeps_midi_port(app, sound_dir):
+    widget = make_widget()
+    widget.toggle_recording()
+    widget.midi_input.push([0x90, 60, 100], source='keyboard A')
+    widget.midi_input.push([0x90, 64, 90], source='keyboard B')
+    widget.drain_midi_input()
+    widget.toggle_recording()
+    events = widget.record_log.view()
+    assert events['note'].tolist() == [60, 64]
+    assert events['source'].tolist() == [widget.midi_input.keys.index('keyboard A'),
+                                         widget.midi_input.keys.index('keyboard B')]
+    widget.cleanup()
@@ -0,0 +1,137 @@
+"""采样库：冷启动写入缓存、缓存映射、按音符换入/归还页面与常驻预算"""
+import os
+import signal
+import wave
+
+import numpy as np
+import pytest
+
+from mixer import decode_audio_file
+from note_tables import MIDI_TO_NOTE
+from sample_bank import SampleBank, SampleResidency
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+FRAMES = 24000  # 每个采样0.5s立体声，约94KB
+
+
+def write_note(path, seed, frames=FRAMES, channels=2):
+    data = np.random.default_rng(seed).integers(-20000, 20000, (frames, channels), dtype=np.int16)
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(48000)
+        f.writeframes(data.astype('<i2').tobytes())
+    return data
+
+
+@pytest.fixture
+def sounds(tmp_path):
+    directory = tmp_path / 'sounds'
+    directory.mkdir()
+    expected = {midi: write_note(directory / f'{MIDI_TO_NOTE[midi]}.wav', midi) for midi in range(48, 84)}
+    expected[(60, 40)] = write_note(directory / 'C4_v40.wav', 1000)
+    return str(directory), expected
+
+
+def mapped_bank(directory):
+    SampleBank(directory, 48000, 'wav').load()
+    bank = SampleBank(directory, 48000, 'wav')
+    assert bank.load_cached()
+    assert bank.mapped
+    return bank
+
+
+def test_cache_round_trip(sounds):
+    directory, expected = sounds
+    bank = mapped_bank(directory)
+    for midi in range(48, 84):
+        assert np.array_equal(bank.get(midi), expected[midi])
+    assert np.array_equal(bank.layers(60)[40], expected[(60, 40)])
+    assert not bank.get(60).flags.writeable
+
+
+def decoded_bank(directory):
+    """已解码、尚未写入缓存的采样库"""
+    bank = SampleBank(directory, 48000, 'wav')
+    sources = bank.find_sources()
+    for key, path in sources.items():
+        bank.loaded[key] = decode_audio_file(path, 48000)
+    return bank, bank.signature(sources)
+
+
+def test_store_writes_notes_one_by_one(sounds):
+    directory, expected = sounds
+    # 单声道音符与立体声混存时复制到两个声道
+    expected[50] = write_note(os.path.join(directory, 'D3.wav'), 50, channels=1)
+    bank, signature = decoded_bank(directory)
+    bank.store(signature)
+    assert bank.mapped
+    assert bank.loaded == {}
+    assert np.array_equal(bank.get(50), np.repeat(expected[50], 2, axis=1))
+    assert np.array_equal(bank.get(83), expected[83])
+    assert np.array_equal(bank.layers(60)[40], expected[(60, 40)])
+
+
+@pytest.mark.skipif(resource is None, reason="需要 RLIMIT_FSIZE")
+@pytest.mark.parametrize('limit', [0, 1_000_000])
+def test_store_falls_back_to_memory(sounds, limit, capsys):
+    directory, expected = sounds
+    bank, signature = decoded_bank(directory)
+    # 文件大小上限使缓存在写入中途失败（EFBIG），已写入的部分应从临时文件读回；
+    # capsys 在内存中捕获输出，不受文件大小上限影响
+    previous = signal.signal(signal.SIGXFSZ, signal.SIG_IGN)
+    soft, hard = resource.getrlimit(resource.RLIMIT_FSIZE)
+    resource.setrlimit(resource.RLIMIT_FSIZE, (limit, hard))
+    try:
+        bank.store(signature)
+    finally:
+        resource.setrlimit(resource.RLIMIT_FSIZE, (soft, hard))
+        signal.signal(signal.SIGXFSZ, previous)
+    assert "采样缓存写入失败" in capsys.readouterr().out
+    assert not bank.mapped
+    assert bank.loaded == {}
+    for midi in range(48, 84):
+        assert np.array_equal(bank.get(midi), expected[midi])
+    assert np.array_equal(bank.layers(60)[40], expected[(60, 40)])
+    assert not any(name.endswith('.tmp') for name in os.listdir(bank.cache_dir))
+
+
+def test_page_spans_cover_layers(sounds):
+    directory, _ = sounds
+    bank = mapped_bank(directory)
+    assert len(bank.page_spans(60)) == 2
+    assert len(bank.page_spans(61)) == 1
+    assert bank.resident_size(61) >= FRAMES * 4
+
+
+def test_release_keeps_samples_playable(sounds):
+    directory, expected = sounds
+    bank = mapped_bank(directory)
+    assert bank.fault_in(60) == bank.resident_size(60)
+    bank.release(60)
+    # 归还的页面再次读取时从文件换入，内容不变
+    assert np.array_equal(bank.get(60), expected[60])
+    assert np.array_equal(bank.get(61), expected[61])
+
+
+def test_residency_stays_within_budget(sounds):
+    directory, expected = sounds
+    bank = mapped_bank(directory)
+    residency = SampleResidency(bank, octave_radius=0, memory_budget_mb=1)
+    try:
+        window = residency.within_budget(sorted(residency.octave_notes(4)))
+        residency.window = set(window)
+        residency.prefetch(window)
+        residency.prefetch(list(range(48, 84)))
+        assert 0 < residency.resident_bytes <= residency.budget
+        assert residency.resident_bytes == sum(residency.resident.values())
+        # 窗口外的音符先被淘汰
+        assert set(window) <= set(residency.resident)
+        for midi in range(48, 84):
+            assert np.array_equal(bank.get(midi), expected[midi])
+    finally:
+        residency.shutdown()